@@ -0,0 +1,102 @@
+"""
+Benchmark: streaming GUID extraction vs. reply.json() on CC v3 pages.
+
+Builds a realistic 5000-record /v3/apps page and compares CPU time and
+peak (tracemalloc) memory of decoding the whole page against the
+incremental json_stream extraction.
+
+Usage: python benchmarks/bench_json_stream.py [records] [repeat]
+"""
+import json
+import os
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import json_stream  # noqa: E402
+
+CHUNK_SIZE = 64 * 1024
+
+
+def v3_app(index):
+    """
+    One /v3/apps resource shaped like a real Cloud Controller record.
+    """
+    guid = str(uuid.uuid4())
+    space = str(uuid.uuid4())
+    base = 'https://api.sys.foundation.example.com/v3'
+    return {
+        'guid': guid,
+        'created_at': '2018-05-01T12:00:00Z',
+        'updated_at': '2018-05-02T12:00:00Z',
+        'name': 'app-{:05d}'.format(index),
+        'state': 'STARTED',
+        'lifecycle': {'type': 'buildpack',
+                      'data': {'buildpacks': ['python_buildpack'],
+                               'stack': 'cflinuxfs2'}},
+        'relationships': {'space': {'data': {'guid': space}}},
+        'metadata': {'labels': {}, 'annotations': {}},
+        'links': {name: {'href': '{}/apps/{}/{}'.format(base, guid, name)}
+                  for name in ('self', 'environment_variables', 'space',
+                               'processes', 'packages', 'current_droplet',
+                               'droplets', 'tasks', 'features', 'revisions',
+                               'deployed_revisions')},
+    }
+
+
+def v3_page(records):
+    return json.dumps({
+        'pagination': {'total_results': records, 'total_pages': 1,
+                       'first': {'href': 'first'}, 'last': {'href': 'last'},
+                       'next': None, 'previous': None},
+        'resources': [v3_app(i) for i in range(records)],
+    }).encode('utf-8')
+
+
+def chunked(body):
+    for start in range(0, len(body), CHUNK_SIZE):
+        yield body[start:start + CHUNK_SIZE]
+
+
+def full_decode(body):
+    page = json.loads(body.decode('utf-8'))
+    return [res['guid'] for res in page['resources']]
+
+
+def stream_decode(body):
+    _, records = json_stream.extract_page(chunked(body))
+    return [rec['guid'] for rec in records]
+
+
+def measure(func, body, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.process_time()
+        func(body)
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    tracemalloc.start()
+    func(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    body = v3_page(records)
+    assert full_decode(body) == stream_decode(body)
+    print("page: {} records, {:.1f} KiB".format(records, len(body) / 1024))
+    for name, func in (('reply.json()', full_decode),
+                       ('json_stream', stream_decode)):
+        cpu, peak = measure(func, body, repeat)
+        print("{:14s} cpu {:8.2f} ms   peak {:8.1f} KiB"
+              .format(name, cpu * 1000, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
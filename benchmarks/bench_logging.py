@@ -0,0 +1,90 @@
+"""
+Benchmark: logging overhead inside the StatsDB.row_to_dict row loop.
+
+Compares, per converted row:
+  * debug disabled, unguarded calls (the previous row_to_dict)
+  * debug disabled, level guarded (the current row_to_dict)
+  * debug enabled, synchronous handler on a slow (back-pressured) stream
+  * debug enabled, queue handler + background writer on the same stream
+
+Usage: python benchmarks/bench_logging.py [rows]
+"""
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import logger as cf_logger  # noqa: E402
+from statsdb import StatsDB  # noqa: E402
+
+COLUMNS = ['guid', 'name', 'state', 'space_guid', 'updated_at']
+ROW = ('0f5c0e4e-0000-4000-8000-000000000000', 'app', 'STARTED',
+       '1a2b3c4d-0000-4000-8000-000000000000', '2018-05-02T12:00:00Z')
+
+
+class SlowStream(object):
+    """
+    A stdout stand-in whose writes block (releasing the GIL, as a blocked
+    pipe write does), like loggregator back-pressure.
+    """
+    def __init__(self, delay=50e-6):
+        self._delay = delay
+
+    def write(self, _):
+        time.sleep(self._delay)
+
+    def flush(self):
+        pass
+
+
+def unguarded_row_to_dict(row, column_list):
+    """
+    row_to_dict as it was before the level guards.
+    """
+    cf_logger.Logger().logger.debug("Convert query row to dict")
+    if len(row) != len(column_list):
+        rtn = {}
+    else:
+        rtn = dict(zip(column_list, row))
+    cf_logger.Logger().logger.debug("row_to_dict returning dict length %d",
+                                    len(rtn))
+    return rtn
+
+
+def run(func, rows):
+    start = time.perf_counter()
+    for _ in range(rows):
+        func(ROW, COLUMNS)
+    return (time.perf_counter() - start) / rows * 1e6
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    log = cf_logger.Logger(level='INFO').logger
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.propagate = False
+
+    results = [('disabled, unguarded', run(unguarded_row_to_dict, rows)),
+               ('disabled, guarded', run(StatsDB.row_to_dict, rows))]
+
+    log.setLevel(logging.DEBUG)
+    for mode in ('sync', 'queue'):
+        handler, listener = cf_logger.make_handler(SlowStream(), mode=mode,
+                                                   queue_size=rows * 2)
+        log.addHandler(handler)
+        results.append(('enabled, {}'.format(mode),
+                        run(StatsDB.row_to_dict, rows)))
+        log.removeHandler(handler)
+        if listener:
+            listener.stop()
+
+    print("{} rows".format(rows))
+    for name, usec in results:
+        print("{:22s} {:8.2f} us/row".format(name, usec))
+
+
+if __name__ == '__main__':
+    main()
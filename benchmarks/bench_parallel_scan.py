@@ -0,0 +1,100 @@
+"""
+Benchmark: StatsDB parallel range scan vs. connection count.
+
+Runs the scan against fake connections whose execute/fetchmany calls
+block for a fixed latency (as a network round trip does), to show how
+throughput scales with DB_SCAN_CONNECTIONS.  Point it at a real database
+by exporting MYSQL_* and passing --live.
+
+Usage: python benchmarks/bench_parallel_scan.py [rows] [--live]
+"""
+import bisect
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault('OAUTH_CLIENT_ID', 'bench')
+os.environ.setdefault('OAUTH_CLIENT_SECRET', 'bench')
+os.environ.setdefault('FOUNDATION', 'bench')
+os.environ.setdefault('CC_URL', 'https://bench')
+for _key in ('MYSQL_USER', 'MYSQL_PASSWORD', 'MYSQL_HOST', 'MYSQL_CF_DATABASE'):
+    os.environ.setdefault(_key, 'bench')
+
+import constants  # noqa: E402
+import statsdb  # noqa: E402
+from statsdb import StatsDB  # noqa: E402
+
+LATENCY = 0.05      # seconds per round trip
+
+
+class FakeCursor(object):
+    def __init__(self, guids):
+        self._guids = guids
+        self._rows = []
+
+    def execute(self, sql, args=()):
+        time.sleep(LATENCY)
+        lower, upper = None, None
+        args = list(args)
+        if '>=' in sql:
+            lower = args.pop(0)
+        if '<' in sql.replace('>=', ''):
+            upper = args.pop(0)
+        start = 0 if lower is None else bisect.bisect_left(self._guids, lower)
+        end = len(self._guids) if upper is None else \
+            bisect.bisect_left(self._guids, upper)
+        self._rows = [(g,) for g in self._guids[start:end]]
+
+    def fetchmany(self, size):
+        time.sleep(LATENCY)
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self, guids):
+        self._guids = guids
+
+    def cursor(self):
+        return FakeCursor(self._guids)
+
+    def close(self):
+        pass
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 and sys.argv[1].isdigit() \
+        else 200000
+    live = '--live' in sys.argv
+    db = StatsDB()
+    if not live:
+        guids = sorted(str(uuid.uuid4()) for _ in range(rows))
+        db._new_connection = lambda: FakeConnection(guids)
+    baseline = None
+    for connections in (1, 2, 4, 8, 16):
+        start = time.perf_counter()
+        if connections == 1:
+            # the same 16 ranges, read one at a time
+            scan = db._parallel_scan('applications', 'guid',
+                                     statsdb.hex_ranges(16), 1)
+        else:
+            scan = db.guids('applications', connections=connections,
+                            partitions=16)
+        count = sum(1 for _ in scan)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print("{:2d} connections: {} rows in {:.3f}s ({:.1f}x of 1 connection)"
+              .format(connections, count, elapsed, baseline / elapsed))
+    print("fetch batch {} rows, {}".format(
+        constants.DB_FETCH_BATCH, 'live database' if live else
+        'simulated {:.0f} ms round trips'.format(LATENCY * 1000)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""
+Benchmark: persisting a run of discrepancies through ResultsSink.
+
+Needs a reachable MySQL database (MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST,
+MYSQL_CF_DATABASE); the run is written to the cf_diff_runs and
+cf_diff_discrepancies tables under the foundation 'bench' and deleted
+afterwards.
+
+Usage: python benchmarks/bench_results_sink.py [discrepancies]
+"""
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+os.environ.setdefault('OAUTH_CLIENT_ID', 'bench')
+os.environ.setdefault('OAUTH_CLIENT_SECRET', 'bench')
+os.environ.setdefault('FOUNDATION', 'bench')
+os.environ.setdefault('CC_URL', 'https://bench')
+
+import differ  # noqa: E402
+import results_sink  # noqa: E402
+from statsdb import StatsDB  # noqa: E402
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    found = [differ.Discrepancy(str(uuid.uuid4()),
+                                differ.MISSING_IN_DB if i % 3
+                                else differ.MISSING_IN_CC)
+             for i in range(total)]
+    db = StatsDB()
+    start = time.perf_counter()
+    with results_sink.ResultsSink(db, 'bench', 'applications') as sink:
+        for item in found:
+            sink.write(item)
+    elapsed = time.perf_counter() - start
+    print("{} discrepancies persisted in {:.3f}s ({:.0f} rows/s)"
+          .format(total, elapsed, total / elapsed))
+
+    with db.transaction() as cursor:
+        cursor.execute("DELETE FROM {} WHERE run_id = %s"
+                       .format(results_sink.DISCREPANCIES_TABLE),
+                       (sink.run_id,))
+        cursor.execute("DELETE FROM {} WHERE id = %s"
+                       .format(results_sink.RUNS_TABLE), (sink.run_id,))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+"""
+Cold start measurement for scheduled (CF task) runs.
+
+Runs cf_diff in a child interpreter with requests' Session.request
+(which requests.get also goes through) replaced by a probe, so the time
+from process launch to the first Cloud Controller request can be
+measured without any network.  Also captures the
+'python -X importtime' breakdown of importing cf_diff.
+
+Usage: python benchmarks/bench_startup.py [artifact_path]
+(exits non-zero if the first request is over STARTUP_BUDGET_SECONDS)
+"""
+import os
+import subprocess
+import sys
+import time
+
+_HERE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, _HERE)
+
+import constants  # noqa: E402
+
+# Child program: stop at the first outgoing request, reporting which of
+# the lazily imported modules were loaded by then.
+_PROBE = '''
+import os, sys
+import requests
+def _first_request(*args, **kwargs):
+    loaded = [m for m in {lazy!r} if m in sys.modules]
+    sys.stdout.write('FIRST_REQUEST ' + ','.join(loaded) + '\\n')
+    sys.stdout.flush()
+    os._exit(0)
+requests.Session.request = _first_request
+import cf_diff
+cf_diff.main()
+'''
+
+_PROBE_ENV = {'OAUTH_CLIENT_ID': 'id',
+              'OAUTH_CLIENT_SECRET': 'secret',
+              'FOUNDATION': 'foundation',
+              'CC_URL': 'https://api.sys.{foundation}.example.com',
+              'MYSQL_USER': 'user',
+              'MYSQL_PASSWORD': 'password',
+              'MYSQL_HOST': 'localhost',
+              'MYSQL_CF_DATABASE': 'db',
+              'LOG_LEVEL': 'WARNING'}
+
+
+def _child_env():
+    env = dict(os.environ)
+    env.pop('VCAP_SERVICES', None)
+    env.update(_PROBE_ENV)
+    return env
+
+
+def time_to_first_request():
+    """
+    Launch cf_diff and time it until its first HTTP request.
+
+    :return: (seconds, list of lazy modules loaded by then)
+    """
+    probe = _PROBE.format(lazy=constants.LAZY_MODULES)
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', probe], cwd=_HERE,
+                         env=_child_env(), stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, check=False)
+    elapsed = time.perf_counter() - start
+    marker = [line for line in out.stdout.decode().splitlines()
+              if line.startswith('FIRST_REQUEST')]
+    if not marker:
+        raise RuntimeError("cf_diff made no request: {}"
+                           .format(out.stderr.decode()))
+    loaded = marker[0].split(' ', 1)[1]
+    return elapsed, [name for name in loaded.split(',') if name]
+
+
+def import_breakdown():
+    """
+    Return the 'python -X importtime -c "import cf_diff"' report as a list
+    of (self_us, cumulative_us, module) sorted by cumulative time.
+    """
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                          'import cf_diff'], cwd=_HERE, env=_child_env(),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         check=True)
+    rows = []
+    for line in out.stderr.decode().splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        rows.append((int(self_us), int(cumulative_us), module.rstrip()))
+    return sorted(rows, key=lambda row: row[1], reverse=True)
+
+
+def write_report(path):
+    """
+    Measure cold start and write the report (first-request time plus the
+    import breakdown) to path.
+
+    :return: (seconds to first request, lazy modules loaded by then)
+    """
+    elapsed, loaded = time_to_first_request()
+    rows = import_breakdown()
+    with open(path, 'w') as out:
+        out.write("time to first request: {:.3f}s (budget {:.3f}s)\n"
+                  .format(elapsed, constants.STARTUP_BUDGET_SECONDS))
+        out.write("lazy modules loaded before it: {}\n"
+                  .format(', '.join(loaded) or 'none'))
+        out.write("\n{:>10} {:>10}  module\n".format('self[us]', 'cumul[us]'))
+        for self_us, cumulative_us, module in rows:
+            out.write("{:>10} {:>10}  {}\n".format(self_us, cumulative_us,
+                                                   module))
+    return elapsed, loaded
+
+
+if __name__ == '__main__':
+    artifact = sys.argv[1] if len(sys.argv) > 1 else 'importtime_output.txt'
+    seconds, _ = write_report(artifact)
+    print("time to first request {:.3f}s, report in {}".format(seconds,
+                                                                artifact))
+    if seconds >= constants.STARTUP_BUDGET_SECONDS:
+        print("over the {:.3f}s budget".format(constants.STARTUP_BUDGET_SECONDS))
+        sys.exit(1)
@@ -0,0 +1,94 @@
+"""
+General purpose bounded caches.
+
+Note(s):
+    1. Requires Python 3
+"""
+import collections
+import threading
+import time
+
+
+class LRUCache(object):
+    """
+    A thread-safe, size bounded, least-recently-used cache with an
+    optional time-to-live.  Entries older than the TTL are treated as
+    missing; a TTL of zero (or None) disables expiry.
+    """
+    def __init__(self, maxsize=128, ttl=None, clock=time.monotonic):
+        """
+        :param maxsize: maximum number of entries held
+        :param ttl: seconds an entry stays valid (None/0: forever)
+        :param clock: time source (seconds)
+        """
+        self._maxsize = max(int(maxsize), 1)
+        self._ttl = ttl or None
+        self._clock = clock
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expired': 0}
+        super().__init__()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def get(self, key, default=None):
+        """
+        Return the value cached under key, marking it most recently used.
+
+        :param key: cache key
+        :param default: returned when the key is missing or expired
+        """
+        with self._lock:
+            try:
+                stored_at, value = self._data[key]
+            except KeyError:
+                self._stats['misses'] += 1
+                return default
+            if self._ttl and self._clock() - stored_at > self._ttl:
+                del self._data[key]
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats['hits'] += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Cache a value, evicting the least recently used entries if full.
+        """
+        with self._lock:
+            self._data[key] = (self._clock(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self._maxsize:
+                self._data.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def pop(self, key, default=None):
+        """
+        Remove and return a cached value.
+        """
+        with self._lock:
+            try:
+                return self._data.pop(key)[1]
+            except KeyError:
+                return default
+
+    def clear(self):
+        """
+        Drop all entries (statistics are kept).
+        """
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def stats(self):
+        """
+        A snapshot of the hit/miss/eviction counters.
+        """
+        with self._lock:
+            rtn = dict(self._stats)
+            rtn['size'] = len(self._data)
+        return rtn
@@ -3,13 +3,22 @@ Interface to the CloudFoundry Cloud Controller REST API.
 Note(s):
     1. Requires Python 3
 """
-import oauthlib.oauth2
+import collections
+import concurrent.futures
+import random
+import threading
+
 import requests
-import requests_oauthlib
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
+import constants
+import json_stream
+import memory_governor
+from deadline import Deadline, DeadlineExceeded
+from http_cache import ResponseCache
 from logger import Logger
 from parameters import SysParams
+from rate_limiter import AdaptiveLimiter, SlotTimeout, backoff_delay
 
 
 class FailedGetAccessToken(Exception):
@@ -17,16 +26,72 @@ class FailedGetAccessToken(Exception):
     Failed to fetch an access token
     """
 
+class FailedRequest(Exception):
+    """
+    A Cloud Controller request did not succeed
+    """
+
+
+def guid_chunks(guids, room):
+    """
+    Pack GUIDs into comma separated strings of at most room characters
+    (a single GUID longer than room gets a chunk of its own).
+
+    :param guids: iterable of GUIDs
+    :param room: characters available per chunk
+    """
+    chunk, length = [], 0
+    for guid in guids:
+        added = len(guid) + (1 if chunk else 0)
+        if chunk and length + added > room:
+            yield ','.join(chunk)
+            chunk, length = [], 0
+            added = len(guid)
+        chunk.append(guid)
+        length += added
+    if chunk:
+        yield ','.join(chunk)
+
+
 class CCFetcher(object):
     """
     Interface to the CloudFoundry Controller REST API.
     """
-    def __init__(self):
+    # Replies worth retrying (after backoff)
+    _retry_status = frozenset([requests.codes.unauthorized,
+                               requests.codes.too_many_requests,
+                               requests.codes.internal_server_error,
+                               requests.codes.bad_gateway,
+                               requests.codes.service_unavailable,
+                               requests.codes.gateway_timeout])
+    # Request errors worth retrying: timeouts and broken connections
+    _retry_errors = (requests.exceptions.Timeout,
+                     requests.exceptions.ConnectionError,
+                     requests.exceptions.ChunkedEncodingError)
+    # Unlimited, unless a run deadline is given
+    _deadline = Deadline()
+    # The requests module, unless a context provides a session
+    _http = requests
+    # Set up by __init__
+    _cache = None
+
+    def __init__(self, deadline=None, context=None):
         """
         Initialize the CC Fetcher interface.
+
+        :param deadline: run Deadline bounding every request (default: the
+                         context's, or none)
+        :param context: RunContext providing the parameters, logger and
+                        HTTP session (default: the application-wide ones)
         """
-        self.logger = Logger().logger
-        self.params = SysParams()
+        if context is None:
+            self.logger = Logger().logger
+            self.params = SysParams()
+        else:
+            self.logger = context.logger
+            self.params = context.params
+            self._http = context.session
+            deadline = context.deadline if deadline is None else deadline
         self.logger.debug("Initializing CCFetcher")
 
         self._cc_url_format = self.params['CC_URL']
@@ -34,6 +99,21 @@ class CCFetcher(object):
         self._oauth_secret = self.params['OAUTH_CLIENT_SECRET']
         self.logger.debug("CCFetcher %s", self._oauth_id)
         self._access_token = None
+        self._cache = ResponseCache(
+            self.params.get_int('CC_CACHE_SIZE'),
+            self.params.get_float('CC_CACHE_TTL'),
+            directory=self.params['CC_CACHE_DIR'],
+            max_bytes=memory_governor.parse_size(
+                self.params['CC_CACHE_DIR_SIZE']),
+            max_age=self.params.get_float('CC_CACHE_DIR_AGE'),
+            logger=self.logger)
+        self._max_concurrency = self.params.get_int('CC_MAX_CONCURRENCY')
+        self._max_retries = self.params.get_int('CC_MAX_RETRIES')
+        self._limiters = {}
+        self._lock = threading.Lock()
+        if deadline is not None:
+            self._deadline = deadline
+        memory_governor.governor().on_shrink(self._cache.trim_memory)
 
         requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
         super().__init__()
@@ -44,12 +124,15 @@ class CCFetcher(object):
         """
         try:
             cc_url = self._cc_url_format.format(foundation=foundation)
-            cc_reply = requests.get(cc_url, verify=False)
+            cc_reply = self._http.get(cc_url, verify=False,
+                                      timeout=self._timeout())
             if cc_reply.status_code == requests.codes.ok:
                 auth_url = cc_reply.json()['links']['uaa']['href']
                 auth_url = '/'.join([auth_url, "oauth", "token"])
             else:
                 raise FailedGetAccessToken
+        except DeadlineExceeded:
+            raise
         except Exception:
             raise FailedGetAccessToken
         self.logger.debug("Oauth URL %s", auth_url)
@@ -58,19 +141,26 @@ class CCFetcher(object):
     def _get_access_token(self, foundation):
         """
         Get a Cloud Controller access token for this foundation.
+
+        The oauth libraries are only needed here, so they are imported on
+        first use (after the oauth URL request is already on its way).
         """
         try:
             auth_id = self._oauth_id
             oauth_url = None
+            oauth_url = self._get_oauth_url(foundation)
+            import oauthlib.oauth2
+            import requests_oauthlib
             client = oauthlib.oauth2.BackendApplicationClient(client_id=auth_id)
             oauth = requests_oauthlib.OAuth2Session(client=client)
-            oauth_url = self._get_oauth_url(foundation)
             self.logger.debug("Fetching token from %s", oauth_url)
             token = oauth.fetch_token(token_url=oauth_url,
                                       client_id=self._oauth_id,
                                       client_secret=self._oauth_secret,
-                                      verify=False)
+                                      verify=False, timeout=self._timeout())
             access_token = token['access_token']
+        except DeadlineExceeded:
+            raise
         except Exception:
             self.logger.exception("Failed retrieving access token from url %s",
                                   oauth_url or "unknown")
@@ -78,18 +168,154 @@ class CCFetcher(object):
             raise FailedGetAccessToken
         return access_token
 
+    def _timeout(self):
+        """
+        (connect, read) timeouts for one request, within the run deadline.
+
+        :raises DeadlineExceeded: if the deadline has passed
+        """
+        return (self._deadline.timeout(constants.CC_CONNECT_TIMEOUT),
+                self._deadline.timeout(constants.CC_READ_TIMEOUT))
+
     def _header(self, foundation):
         """
         Return the HTTP header including valid access token
         """
-        token = self._access_token or self._get_access_token(foundation)
+        token = self._access_token
+        if not token:
+            with self._lock:
+                token = self._access_token or self._get_access_token(foundation)
+                self._access_token = token
         return {"Authorization": "bearer " + token}
 
-    def _request_app_count(self, foundation, version='v2', _isRetry=False):
+    def _get(self, foundation, url, parse, variant=()):
+        """
+        GET a Cloud Controller URL through the response cache, returning
+        the result parsed from the reply.
+
+        The reply body is streamed into parse (so a page is never held in
+        memory whole) and the reply closed once parsed.  The cache holds
+        parsed results, not replies: a fresh cached result is returned
+        without a request; a stale one is revalidated with a conditional
+        request and reused on a 304.  Requests go through the
+        foundation's adaptive limiter, and throttled (429), unauthorized
+        and 5xx replies, timeouts and broken connections (also while the
+        body streams in) are retried on a backoff schedule, all within the
+        run deadline.
+
+        :param foundation: the name of the foundation
+        :param url: the URL to fetch
+        :param parse: callable(reply) returning the result of a 200 reply
+        :param variant: what else the result depends on (ie: the fields
+                        extracted), part of the cache key
+        :return: the (possibly cached) parsed result
+        :raises FailedRequest: if the reply is not a 200 (or a 304)
+        :raises DeadlineExceeded: if the deadline passes first
+        """
+        cache_key = '\n'.join((url,) + tuple(variant))
+        entry = self._cache.lookup(foundation, cache_key)
+        if entry is not None and self._cache.is_fresh(entry):
+            self.logger.debug("Cache hit %s", url)
+            return self._cache.hit(entry)
+
+        limiter = self._limiter(foundation)
+        for attempt in range(self._max_retries + 1):
+            headers = self._header(foundation)
+            if entry is not None:
+                headers.update(self._cache.conditional_headers(entry))
+            try:
+                # Waits for the slot (ie: out a 429's Retry-After) only if
+                # the deadline allows, and the request is timed once it is
+                # granted, queueing having used up part of the deadline
+                with limiter.slot(self._deadline.remaining()):
+                    reply = self._http.get(url, headers=headers, verify=False,
+                                           stream=True,
+                                           timeout=self._timeout())
+                limiter.observe(reply)
+                if reply.status_code in self._retry_status and \
+                        attempt < self._max_retries:
+                    # Streamed: the connection is only freed once the
+                    # reply closes
+                    reply.close()
+                    if reply.status_code == requests.codes.unauthorized:
+                        self._access_token = None
+                    delay = backoff_delay(attempt)
+                    self.logger.warning("Request %s returned %s, retry in "
+                                        "%.1fs", url, reply.status_code, delay)
+                    self._deadline.sleep(delay)
+                    continue
+                return self._result(foundation, url, cache_key, entry, reply,
+                                    parse)
+            except SlotTimeout as exn:
+                self._deadline.check("requesting {}".format(url))
+                raise DeadlineExceeded("Deadline exceeded before requesting "
+                                       "{}: {}".format(url, str(exn)))
+            except self._retry_errors as exn:
+                # Includes a read timing out while the body streams in,
+                # which requests raises as a ConnectionError
+                self._deadline.check("retrying {}".format(url))
+                if attempt == self._max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                self.logger.warning("Request %s failed (%s), retry in %.1fs",
+                                    url, type(exn).__name__, delay)
+                self._deadline.sleep(delay)
+
+    def _result(self, foundation, url, cache_key, entry, reply, parse):
+        """
+        The result of a (final) reply: the cached value on a 304, else the
+        parsed body of a 200, cached.  The reply is closed.
+
+        :raises FailedRequest: if the reply is not a 200 (or a 304)
+        """
+        try:
+            if entry is not None and \
+                    reply.status_code == requests.codes.not_modified:
+                self.logger.debug("Cache revalidated %s", url)
+                return self._cache.revalidated(foundation, cache_key, entry,
+                                               reply)
+            value = None
+            if reply.status_code == requests.codes.ok:
+                value = parse(reply)
+            self._cache.store(foundation, cache_key, reply, value)
+            if reply.status_code != requests.codes.ok:
+                raise FailedRequest("{} returned {}: {}".format(
+                    url, reply.status_code, reply.text))
+            return value
+        finally:
+            reply.close()
+
+    def _limiter(self, foundation):
+        """
+        Return the (per foundation) adaptive request limiter.
+        """
+        limiter = self._limiters.get(foundation)
+        if limiter is None:
+            with self._lock:
+                limiter = self._limiters.setdefault(foundation, AdaptiveLimiter(
+                    rate=constants.CC_INITIAL_RATE,
+                    concurrency=constants.CC_INITIAL_CONCURRENCY,
+                    max_rate=constants.CC_MAX_RATE,
+                    max_concurrency=self._max_concurrency))
+        return limiter
+
+    @property
+    def cache_stats(self):
+        """
+        Response cache hit/miss counters (None before it is set up).
+        """
+        if self._cache is None:
+            return None
+        return self._cache.stats
+
+    def _request_app_count(self, foundation, version='v2'):
         """
         Send the CloudController request and return only the number of
         'total_results'
 
+        A failure to get an access token is retried (with a fresh token)
+        on a backoff schedule.
+
         :param foundation: the name of the foundation
         """
         command = "apps"
@@ -97,26 +323,29 @@ class CCFetcher(object):
         url = "{}/{}/{}".format(base_url, version, command)
         result = None
         self.logger.debug("Sending request %s", url)
-        try:
-            reply = requests.get(url,
-                                 headers=self._header(foundation),
-                                 verify=False)
-            if reply.status_code == requests.codes.ok:
-                result = reply.json()['total_results']
-            else:
-                self.logger.warn("Request %s/%s failed: %s",
-                                 version, command, reply.text)
-        except FailedGetAccessToken:
-            if _isRetry:
-                self.logger.warn("Request failed, abort %s/%s",
-                                 version, command)
-            else:
-                self.logger.warn("Request failed, refresh token and retry")
-                self._access_token = None
-                result = self._request_app_count(foundation, version=version,
-                                                 _isRetry=True)
-        except Exception as exn:
-            self.logger.warn("Request error: %s", str(exn))
+        for attempt in range(self._max_retries + 1):
+            try:
+                result = self._get(foundation, url,
+                                   lambda reply: reply.json()['total_results'])
+            except FailedRequest as exn:
+                self.logger.warning("Request %s/%s failed: %s",
+                                    version, command, str(exn))
+            except FailedGetAccessToken:
+                if attempt == self._max_retries:
+                    self.logger.warning("Request failed, abort %s/%s",
+                                        version, command)
+                else:
+                    delay = backoff_delay(attempt)
+                    self.logger.warning("Request failed, refresh token and "
+                                        "retry in %.1fs", delay)
+                    self._access_token = None
+                    self._deadline.sleep(delay)
+                    continue
+            except DeadlineExceeded:
+                raise
+            except Exception as exn:
+                self.logger.warning("Request error: %s", str(exn))
+            break
 
         return result
 
@@ -125,3 +354,187 @@ class CCFetcher(object):
         Return the count of the number of (running) applications
         """
         return self._request_app_count(foundation)
+
+    def _next_url(self, base_url, summary):
+        """
+        Return the URL of the next page from a page summary, or None.
+        """
+        next_page = (summary.get('pagination') or {}).get('next')
+        if next_page:
+            return next_page['href']
+        next_url = summary.get('next_url')
+        return base_url + next_url if next_url else None
+
+    def _fetch_page(self, foundation, url, fields):
+        """
+        Fetch and incrementally parse one listing page (see json_stream).
+
+        :return: (page summary, list of slim records)
+        :raises FailedRequest: if the page cannot be fetched
+        """
+        def parse(reply):
+            extractor = json_stream.PageExtractor(
+                reply.iter_content(chunk_size=constants.CC_STREAM_CHUNK),
+                fields=fields)
+            records = list(extractor.records())
+            return extractor.summary, records
+
+        self.logger.debug("Sending request %s", url)
+        try:
+            summary, records = self._get(foundation, url, parse,
+                                         variant=fields)
+        except FailedRequest as exn:
+            self.logger.warning("Request failed: %s", str(exn))
+            raise
+        return summary, records
+
+    def _iter_resources(self, foundation, command, fields=(), version='v3'):
+        """
+        Page through a Cloud Controller listing, yielding slim records.
+
+        Only the GUID and the requested fields of each resource are kept.
+        Once the first v3 page gives the page count the remaining pages are
+        fetched concurrently, as fast as the foundation's limiter allows;
+        otherwise 'next' links are followed one page at a time.
+
+        :param foundation: the name of the foundation
+        :param command: the resource to list (ie: 'apps')
+        :param fields: extra dotted field paths to extract per record
+        :param version: API version
+        :raises FailedRequest: if any page cannot be fetched
+        """
+        base_url = self._cc_url_format.format(foundation=foundation)
+        first_url = "{}/{}/{}?per_page={}".format(base_url, version, command,
+                                                  constants.CC_PAGE_SIZE)
+        summary, records = self._fetch_page(foundation, first_url, fields)
+        yield from records
+
+        total_pages = (summary.get('pagination') or {}).get('total_pages') or 1
+        if total_pages > 1:
+            urls = ["{}&page={}".format(first_url, page)
+                    for page in range(2, total_pages + 1)]
+            yield from self._fetch_pages(foundation, urls, fields)
+            return
+
+        url = self._next_url(base_url, summary)
+        while url:
+            summary, records = self._fetch_page(foundation, url, fields)
+            yield from records
+            url = self._next_url(base_url, summary)
+
+    def _fetch_pages(self, foundation, urls, fields):
+        """
+        Fetch pages concurrently, yielding their records in page order.
+
+        Pages fetched ahead of the caller are held in memory, so how many
+        may be in flight is scaled by the memory governor.
+        """
+        governor = memory_governor.governor()
+        workers = self._limiter(foundation).max_concurrency
+        pending = collections.deque()
+        todo = iter(urls)
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+
+            def submit_more():
+                while len(pending) < governor.scale(workers):
+                    url = next(todo, None)
+                    if url is None:
+                        return
+                    pending.append(pool.submit(self._fetch_page, foundation,
+                                               url, fields))
+
+            try:
+                submit_more()
+                while pending:
+                    _, records = pending.popleft().result()
+                    submit_more()
+                    yield from records
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def app_records(self, foundation, fields=()):
+        """
+        Return a list of {'guid': ..., <field>: ...} dicts, one per application
+
+        :param foundation: the name of the foundation
+        :param fields: extra dotted field paths (ie: 'name', 'state')
+        """
+        return list(self._iter_resources(foundation, 'apps', fields=fields))
+
+    def app_guids(self, foundation):
+        """
+        Return the list of application GUIDs
+        """
+        return [record['guid'] for record in
+                self._iter_resources(foundation, 'apps')]
+
+    def lookup_apps(self, foundation, guids, fields=constants.CC_DETAIL_FIELDS):
+        """
+        Look up many applications by GUID with the v3 'guids' filter.
+
+        The GUIDs are packed into as few requests as the URL length limit
+        (CC_MAX_URL_LENGTH) allows, and the requests are run concurrently
+        as fast as the foundation's limiter allows.
+
+        :param foundation: the name of the foundation
+        :param guids: iterable of application GUIDs
+        :param fields: dotted field paths to extract per application
+        :return: dict of GUID: record, for the applications found
+        :raises FailedRequest: if any lookup cannot be fetched
+        """
+        prefix = "{}/v3/apps?per_page={}&guids=".format(
+            self._cc_url_format.format(foundation=foundation),
+            constants.CC_PAGE_SIZE)
+        urls = [prefix + chunk for chunk in guid_chunks(
+            guids, constants.CC_MAX_URL_LENGTH - len(prefix))]
+        found = {}
+        if not urls:
+            return found
+        workers = min(len(urls), self._limiter(foundation).max_concurrency)
+        with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+            pages = pool.map(lambda url: self._fetch_page(foundation, url,
+                                                          fields), urls)
+            for _, records in pages:
+                found.update((record['guid'], record) for record in records)
+        self.logger.debug("Looked up %d applications in %d requests",
+                          len(found), len(urls))
+        return found
+
+    def existing_app_guids(self, foundation, guids):
+        """
+        Return the subset of guids that exist as applications.
+
+        :param foundation: the name of the foundation
+        :param guids: iterable of application GUIDs
+        :return: set of GUIDs found
+        """
+        return set(self.lookup_apps(foundation, guids, fields=()))
+
+    def sample_app_guids(self, foundation, pages, per_page, rng=random):
+        """
+        Return the application GUIDs on randomly chosen listing pages (a
+        cluster sample of the applications).
+
+        :param foundation: the name of the foundation
+        :param pages: number of pages to sample
+        :param per_page: applications per page
+        :param rng: random number generator
+        :return: list of GUIDs
+        """
+        base_url = self._cc_url_format.format(foundation=foundation)
+        url_fmt = "{}/v3/apps?per_page={}&page={}"
+        summary, first = self._fetch_page(
+            foundation, url_fmt.format(base_url, per_page, 1), ())
+        total_pages = (summary.get('pagination') or {}).get('total_pages') or 1
+        chosen = sorted(rng.sample(range(1, total_pages + 1),
+                                   min(pages, total_pages)))
+        guids = []
+        for page in chosen:
+            if page == 1:
+                records = first
+            else:
+                _, records = self._fetch_page(
+                    foundation, url_fmt.format(base_url, per_page, page), ())
+            guids.extend(record['guid'] for record in records)
+        return guids
@@ -4,13 +4,23 @@ cf-diff tool main
 Note(s):
     1. Requires Python 3
 """
-from sortedcontainers import SortedDict
+import collections
+import contextlib
 
+import differ
+import estimator
+import leases
+import report
 from logger import Logger
 from parameters import SysParams
 from cc_fetcher import CCFetcher
+from context import RunContext
+from deadline import Deadline, DeadlineExceeded
+from results_sink import ResultsSink
 from statsdb import StatsDB
 
+COUNT_SQL = "SELECT COUNT(DISTINCT GUID) FROM applications"
+
 
 def get_counts(foundation, cc_obj, db_obj):
     """
@@ -21,22 +31,248 @@ def get_counts(foundation, cc_obj, db_obj):
     if not cf_count:
         Logger().logger.debug("No count for foundation %s", foundation)
 
-    query_sql = "SELECT COUNT(DISTINCT GUID) FROM applications"
-    db_count = db_obj.query(query_sql).fetchall()[0][0]
+    db_count = db_obj.query(COUNT_SQL).fetchall()[0][0]
     return cf_count, db_count
 
 
+def prepare_db(db_obj):
+    """
+    Provision any missing indices for the diff queries, then check (and
+    warn about) the query plans.
+    """
+    db_obj.ensure_indices()
+    for sql in (COUNT_SQL, db_obj.guids_sql('applications')):
+        try:
+            db_obj.verify_query_plan(sql)
+        except Exception as exn:
+            Logger().logger.warning("Query plan check failed: %s", str(exn))
+
+
+def diff_guids(foundation, cc_obj, db_obj, consumers, details=False,
+               counts=None):
+    """
+    Compare application GUIDs in the Cloud Controller and the database,
+    passing each discrepancy to every consumer as it is found.
+
+    :param consumers: objects with a write(discrepancy) method
+    :param details: look up each discrepant application (in batches) on
+                    the side that has it, see differ.enrich
+    :param counts: Counter to count into (so that the counts so far are
+                   known if the diff is cut short)
+    :return: Counter of discrepancies by kind
+    """
+    counts = collections.Counter() if counts is None else counts
+    # Both sides in the database's GUID order, which may ignore case
+    order = db_obj.guid_order('applications')
+    cc_guids = sorted(cc_obj.app_guids(foundation), key=order)
+    found = differ.diff_sorted(cc_guids, db_obj.guids('applications'),
+                               key=order)
+    if details:
+        found = differ.enrich(
+            found, lambda guids: cc_obj.lookup_apps(foundation, guids),
+            lambda guids: db_obj.lookup('applications', guids))
+    for discrepancy in found:
+        counts[discrepancy.kind] += 1
+        for consumer in consumers:
+            consumer.write(discrepancy)
+    return counts
+
+
+def estimate(foundation, cc_obj, db_obj, cf_count, db_count, context=None):
+    """
+    Estimate the drift from samples and log it.
+
+    :param context: RunContext of the foundation (default: the
+                    application-wide parameters and logger)
+    :return: True if the estimate calls for a full diff
+    """
+    params = SysParams() if context is None else context.params
+    logger = Logger().logger if context is None else context.logger
+    estimates = estimator.estimate_drift(
+        foundation, cc_obj, db_obj, cf_count, db_count,
+        prefixes=params.get_int('SAMPLE_PREFIXES'),
+        pages=params.get_int('SAMPLE_PAGES'))
+    for est in estimates:
+        logger.info("[Foundation %s] estimated %s: %d "
+                    "(rate %.4f, %.4f-%.4f; %d of %d sampled)",
+                    foundation, est.kind, est.count, est.rate,
+                    est.low, est.high, est.found, est.sampled)
+    escalate = estimator.exceeds(estimates, params.get_float('DRIFT_THRESHOLD'))
+    if escalate:
+        logger.info("[Foundation %s] drift estimate over threshold, "
+                    "running full diff", foundation)
+    return escalate
+
+
+def log_cache_stats(foundation, cc_fetcher, db_obj, logger):
+    """
+    Log the counters of the Cloud Controller response cache and of the
+    database query cache (if enabled).
+    """
+    for name, stats in (('CloudController response', cc_fetcher.cache_stats),
+                        ('Database query', db_obj.query_cache_stats)):
+        if stats is not None:
+            logger.info("[Foundation %s] %s cache: %s", foundation, name,
+                        ', '.join('{} {}'.format(key, stats[key])
+                                  for key in sorted(stats)))
+
+
+def audit(foundation, cc_fetcher, db_obj, context=None):
+    """
+    Count, and if configured diff, the applications of one foundation,
+    then log the cache counters (see log_cache_stats).
+
+    If the deadline passes mid-diff (or is cancelled, see coordinate) the
+    results so far are kept, and the results run and report are marked
+    incomplete.
+
+    :param context: RunContext of the foundation (default: the
+                    application-wide parameters and logger)
+    :return: True if the audit completed
+    """
+    logger = Logger().logger if context is None else context.logger
+    try:
+        return _audit(foundation, cc_fetcher, db_obj, context)
+    finally:
+        log_cache_stats(foundation, cc_fetcher, db_obj, logger)
+
+
+def _audit(foundation, cc_fetcher, db_obj, context):
+    """
+    The body of audit()
+    """
+    params = SysParams() if context is None else context.params
+    logger = Logger().logger if context is None else context.logger
+    try:
+        cf_count, db_count = get_counts(foundation, cc_fetcher, db_obj)
+        prepare_db(db_obj)
+        logger.info("[Foundation %s] CloudController: %s, Database: %s",
+                    foundation, cf_count, db_count)
+
+        full_diff = (params.get_bool('RESULTS_SINK') or
+                     bool(params['REPORT_PATH']))
+        if params['DIFF_MODE'] == 'estimate':
+            full_diff = estimate(foundation, cc_fetcher, db_obj,
+                                 cf_count, db_count, context=context)
+    except DeadlineExceeded as exn:
+        logger.warning("[Foundation %s] incomplete, no results: %s",
+                       foundation, str(exn))
+        return False
+    if not full_diff:
+        return True
+
+    complete = True
+    counts = collections.Counter()
+    with contextlib.ExitStack() as stack:
+        consumers = []
+        try:
+            # Setting the results sink up queries the database, so may
+            # itself run past the deadline
+            if params.get_bool('RESULTS_SINK'):
+                sink = stack.enter_context(ResultsSink(
+                    db_obj, foundation, 'applications', logger=logger))
+                sink.set_counts(cf_count, db_count)
+                consumers.append(sink)
+            if params['REPORT_PATH']:
+                consumers.append(stack.enter_context(report.open_report(
+                    params['REPORT_PATH'], params['REPORT_FORMAT'],
+                    foundation, 'applications',
+                    compress=params.get_bool('REPORT_COMPRESS'),
+                    details=params.get_bool('REPORT_DETAILS'))))
+            counts = diff_guids(foundation, cc_fetcher, db_obj, consumers,
+                                details=(bool(params['REPORT_PATH']) and
+                                         params.get_bool('REPORT_DETAILS')),
+                                counts=counts)
+        except DeadlineExceeded as exn:
+            complete = False
+            reason = str(exn)
+            for consumer in consumers:
+                consumer.mark_incomplete(reason)
+    logger.info("[Foundation %s] missing in Database: %d, "
+                "missing in CloudController: %d",
+                foundation, counts[differ.MISSING_IN_DB],
+                counts[differ.MISSING_IN_CC])
+    if not complete:
+        logger.warning("[Foundation %s] results are incomplete: %s",
+                       foundation, reason)
+    return complete
+
+
+def coordinate(foundations, db_obj, context):
+    """
+    Audit whichever of the foundations no other instance has leased (see
+    leases), so that several instances share the work.  An audit cut short
+    by the run deadline gives its lease up, and no more are claimed; an
+    audit whose lease is taken over by another instance stops as if its
+    deadline had passed.  Each foundation's report goes to a file of its
+    own (see report.foundation_path).
+
+    :param foundations: names of the foundations
+    :param db_obj: StatsDB holding the leases, shared by the instances
+    :param context: the run's RunContext; each foundation is audited in a
+                    context of its own (see RunContext.for_foundation),
+                    against its own database
+    :return: the foundations audited by this instance
+    """
+    params = context.params
+    logger = context.logger
+    manager = leases.LeaseManager(db_obj, ttl=params.get_float('LEASE_TTL'),
+                                  hold=params.get_float('LEASE_HOLD'),
+                                  logger=logger)
+    manager.ensure_table()
+    audited = []
+    for foundation in foundations:
+        if context.deadline.expired:
+            logger.warning("Run deadline exceeded, foundations not claimed")
+            break
+        deadline = context.deadline.derive()
+        lease = manager.claim(foundation, 'applications', deadline=deadline)
+        if lease is None:
+            logger.debug("[Foundation %s] leased by another instance",
+                         foundation)
+            continue
+        try:
+            with lease, context.for_foundation(foundation,
+                                               deadline) as fcontext:
+                report_path = fcontext.params['REPORT_PATH']
+                if report_path and \
+                        report_path == context.params['REPORT_PATH']:
+                    # A report per foundation, unless REPORT_PATH__<NAME>
+                    # names one
+                    fcontext.params['REPORT_PATH'] = report.foundation_path(
+                        report_path, foundation)
+                # Access tokens and cf-fetcher databases are per foundation
+                lease.done = audit(foundation, CCFetcher(context=fcontext),
+                                   StatsDB(context=fcontext), fcontext)
+        except Exception as exn:
+            logger.error("[Foundation %s] audit failed, lease released: %s",
+                         foundation, str(exn))
+            continue
+        if lease.lost:
+            logger.warning("[Foundation %s] lease lost, audit abandoned",
+                           foundation)
+        elif lease.done:
+            audited.append(foundation)
+    logger.info("%s audited %d of %d foundations: %s", manager.owner,
+                len(audited), len(foundations), ', '.join(audited))
+    return audited
+
+
 def main():
     """
     Wrap up main functionality
     """
-    foundation = SysParams()['FOUNDATION']
-    cc_fetcher = CCFetcher()
-    db_obj = StatsDB()
-    cf_count, db_count = get_counts(foundation, cc_fetcher, db_obj)
-    Logger().logger.info("[Foundation %s] CloudController: %s, Database: %s",
-                         foundation, cf_count, db_count)
-
+    params = SysParams()
+    run_deadline = Deadline(params.get_float('RUN_DEADLINE'))
+    with RunContext(params, deadline=run_deadline) as context:
+        if params.get_bool('COORDINATE'):
+            coordinate(params.get_list('FOUNDATIONS') or
+                       [params['FOUNDATION']], StatsDB(context=context),
+                       context)
+            return
+        cc_fetcher = CCFetcher(context=context)
+        db_obj = StatsDB(context=context)
+        audit(params['FOUNDATION'], cc_fetcher, db_obj, context)
 
 if __name__ == "__main__":
     Logger().logger.debug("Main starting")
@@ -4,3 +4,96 @@ cf-diff shared constants.
 
 # Miscelaneous system wide and parameter constants
 DEFAULT_LOG_LEVEL = 'INFO'
+DEFAULT_LOG_MODE = 'sync'           # 'sync' or 'queue' (background writer)
+DEFAULT_LOG_FORMAT = 'text'         # 'text' or 'json'
+LOG_QUEUE_SIZE = 10000              # records buffered in queue mode
+
+# Cloud Controller response cache
+DEFAULT_CC_CACHE_SIZE = 128         # in-memory entries
+DEFAULT_CC_CACHE_TTL = 30           # seconds an entry is reused unrevalidated
+DEFAULT_CC_CACHE_DIR = ''           # on-disk tier directory (empty: disabled)
+DEFAULT_CC_CACHE_DIR_SIZE = '256m'  # on-disk tier size limit
+DEFAULT_CC_CACHE_DIR_AGE = 7 * 86400  # seconds an on-disk entry is kept
+
+# Cloud Controller listing
+CC_PAGE_SIZE = 5000                 # records per v3 list page (CC maximum)
+CC_STREAM_CHUNK = 64 * 1024         # bytes per chunk fed to the page parser
+CC_MAX_URL_LENGTH = 8000            # characters per 'guids' filter request URL
+CC_DETAIL_FIELDS = ('name', 'state', 'relationships.space.data.guid',
+                    'updated_at')   # fields kept by a detail lookup
+
+# Cloud Controller request timeouts (each within the run deadline)
+CC_CONNECT_TIMEOUT = 10             # seconds to connect
+CC_READ_TIMEOUT = 60                # seconds between bytes read
+
+# Cloud Controller request limiting (per foundation, see rate_limiter)
+CC_INITIAL_RATE = 10.0              # requests per second at start
+CC_MAX_RATE = 50.0                  # requests per second ceiling
+CC_INITIAL_CONCURRENCY = 2          # requests in flight at start
+DEFAULT_CC_MAX_CONCURRENCY = 8      # requests in flight ceiling
+DEFAULT_CC_MAX_RETRIES = 3          # retries of a throttled/failed request
+
+# Cold start budget: process launch to the first Cloud Controller request
+STARTUP_BUDGET_SECONDS = 1.0
+
+# Modules that must not be imported before they are first needed
+LAZY_MODULES = ('mysql', 'oauthlib', 'requests_oauthlib')
+
+# Database writes
+DB_INSERT_BATCH = 1000              # rows per multi-row INSERT
+DEFAULT_RESULTS_SINK = False        # persist GUID diff results to MySQL
+
+# Database scans
+DB_FETCH_BATCH = 5000               # rows per fetchmany
+DB_IN_BATCH = 1000                  # GUIDs per 'WHERE guid IN (...)' query
+DB_MIN_FETCH_BATCH = 500            # rows per fetchmany under memory pressure
+DB_SCAN_READ_AHEAD = 1000000        # rows a parallel scan holds ahead of
+                                    # the caller (~100 bytes each)
+
+# Database query result cache (see query_cache)
+DEFAULT_DB_QUERY_CACHE = False      # cache read-only query results
+DEFAULT_DB_QUERY_CACHE_SIZE = 64    # results held
+DEFAULT_DB_QUERY_CACHE_TTL = 300    # seconds a result is reused at most
+DB_QUERY_CACHE_PROBE = 5            # seconds a table's UPDATE_TIME is trusted
+DB_QUERY_CACHE_MAX_ROWS = 100000    # larger results are not cached
+DB_QUERY_CACHE_TABLES = 256         # table versions held
+DEFAULT_DB_SCAN_CONNECTIONS = 1     # >1: parallel range-partitioned scan
+DEFAULT_DB_SCAN_PARTITIONS = 16     # GUID ranges of a parallel scan
+DB_POOL_SIZE = 4                    # idle connections kept for reuse (per context)
+
+# Discrepancy reports
+DEFAULT_REPORT_PATH = ''            # file, '-' for stdout (empty: disabled)
+DEFAULT_REPORT_FORMAT = 'ndjson'    # 'ndjson' or 'csv'
+DEFAULT_REPORT_COMPRESS = False     # gzip the report
+DEFAULT_REPORT_DETAILS = False      # add CC / database details per discrepancy
+ENRICH_BATCH = 10000                # discrepancies looked up per batch
+REPORT_BUFFER = 256 * 1024          # bytes buffered between writes
+
+# Sampled drift estimation (DIFF_MODE 'estimate')
+DEFAULT_DIFF_MODE = 'full'          # 'full' or 'estimate'
+DEFAULT_SAMPLE_PREFIXES = 4         # two hex digit GUID prefixes sampled (of 256)
+DEFAULT_SAMPLE_PAGES = 4            # random CC listing pages sampled
+SAMPLE_PAGE_SIZE = 100              # applications per sampled page
+DEFAULT_DRIFT_THRESHOLD = 0.001     # estimated drift rate triggering a full diff
+CONFIDENCE_Z = 1.96                 # 95% confidence intervals
+
+# Lease based sharding of foundations between instances (see leases)
+DEFAULT_COORDINATE = False          # claim foundations through leases
+DEFAULT_FOUNDATIONS = ''            # comma separated (empty: FOUNDATION)
+DEFAULT_LEASE_TTL = 60              # seconds a lease lasts without a heartbeat
+DEFAULT_LEASE_HOLD = 3600           # seconds finished work stays leased
+DEFAULT_MYSQL_SERVICE = ''          # VCAP_SERVICES p-mysql binding name
+                                    # (empty: the first)
+
+# Memory governor (see memory_governor)
+DEFAULT_MEMORY_LIMIT = ''           # bytes or ie: '2048m' (empty: unlimited)
+MEMORY_HIGH_WATER = 0.75            # fraction of the limit: shrink buffers
+MEMORY_LOW_WATER = 0.5              # fraction of the limit: grow them back
+MEMORY_SAMPLE_INTERVAL = 0.25       # seconds between RSS samples
+MEMORY_MIN_FACTOR = 1.0 / 16        # smallest buffer scale factor
+MEMORY_GROW_STEP = 0.125            # scale factor regained per sample
+
+# Run deadline (see deadline)
+DEFAULT_RUN_DEADLINE = 0            # seconds per run (0: unlimited)
+DB_GRACE_TIMEOUT = 30               # seconds for bookkeeping (results, leases)
+                                    # connections, which outlive the deadline
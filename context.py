@@ -0,0 +1,182 @@
+"""
+Run contexts: the parameters, logger, deadline, HTTP session and database
+connection pool that a CCFetcher or StatsDB works with.
+
+Without a context those objects use the process-wide SysParams and Logger
+(and module level requests), which suits a run over one foundation.  To
+audit several foundations, or foundations with their own credentials, in
+one process, each gets a context of its own (RunContext.for_foundation)
+and its fetcher and database objects no longer share any state but the
+deadline.
+
+Note(s):
+    1. Requires Python 3
+"""
+import collections
+import logging
+import threading
+
+import requests
+
+import constants
+from deadline import Deadline
+from logger import Logger
+from parameters import SysParams
+
+
+class ConnectionPool(object):
+    """
+    Idle database connections kept for reuse, up to a size.  Connections
+    are kept by the class of timeout they were opened with (see
+    StatsDB._new_connection), since a connection keeps its socket timeout
+    for life: one is only reused for work of the same class.
+    """
+    def __init__(self, size=constants.DB_POOL_SIZE):
+        """
+        :param size: idle connections kept at most
+        """
+        self._size = size
+        self._idle = collections.defaultdict(collections.deque)
+        self._count = 0
+        self._lock = threading.Lock()
+        super().__init__()
+
+    def get(self, key=None):
+        """
+        An idle connection of a timeout class that is still connected, or
+        None.
+
+        :param key: the timeout class
+        """
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                if not idle:
+                    return None
+                conn = idle.pop()
+                self._count -= 1
+            try:
+                if conn.is_connected():
+                    return conn
+                conn.close()
+            except Exception:
+                pass
+
+    def put(self, conn, key=None):
+        """
+        Keep a connection for reuse.
+
+        :param key: the timeout class conn was opened with
+        :return: False if the pool is full (the caller closes conn)
+        """
+        with self._lock:
+            if self._count >= self._size:
+                return False
+            self._idle[key].append(conn)
+            self._count += 1
+            return True
+
+    def close(self):
+        """
+        Close the idle connections.
+        """
+        with self._lock:
+            idle = [conn for conns in self._idle.values() for conn in conns]
+            self._idle.clear()
+            self._count = 0
+        for conn in idle:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+class RunContext(object):
+    """
+    The state of one run (or of one foundation in a run).  A context
+    closes its HTTP session and database connections when it is closed, or
+    on leaving a 'with' block.
+    """
+    def __init__(self, params=None, logger=None, deadline=None,
+                 session=None):
+        """
+        :param params: Params (default: the SysParams)
+        :param logger: logger (default: the application logger)
+        :param deadline: run Deadline (default: unlimited)
+        :param session: HTTP session (default: created on first use)
+        """
+        self.params = SysParams() if params is None else params
+        self.logger = Logger().logger if logger is None else logger
+        self.deadline = Deadline() if deadline is None else deadline
+        self._session = session
+        self._db_pool = None
+        self._lock = threading.Lock()
+        super().__init__()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def for_foundation(self, foundation, deadline=None):
+        """
+        A context for one foundation: its own parameters (see
+        Params.for_foundation), HTTP session and connection pool, and a
+        logger adding the foundation to each record, sharing the deadline.
+
+        :param foundation: the name of the foundation
+        :param deadline: the foundation's Deadline instead of the run's (ie:
+                         one derived from it, see Deadline.derive)
+        :return: RunContext
+        """
+        return RunContext(
+            params=self.params.for_foundation(foundation),
+            logger=logging.LoggerAdapter(self.logger,
+                                         {'foundation': foundation}),
+            deadline=self.deadline if deadline is None else deadline)
+
+    @property
+    def session(self):
+        """
+        The HTTP session, its connection pool sized for CC_MAX_CONCURRENCY
+        concurrent requests.
+        """
+        session = self._session
+        if session is None:
+            with self._lock:
+                session = self._session
+                if session is None:
+                    size = self.params.get_int('CC_MAX_CONCURRENCY')
+                    session = requests.Session()
+                    adapter = requests.adapters.HTTPAdapter(
+                        pool_connections=size, pool_maxsize=size)
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+        return session
+
+    @property
+    def db_pool(self):
+        """
+        The database ConnectionPool.
+        """
+        pool = self._db_pool
+        if pool is None:
+            with self._lock:
+                pool = self._db_pool
+                if pool is None:
+                    pool = self._db_pool = ConnectionPool()
+        return pool
+
+    def close(self):
+        """
+        Close the HTTP session and the pooled database connections.
+        """
+        with self._lock:
+            session, self._session = self._session, None
+            pool, self._db_pool = self._db_pool, None
+        if session is not None:
+            session.close()
+        if pool is not None:
+            pool.close()
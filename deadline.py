@@ -0,0 +1,117 @@
+"""
+Run deadline budgeting.
+
+A Deadline is created once per run and handed to the Cloud Controller and
+database interfaces, which derive the timeouts of every request, connect
+and query from the time remaining.  Once it has passed, work stops with
+DeadlineExceeded and the runner records whatever it has as incomplete.
+
+A derived Deadline expires with the run's but may also be cancelled on
+its own, ie: to stop one foundation's audit once another instance has
+taken its lease over (see leases).
+
+Note(s):
+    1. Requires Python 3
+"""
+import math
+import time
+
+
+class DeadlineExceeded(Exception):
+    """
+    The run's time budget is spent
+    """
+
+
+class Deadline(object):
+    """
+    A point in (monotonic) time by which the run must finish.
+    """
+    def __init__(self, seconds=None, clock=time.monotonic):
+        """
+        :param seconds: time budget from now (None/0: unlimited)
+        :param clock: time source (seconds)
+        """
+        self._clock = clock
+        self.budget = seconds or None
+        self._expires = clock() + seconds if seconds else None
+        self._cancelled = None
+        super().__init__()
+
+    def derive(self):
+        """
+        A deadline expiring when this one does, that can also be cancelled
+        without cancelling this one.
+        """
+        derived = Deadline(clock=self._clock)
+        derived.budget = self.budget
+        derived._expires = self._expires
+        return derived
+
+    def cancel(self, reason):
+        """
+        Expire the deadline now: work stops as if it had passed.
+
+        :param reason: why (the message of the DeadlineExceeded raised)
+        """
+        self._cancelled = reason
+
+    def _exceeded(self, message):
+        return DeadlineExceeded(self._cancelled or message)
+
+    def remaining(self):
+        """
+        Seconds left (never negative), or None if unlimited.
+        """
+        if self._cancelled is not None:
+            return 0.0
+        if self._expires is None:
+            return None
+        return max(0.0, self._expires - self._clock())
+
+    @property
+    def expired(self):
+        return self._cancelled is not None or (
+            self._expires is not None and self.remaining() <= 0)
+
+    def check(self, what="run"):
+        """
+        Raise DeadlineExceeded if the deadline has passed.
+
+        :param what: the work about to start (for the message)
+        """
+        if self.expired:
+            raise self._exceeded("Deadline exceeded before {}".format(what))
+
+    def timeout(self, cap=None):
+        """
+        A timeout for one call: the time remaining, at most cap.
+
+        :param cap: the call's own timeout (None: none)
+        :return: seconds, or None for no timeout at all
+        :raises DeadlineExceeded: if no time remains
+        """
+        remaining = self.remaining()
+        if remaining is None:
+            return cap
+        if remaining <= 0:
+            raise self._exceeded("Deadline exceeded")
+        return remaining if cap is None else min(cap, remaining)
+
+    def whole_seconds(self, cap=None):
+        """
+        timeout() rounded up to whole seconds, for APIs that take an int.
+        """
+        timeout = self.timeout(cap)
+        return None if timeout is None else max(1, int(math.ceil(timeout)))
+
+    def sleep(self, seconds):
+        """
+        Sleep (ie: a retry backoff), unless that would outlast the deadline.
+
+        :raises DeadlineExceeded: rather than sleep past the deadline
+        """
+        remaining = self.remaining()
+        if remaining is not None and seconds >= remaining:
+            raise self._exceeded("Deadline exceeded before retry")
+        time.sleep(seconds)
@@ -0,0 +1,80 @@
+"""
+GUID level comparison of Cloud Controller and database contents.
+
+Note(s):
+    1. Requires Python 3
+"""
+import collections
+import itertools
+
+import constants
+
+MISSING_IN_DB = 'missing_in_db'     # in the Cloud Controller only
+MISSING_IN_CC = 'missing_in_cc'     # in the database only
+
+Discrepancy = collections.namedtuple('Discrepancy', ['guid', 'kind'])
+# A discrepancy with the record found on the side that has the GUID
+DetailedDiscrepancy = collections.namedtuple('DetailedDiscrepancy',
+                                             ['guid', 'kind', 'details'])
+
+
+def diff_sorted(cc_guids, db_guids, key=None):
+    """
+    Merge two ascending GUID streams, yielding a Discrepancy for every
+    GUID present on one side only.  Neither stream is held in memory and
+    duplicates within a stream are ignored.
+
+    Both streams must be in the same order: the database's, which follows
+    the GUID column's collation (see StatsDB.guid_order).
+
+    :param cc_guids: ascending iterable of Cloud Controller GUIDs
+    :param db_guids: ascending iterable of database GUIDs
+    :param key: sort key of that order (None: code point order)
+    """
+    key = key or (lambda guid: guid)
+    cc_iter, db_iter = iter(cc_guids), iter(db_guids)
+    cc_guid = next(cc_iter, None)
+    db_guid = next(db_iter, None)
+    while cc_guid is not None or db_guid is not None:
+        cc_key = key(cc_guid) if cc_guid is not None else None
+        db_key = key(db_guid) if db_guid is not None else None
+        if db_guid is None or (cc_guid is not None and cc_key < db_key):
+            current = cc_key
+            yield Discrepancy(cc_guid, MISSING_IN_DB)
+        elif cc_guid is None or db_key < cc_key:
+            current = db_key
+            yield Discrepancy(db_guid, MISSING_IN_CC)
+        else:
+            current = cc_key
+        while cc_guid is not None and key(cc_guid) == current:
+            cc_guid = next(cc_iter, None)
+        while db_guid is not None and key(db_guid) == current:
+            db_guid = next(db_iter, None)
+
+
+def enrich(discrepancies, lookup_cc, lookup_db,
+           batch_size=constants.ENRICH_BATCH):
+    """
+    Attach details to a stream of discrepancies, looking GUIDs up in
+    batches rather than one at a time.  Only one batch is held in memory.
+
+    :param discrepancies: iterable of Discrepancy
+    :param lookup_cc: callable(list of GUIDs) -> {GUID: record} in the CC
+    :param lookup_db: callable(list of GUIDs) -> {GUID: row} in the database
+    :param batch_size: discrepancies per lookup batch
+    :return: generator of DetailedDiscrepancy, in input order
+    """
+    lookups = {MISSING_IN_DB: lookup_cc, MISSING_IN_CC: lookup_db}
+    discrepancies = iter(discrepancies)
+    while True:
+        batch = list(itertools.islice(discrepancies, batch_size))
+        if not batch:
+            return
+        details = {}
+        for kind, lookup in lookups.items():
+            guids = [found.guid for found in batch if found.kind == kind]
+            if guids:
+                details[kind] = lookup(guids)
+        for found in batch:
+            record = details.get(found.kind, {}).get(found.guid)
+            yield DetailedDiscrepancy(found.guid, found.kind, record)
@@ -0,0 +1,108 @@
+"""
+Fast approximate drift estimation by sampling.
+
+Rather than comparing every GUID, a small random sample is checked on
+each side:
+
+  * database rows whose GUIDs start with a few random two hex digit
+    prefixes (WHERE guid LIKE 'ab%') are looked up in the Cloud
+    Controller, estimating the rate of rows missing in the CC;
+  * applications on a few random CC listing pages are looked up in the
+    database, estimating the rate of applications missing in the DB.
+
+Each rate gets a Wilson score confidence interval, and is scaled to a
+count by the size of the side it was sampled from.  The CC sample is a
+cluster sample (whole pages), so its interval is somewhat optimistic.
+
+Note(s):
+    1. Requires Python 3
+"""
+import collections
+import math
+import random
+
+import constants
+import differ
+
+Estimate = collections.namedtuple('Estimate', [
+    'kind',         # differ.MISSING_IN_DB or differ.MISSING_IN_CC
+    'sampled',      # GUIDs checked
+    'found',        # of which discrepant
+    'rate',         # found / sampled
+    'low',          # confidence interval of the rate
+    'high',
+    'population',   # size of the side sampled from
+    'count',        # estimated discrepancies: rate * population
+])
+
+
+def wilson_interval(found, sampled, z=constants.CONFIDENCE_Z):
+    """
+    Wilson score interval for a binomial proportion.
+
+    :return: (low, high); (0.0, 1.0) when nothing was sampled
+    """
+    if not sampled:
+        return 0.0, 1.0
+    rate = found / sampled
+    denominator = 1 + z * z / sampled
+    centre = (rate + z * z / (2 * sampled)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / sampled +
+                           z * z / (4 * sampled * sampled)) / denominator
+    return max(0.0, centre - margin), min(1.0, centre + margin)
+
+
+def make_estimate(kind, sampled, found, population, z=constants.CONFIDENCE_Z):
+    """
+    Build an Estimate from sample counts.
+    """
+    rate = found / sampled if sampled else 0.0
+    low, high = wilson_interval(found, sampled, z)
+    return Estimate(kind, sampled, found, rate, low, high, population,
+                    int(round(rate * (population or 0))))
+
+
+def sample_prefixes(count, rng=random):
+    """
+    Choose distinct random two hex digit GUID prefixes.
+    """
+    return ['{:02x}'.format(value)
+            for value in sorted(rng.sample(range(256), min(count, 256)))]
+
+
+def estimate_drift(foundation, cc_obj, db_obj, cc_count, db_count,
+                   prefixes=constants.DEFAULT_SAMPLE_PREFIXES,
+                   pages=constants.DEFAULT_SAMPLE_PAGES,
+                   per_page=constants.SAMPLE_PAGE_SIZE, rng=random):
+    """
+    Estimate the application drift between the CC and the database.
+
+    :param foundation: the name of the foundation
+    :param cc_obj: CCFetcher object
+    :param db_obj: StatsDB object
+    :param cc_count: applications in the CC
+    :param db_count: application GUIDs in the database
+    :param prefixes: number of GUID prefixes to sample in the database
+    :param pages: number of CC listing pages to sample
+    :param per_page: applications per sampled page
+    :return: list of Estimate (missing in CC, missing in DB)
+    """
+    db_sample = db_obj.guids_with_prefixes(
+        'applications', sample_prefixes(prefixes, rng))
+    in_cc = cc_obj.existing_app_guids(foundation, db_sample)
+    missing_in_cc = make_estimate(differ.MISSING_IN_CC, len(db_sample),
+                                  len(db_sample) - len(in_cc), db_count)
+
+    cc_sample = set(cc_obj.sample_app_guids(foundation, pages, per_page, rng))
+    in_db = db_obj.existing_guids('applications', cc_sample)
+    missing_in_db = make_estimate(differ.MISSING_IN_DB, len(cc_sample),
+                                  len(cc_sample) - len(in_db), cc_count)
+    return [missing_in_cc, missing_in_db]
+
+
+def exceeds(estimates, threshold):
+    """
+    True if any estimated drift rate is above the threshold, or if a
+    side could not be sampled at all.
+    """
+    return any(est.rate > threshold or not est.sampled for est in estimates)
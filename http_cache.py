@@ -0,0 +1,266 @@
+"""
+Cloud Controller HTTP response cache.
+
+The parsed result of a reply (ie: the slim records of a listing page, not
+the reply itself) is cached per (foundation, URL) together with the
+reply's ETag/Last-Modified validators, in a bounded in-memory LRU tier
+and, optionally, an on-disk tier that survives between runs.  An entry
+younger than the TTL is reused without contacting the Cloud Controller;
+an older entry carrying a validator is revalidated with a conditional
+request, so an unchanged page costs a 304.
+
+The disk tier is bounded: entries older than max_age are removed when the
+cache opens, and once the tier outgrows max_bytes the least recently
+written entries are removed until it is back under 90% of it.
+
+Note(s):
+    1. Requires Python 3
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+import requests
+
+from cache import LRUCache
+from logger import Logger
+
+# Entries are pruned down to this fraction of the size limit
+_PRUNE_TO = 0.9
+_SUFFIX = '.entry'
+
+
+class CacheEntry(object):
+    """
+    A cached (parsed) result, its validators and the (wall clock) time it
+    was stored/revalidated.
+    """
+    __slots__ = ('value', 'etag', 'last_modified', 'stored_at')
+
+    def __init__(self, value, etag, last_modified, stored_at):
+        self.value = value
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+
+
+class ResponseCache(object):
+    """
+    Two tier (memory LRU + optional disk) cache of parsed GET replies.
+    """
+    _stat_names = ('hits', 'revalidated', 'misses', 'disk_hits', 'stores',
+                   'disk_evictions')
+
+    def __init__(self, maxsize, ttl, directory=None, max_bytes=None,
+                 max_age=None, clock=time.time, logger=None):
+        """
+        :param maxsize: in-memory tier entry limit
+        :param ttl: seconds an entry is reused without revalidation
+        :param directory: on-disk tier location (None/empty: memory only)
+        :param max_bytes: on-disk tier size limit (None: unlimited)
+        :param max_age: seconds an on-disk entry is kept (None: forever)
+        :param clock: wall clock time source
+        :param logger: logger to use (default: the application-wide one)
+        """
+        self.logger = Logger().logger if logger is None else logger
+        self._memory = LRUCache(maxsize=maxsize)
+        self._ttl = ttl
+        self._directory = directory or None
+        self._max_bytes = max_bytes or None
+        self._max_age = max_age or None
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(self._stat_names, 0)
+        self._disk_bytes = 0
+        if self._directory:
+            os.makedirs(self._directory, exist_ok=True)
+            self._prune_disk(expire=True)
+        super().__init__()
+
+    @staticmethod
+    def _key(foundation, url):
+        return hashlib.sha1('{}\n{}'.format(foundation, url)
+                            .encode('utf-8')).hexdigest()
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    @property
+    def stats(self):
+        """
+        A snapshot of the cache counters.
+        """
+        with self._lock:
+            rtn = dict(self._stats)
+            rtn['disk_bytes'] = self._disk_bytes
+        rtn['size'] = len(self._memory)
+        return rtn
+
+    def lookup(self, foundation, url):
+        """
+        Return the cached entry for this foundation/url, or None.
+        """
+        key = self._key(foundation, url)
+        entry = self._memory.get(key)
+        if entry is None and self._directory:
+            entry = self._read_disk(key)
+            if entry is not None:
+                self._count('disk_hits')
+                self._memory.put(key, entry)
+        return entry
+
+    def is_fresh(self, entry):
+        """
+        True if the entry may be reused without contacting the server.
+        """
+        return self._clock() - entry.stored_at <= self._ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        Revalidation headers for a stale entry (empty if it has no validators).
+        """
+        headers = {}
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def hit(self, entry):
+        """
+        Record reuse of a fresh entry and return its value.
+        """
+        self._count('hits')
+        return entry.value
+
+    def revalidated(self, foundation, url, entry, reply):
+        """
+        The server answered 304 for a stale entry: restart its TTL and
+        return the cached value.
+        """
+        self._count('revalidated')
+        etag = reply.headers.get('ETag')
+        if etag:
+            entry.etag = etag
+        entry.stored_at = self._clock()
+        key = self._key(foundation, url)
+        self._memory.put(key, entry)
+        if self._directory:
+            self._write_disk(key, foundation, url, entry)
+        return entry.value
+
+    def store(self, foundation, url, reply, value):
+        """
+        Count a full download and cache its parsed value if the reply is a
+        cacheable 200.
+
+        :param reply: the reply (for its status and headers)
+        :param value: the result parsed from the reply's body
+        """
+        self._count('misses')
+        if reply.status_code != requests.codes.ok:
+            return
+        if 'no-store' in reply.headers.get('Cache-Control', ''):
+            return
+        entry = CacheEntry(value, reply.headers.get('ETag'),
+                           reply.headers.get('Last-Modified'), self._clock())
+        key = self._key(foundation, url)
+        self._memory.put(key, entry)
+        self._count('stores')
+        if self._directory:
+            self._write_disk(key, foundation, url, entry)
+
+    def trim_memory(self):
+        """
+        Drop the in-memory tier (the disk tier is kept), ie: under memory
+        pressure.
+        """
+        self._memory.clear()
+
+    def _path(self, key):
+        return os.path.join(self._directory, key + _SUFFIX)
+
+    def _write_disk(self, key, foundation, url, entry):
+        """
+        Persist an entry to the disk tier, pruning the tier if it has
+        outgrown its size limit.
+        """
+        path = self._path(key)
+        try:
+            data = json.dumps({'foundation': foundation,
+                               'url': url,
+                               'etag': entry.etag,
+                               'last_modified': entry.last_modified,
+                               'stored_at': entry.stored_at,
+                               'value': entry.value}).encode('utf-8')
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as out:
+                out.write(data)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as exn:
+            self.logger.warning("Response cache write failed: %s", str(exn))
+            return
+        with self._lock:
+            self._disk_bytes += len(data) - replaced
+            over = (self._max_bytes is not None and
+                    self._disk_bytes > self._max_bytes)
+        if over:
+            self._prune_disk()
+
+    def _read_disk(self, key):
+        """
+        Load an entry from the disk tier, or None if absent/unreadable.
+        """
+        try:
+            with open(self._path(key), 'rb') as entry_file:
+                data = json.loads(entry_file.read().decode('utf-8'))
+            return CacheEntry(data['value'], data['etag'],
+                              data['last_modified'], data['stored_at'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _prune_disk(self, expire=False):
+        """
+        Remove disk tier entries: those older than max_age (if expire),
+        then the least recently written until the tier is under 90% of
+        max_bytes.  Also (re)counts the tier's size.
+        """
+        entries = []
+        for name in os.listdir(self._directory):
+            path = os.path.join(self._directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        limit = (self._max_bytes * _PRUNE_TO if self._max_bytes is not None
+                 else None)
+        oldest = (self._clock() - self._max_age
+                  if expire and self._max_age is not None else None)
+        removed = 0
+        for mtime, size, path in entries:
+            if not ((oldest is not None and mtime < oldest) or
+                    (limit is not None and total > limit)):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self._disk_bytes = total
+            self._stats['disk_evictions'] += removed
+        if removed:
+            self.logger.debug("Response cache: %d entries evicted from disk",
+                              removed)
@@ -0,0 +1,216 @@
+"""
+Incremental extraction of records from Cloud Controller list pages.
+
+A CC list page is a single JSON object whose 'resources' array holds the
+records (up to 5000 per v3 page).  Rather than decoding the whole page
+into one object tree, the page body is consumed chunk by chunk: the
+top-level keys are walked one at a time, each element of the resources
+array is decoded on its own, the requested fields are pulled out of it,
+and the element is dropped before the next one is read.  Peak memory is
+therefore one record (plus the undecoded input buffer) rather than the
+whole page.
+
+Note(s):
+    1. Requires Python 3
+"""
+import codecs
+import json
+import json.decoder
+
+# Default per-record fields: the resource GUID, v3 ('guid') then v2
+# ('metadata.guid') layout.
+GUID_PATHS = ('guid', 'metadata.guid')
+
+# Top-level (non-resource) page keys retained in the page summary
+SUMMARY_KEYS = ('total_results', 'total_pages', 'next_url', 'pagination')
+
+_WHITESPACE = ' \t\n\r'
+
+
+class IncompletePage(ValueError):
+    """
+    The page body ended before the JSON document was complete
+    """
+
+
+def lookup(obj, path):
+    """
+    Return the value at a dotted path in nested dicts, or None.
+
+    :param obj: decoded JSON object
+    :param path: dotted key path, e.g. 'metadata.guid'
+    """
+    for key in path.split('.'):
+        if not isinstance(obj, dict):
+            return None
+        obj = obj.get(key)
+    return obj
+
+
+class PageExtractor(object):
+    """
+    Incrementally parse one CC list page, yielding slim records.
+
+    Iterate over records() to consume the page; once it is exhausted the
+    summary attribute holds the retained top-level keys.
+    """
+    def __init__(self, chunks, fields=(), collection='resources',
+                 summary_keys=SUMMARY_KEYS):
+        """
+        :param chunks: iterable of bytes (or str) chunks of the page body
+        :param fields: extra dotted field paths to extract per record
+        :param collection: name of the top-level records array
+        :param summary_keys: top-level keys to retain in summary
+        """
+        self._chunks = iter(chunks)
+        self._fields = tuple(fields)
+        self._collection = collection
+        self._summary_keys = frozenset(summary_keys)
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+        self.summary = {}
+        super().__init__()
+
+    def _fill(self):
+        """
+        Append the next chunk to the buffer; False at end of input.
+        """
+        if self._eof:
+            return False
+        # Drop the consumed prefix so the buffer stays about one chunk long
+        if self._pos:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        for chunk in self._chunks:
+            if isinstance(chunk, bytes):
+                chunk = self._decoder.decode(chunk)
+            if chunk:
+                self._buf += chunk
+                return True
+        self._buf += self._decoder.decode(b'', final=True)
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """
+        Skip whitespace and return the next significant character.
+        """
+        while True:
+            buf, pos = self._buf, self._pos
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                raise IncompletePage("Unexpected end of page")
+
+    def _expect(self, chars):
+        """
+        Consume the next significant character, which must be one of chars.
+        """
+        char = self._peek()
+        if char not in chars:
+            raise ValueError("Expected {!r} at offset {}, found {!r}"
+                             .format(chars, self._pos, char))
+        self._pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decode the JSON value at the current position.
+
+        A value decoded right up to the end of the buffer may have been
+        cut short (e.g. a number), so it is re-read with more input.
+        """
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise IncompletePage("Truncated value at end of page")
+            if end < len(self._buf) or not self._fill():
+                self._pos = end
+                return value
+
+    def _key(self):
+        """
+        Decode an object key string (the opening quote is current).
+        """
+        while True:
+            try:
+                key, end = json.decoder.scanstring(self._buf, self._pos + 1)
+            except ValueError:
+                if self._fill():
+                    continue
+                raise IncompletePage("Truncated key at end of page")
+            self._pos = end
+            return key
+
+    def _extract(self, record):
+        """
+        Reduce a decoded record to its GUID and requested fields.
+        """
+        rtn = {'guid': None}
+        for path in GUID_PATHS:
+            guid = lookup(record, path)
+            if guid is not None:
+                rtn['guid'] = guid
+                break
+        for path in self._fields:
+            rtn[path] = lookup(record, path)
+        return rtn
+
+    def _records(self):
+        """
+        Yield the extracted elements of the records array.
+        """
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self._extract(self._value())
+            if self._expect(',]') == ']':
+                return
+
+    def records(self):
+        """
+        Generator of slim record dicts ({'guid': ..., <field>: ...}).
+        """
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            if self._peek() != '"':
+                self._expect('"')
+            key = self._key()
+            self._expect(':')
+            if key == self._collection:
+                for record in self._records():
+                    yield record
+            else:
+                value = self._value()
+                if key in self._summary_keys:
+                    self.summary[key] = value
+            if self._expect(',}') == '}':
+                return
+
+
+def extract_page(chunks, fields=(), collection='resources'):
+    """
+    Parse a whole page.
+
+    :param chunks: iterable of bytes chunks of the page body
+    :param fields: extra dotted field paths to extract per record
+    :param collection: name of the top-level records array
+    :return: (summary dict, list of record dicts)
+    """
+    extractor = PageExtractor(chunks, fields=fields, collection=collection)
+    records = list(extractor.records())
+    return extractor.summary, records
@@ -0,0 +1,230 @@
+"""
+Lease based sharding of audit work between cf-diff instances.
+
+Each unit of work (a foundation/resource pair) has a row in the
+cf_diff_leases table, and an instance works on a unit only while it holds
+the unit's lease:
+
+  * a lease is claimed with one conditional UPDATE, which succeeds for at
+    most one instance and only once the previous lease has expired;
+  * while the work runs a heartbeat thread keeps extending the lease, so
+    the lease of a crashed instance lapses within the lease TTL and its
+    work is picked up by another instance;
+  * should the heartbeat find the lease taken over (ie: this instance
+    stalled past the TTL), it cancels the work's Deadline, so the work
+    stops as if its deadline had passed;
+  * finished work keeps its lease for the hold time (the audit cycle), so
+    no other instance repeats it within the cycle; failed work is released
+    at once.
+
+All times are taken from the database clock, so the instances' clocks
+need not agree.  Lease statements use their own fixed timeout rather than
+the run deadline, so a lease is still released once the deadline passed.
+
+Note(s):
+    1. Requires Python 3
+"""
+import os
+import socket
+import threading
+
+import constants
+from logger import Logger
+
+LEASES_TABLE = 'cf_diff_leases'
+
+_SCHEMA = """CREATE TABLE IF NOT EXISTS {} (
+    foundation VARCHAR(64) NOT NULL,
+    resource VARCHAR(64) NOT NULL,
+    owner VARCHAR(128) NOT NULL DEFAULT '',
+    expires_at DATETIME(6) NOT NULL,
+    heartbeat_at DATETIME(6) NULL,
+    finished_at DATETIME(6) NULL,
+    PRIMARY KEY (foundation, resource)
+)""".format(LEASES_TABLE)
+
+
+def default_owner():
+    """
+    An owner name unique to this process: host name and process id.
+    """
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def _micros(seconds):
+    # INTERVAL ... SECOND rounds fractions, so intervals are in microseconds
+    return int(seconds * 1000000)
+
+
+class Lease(object):
+    """
+    A claimed lease: a context manager heartbeating while the work runs,
+    then finishing the lease, or releasing it if the block raises or
+    clears 'done' (ie: the work was cut short).
+    """
+    def __init__(self, manager, foundation, resource, deadline=None):
+        """
+        :param manager: the LeaseManager that claimed the lease
+        :param foundation: the name of the foundation
+        :param resource: the resource, ie: 'applications'
+        :param deadline: Deadline of the work, cancelled if the lease is lost
+        """
+        self.logger = manager.logger
+        self._manager = manager
+        self.foundation = foundation
+        self.resource = resource
+        self.deadline = deadline
+        self.lost = False
+        self.done = True
+        self._stop = threading.Event()
+        self._thread = None
+        super().__init__()
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._heartbeat, daemon=True,
+                                        name="lease-heartbeat")
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self._stop.set()
+        self._thread.join()
+        try:
+            if exc_type is not None or not self.done:
+                self._manager.release(self)
+            elif not self.lost:
+                self._manager.finish(self)
+        except Exception as exn:
+            self.logger.warning("Lease %s/%s not updated: %s",
+                                self.foundation, self.resource, str(exn))
+        return False
+
+    def _heartbeat(self):
+        """
+        Renew the lease every heartbeat interval until stopped, or until
+        it turns out another instance has taken it over.
+        """
+        while not self._stop.wait(self._manager.heartbeat):
+            try:
+                renewed = self._manager.renew(self)
+            except Exception as exn:
+                # Transient: the next beat retries before the lease lapses
+                self.logger.warning("Lease %s/%s heartbeat failed: %s",
+                                    self.foundation, self.resource, str(exn))
+                continue
+            if not renewed:
+                self.lost = True
+                self.logger.warning("Lease %s/%s lost to another instance",
+                                    self.foundation, self.resource)
+                if self.deadline is not None:
+                    self.deadline.cancel("Lease {}/{} lost to another "
+                                         "instance".format(self.foundation,
+                                                           self.resource))
+                return
+
+
+class LeaseManager(object):
+    """
+    Claims and maintains leases in the cf_diff_leases table.
+    """
+    def __init__(self, db, owner=None, ttl=constants.DEFAULT_LEASE_TTL,
+                 hold=constants.DEFAULT_LEASE_HOLD, heartbeat=None,
+                 logger=None):
+        """
+        :param db: StatsDB object
+        :param owner: name of this instance (default: host name and pid)
+        :param ttl: seconds a lease lasts without a heartbeat
+        :param hold: seconds finished work keeps its lease
+        :param heartbeat: seconds between heartbeats (default ttl / 3)
+        :param logger: logger to use (default: the application-wide one)
+        """
+        self.logger = Logger().logger if logger is None else logger
+        self._db = db
+        self.owner = owner or default_owner()
+        self.ttl = float(ttl)
+        self.hold = float(hold)
+        self.heartbeat = float(heartbeat or self.ttl / 3)
+        super().__init__()
+
+    def ensure_table(self):
+        """
+        Create the leases table if needed.
+        """
+        self._db.query(_SCHEMA)
+
+    def _transaction(self):
+        return self._db.transaction(timeout=constants.DB_GRACE_TIMEOUT)
+
+    def _execute(self, sql, args):
+        """
+        Run one statement in its own transaction.
+
+        :return: number of rows changed
+        """
+        with self._transaction() as cursor:
+            cursor.execute(sql, args)
+            return cursor.rowcount
+
+    def claim(self, foundation, resource, deadline=None):
+        """
+        Try to claim the lease on a unit of work.
+
+        :param foundation: the name of the foundation
+        :param resource: the resource, ie: 'applications'
+        :param deadline: Deadline of the work, cancelled if the lease is lost
+        :return: Lease, or None if another instance holds it
+        """
+        with self._transaction() as cursor:
+            cursor.execute(
+                "INSERT IGNORE INTO {} (foundation, resource, expires_at) "
+                "VALUES (%s, %s, '1970-01-02')".format(LEASES_TABLE),
+                (foundation, resource))
+            cursor.execute(
+                "UPDATE {} SET owner = %s, heartbeat_at = NOW(6), "
+                "finished_at = NULL, "
+                "expires_at = NOW(6) + INTERVAL %s MICROSECOND "
+                "WHERE foundation = %s AND resource = %s "
+                "AND expires_at <= NOW(6)".format(LEASES_TABLE),
+                (self.owner, _micros(self.ttl), foundation, resource))
+            claimed = cursor.rowcount == 1
+        self.logger.debug("Lease %s/%s %s by %s", foundation, resource,
+                          "claimed" if claimed else "not claimed", self.owner)
+        return (Lease(self, foundation, resource, deadline=deadline)
+                if claimed else None)
+
+    def _update_own(self, lease, assignments, args=()):
+        """
+        Update a lease row, provided this instance still owns it.
+
+        :return: True if the row was updated
+        """
+        return self._execute(
+            "UPDATE {} SET {} WHERE foundation = %s AND resource = %s "
+            "AND owner = %s".format(LEASES_TABLE, assignments),
+            tuple(args) + (lease.foundation, lease.resource, self.owner)) == 1
+
+    def renew(self, lease):
+        """
+        Extend a lease by the TTL (a heartbeat).
+
+        :return: False if the lease has been taken over
+        """
+        return self._update_own(
+            lease, "heartbeat_at = NOW(6), "
+            "expires_at = NOW(6) + INTERVAL %s MICROSECOND",
+            (_micros(self.ttl),))
+
+    def finish(self, lease):
+        """
+        Mark the work done, keeping the lease for the hold time.
+        """
+        return self._update_own(
+            lease, "finished_at = NOW(6), "
+            "expires_at = NOW(6) + INTERVAL %s MICROSECOND",
+            (_micros(self.hold),))
+
+    def release(self, lease):
+        """
+        Give a lease up at once, so another instance may retry the work.
+        """
+        return self._update_own(lease, "expires_at = NOW(6)")
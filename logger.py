@@ -1,13 +1,79 @@
 """
 scaler logger functions.
 """
+import atexit
+import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 
 import constants
 from singleton import Singleton
 
+# LogRecord attributes that are not user supplied 'extra' fields
+_RECORD_ATTRS = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None)))
+_RECORD_ATTRS |= {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line.  Fields passed through
+    'extra' are included as top-level keys.
+    """
+    def format(self, record):
+        entry = {'time': self.formatTime(record),
+                 'level': record.levelname,
+                 'logger': record.name,
+                 'message': record.getMessage()}
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    A QueueHandler that never blocks the caller: when the queue is full
+    the record is dropped and counted instead.
+    """
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def make_handler(stream, mode='sync', fmt='text',
+                 queue_size=constants.LOG_QUEUE_SIZE):
+    """
+    Build the handler writing to stream.
+
+    :param stream: output stream
+    :param mode: 'sync' (write in the caller) or 'queue' (hand records to
+                 a background writer thread)
+    :param fmt: 'text' or 'json'
+    :param queue_size: maximum records waiting to be written (queue mode)
+    :return: (handler to attach, QueueListener or None)
+    """
+    handler = logging.StreamHandler(stream)
+    if fmt == 'json':
+        handler.setFormatter(JsonFormatter())
+    if mode != 'queue':
+        return handler, None
+    log_queue = queue.Queue(queue_size)
+    listener = logging.handlers.QueueListener(log_queue, handler,
+                                              respect_handler_level=True)
+    listener.start()
+    return DroppingQueueHandler(log_queue), listener
+
 
 class Logger(object, metaclass=Singleton):
     _avail_levels = {'DEBUG': logging.DEBUG,
@@ -15,16 +81,30 @@ class Logger(object, metaclass=Singleton):
                      'WARNING': logging.WARNING,
                      'ERROR': logging.ERROR,
                      'CRITICAL': logging.CRITICAL}
-    def __init__(self, appname=None, level=None):
+    def __init__(self, appname=None, level=None, mode=None, fmt=None):
         """
         Get a logger object for application-wide use.
+
+        In 'queue' mode (LOG_MODE) records are written by a background
+        thread so a blocked stdout never stalls the caller; LOG_FORMAT
+        'json' writes one JSON object per record.
         """
         appname = appname or os.environ.get('APPNAME', __name__)
         loglevel = str(level or os.environ.get('LOG_LEVEL',
                                                constants.DEFAULT_LOG_LEVEL)).upper()
+        mode = str(mode or os.environ.get('LOG_MODE',
+                                          constants.DEFAULT_LOG_MODE)).lower()
+        fmt = str(fmt or os.environ.get('LOG_FORMAT',
+                                        constants.DEFAULT_LOG_FORMAT)).lower()
 
         self._logger = logging.getLogger(appname)
-        self._logger.addHandler(logging.StreamHandler(sys.stdout))
+        self._handler, self._listener = make_handler(sys.stdout, mode, fmt)
+        self._logger.addHandler(self._handler)
+        # The handler writing to the stream (behind the queue in queue mode)
+        self._stream_handler = (self._listener.handlers[0] if self._listener
+                                else self._handler)
+        if self._listener:
+            atexit.register(self.shutdown)
         self.set_level(loglevel)
         super().__init__()
 
@@ -34,6 +114,30 @@ class Logger(object, metaclass=Singleton):
         else:
             self.logger.error("Can't set log level to %s", level)
 
+    def redirect(self, stream):
+        """
+        Write log records to another stream from now on, ie: stderr while
+        stdout carries a report.
+        """
+        handler = self._stream_handler
+        handler.acquire()
+        try:
+            handler.flush()
+            handler.stream = stream
+        finally:
+            handler.release()
+
+    def shutdown(self):
+        """
+        Flush queued records and stop the background writer (queue mode).
+        """
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+            dropped = getattr(self._handler, 'dropped', 0)
+            if dropped:
+                sys.stderr.write("logger: {} records dropped\n".format(dropped))
+
     @property
     def logger(self):
         return self._logger
@@ -0,0 +1,206 @@
+"""
+Memory budgeted sizing of pages, batches and in-flight work.
+
+The process runs under a hard memory limit (MEMORY_LIMIT, which Cloud
+Foundry sets from the manifest, ie: '2048m').  The governor samples the
+resident set size (and, with MEMORY_TRACE, the tracemalloc peak) and keeps
+a scale factor that code sizing its buffers applies to their nominal sizes:
+
+  * at or above the high water mark the factor is halved (and registered
+    caches are dropped), at most once per sample interval;
+  * below the low water mark it grows back additively, up to 1.
+
+Without a limit the factor stays at 1.
+
+Note(s):
+    1. Requires Python 3
+"""
+import os
+import threading
+import time
+import tracemalloc
+import weakref
+
+import constants
+from logger import Logger
+
+_UNITS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def parse_size(value):
+    """
+    Parse a memory size: bytes, or a number with a k/m/g/t suffix (an
+    optional trailing 'b' is ignored), ie: '2048m', '2G', '1048576'.
+
+    :return: bytes, or None for an empty value
+    """
+    text = str(value or '').strip().lower()
+    if text.endswith('b'):
+        text = text[:-1]
+    if not text:
+        return None
+    if text[-1] in _UNITS:
+        return int(float(text[:-1]) * _UNITS[text[-1]])
+    return int(float(text))
+
+
+def rss_bytes():
+    """
+    The current resident set size, from /proc/self/statm.
+
+    :return: bytes, or None where /proc is unavailable
+    """
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class MemoryGovernor(object):
+    """
+    Scales buffer sizes to the memory headroom.
+    """
+    def __init__(self, limit=None, high=constants.MEMORY_HIGH_WATER,
+                 low=constants.MEMORY_LOW_WATER,
+                 interval=constants.MEMORY_SAMPLE_INTERVAL,
+                 min_factor=constants.MEMORY_MIN_FACTOR, trace=False,
+                 rss=rss_bytes, clock=time.monotonic):
+        """
+        :param limit: memory limit in bytes (None: unlimited)
+        :param high: fraction of the limit at which sizes are shrunk
+        :param low: fraction of the limit below which sizes grow back
+        :param interval: minimum seconds between samples
+        :param min_factor: smallest scale factor
+        :param trace: also track the tracemalloc peak
+        :param rss: resident set size source (bytes)
+        :param clock: time source (seconds)
+        """
+        self.logger = Logger().logger
+        self.limit = limit
+        self._high = high
+        self._low = low
+        self._interval = interval
+        self._min_factor = min_factor
+        self._rss = rss
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._factor = 1.0
+        self._sampled_at = None
+        self._stats = {'rss': 0, 'peak_rss': 0, 'traced_peak': 0,
+                       'shrinks': 0, 'grows': 0}
+        self._tracing = trace and not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        super().__init__()
+
+    def on_shrink(self, callback):
+        """
+        Register a callable run whenever sizes are shrunk, ie: to drop a
+        cache.  Bound methods are held weakly.
+        """
+        try:
+            ref = weakref.WeakMethod(callback)
+        except TypeError:
+            ref = lambda: callback
+        with self._lock:
+            self._callbacks.append(ref)
+
+    def sample(self, force=False):
+        """
+        Measure memory use (at most once per interval unless forced) and
+        adjust the scale factor.
+
+        :return: the scale factor
+        """
+        now = self._clock()
+        with self._lock:
+            if not force and self._sampled_at is not None and \
+                    now - self._sampled_at < self._interval:
+                return self._factor
+            self._sampled_at = now
+            rss = self._rss() or 0
+            self._stats['rss'] = rss
+            self._stats['peak_rss'] = max(self._stats['peak_rss'], rss)
+            if tracemalloc.is_tracing():
+                self._stats['traced_peak'] = tracemalloc.get_traced_memory()[1]
+            if not self.limit or not rss:
+                return self._factor
+            usage = rss / self.limit
+            shrunk = False
+            if usage >= self._high and self._factor > self._min_factor:
+                self._factor = max(self._min_factor, self._factor / 2)
+                self._stats['shrinks'] += 1
+                shrunk = True
+            elif usage < self._low and self._factor < 1.0:
+                self._factor = min(1.0, self._factor + constants.MEMORY_GROW_STEP)
+                self._stats['grows'] += 1
+            factor = self._factor
+            callbacks = list(self._callbacks) if shrunk else []
+        if shrunk:
+            self.logger.warning("Memory at %d%% of limit, scaling buffers "
+                                "to %.2f", usage * 100, factor)
+        for ref in callbacks:
+            callback = ref()
+            if callback is not None:
+                callback()
+        return factor
+
+    @property
+    def factor(self):
+        return self.sample()
+
+    def scale(self, nominal, minimum=1):
+        """
+        Scale a nominal size (page count, batch size, ...) to the headroom.
+
+        :param nominal: size with plenty of headroom
+        :param minimum: smallest size returned
+        """
+        return max(minimum, int(nominal * self.sample()))
+
+    @property
+    def stats(self):
+        """
+        A snapshot of the memory measurements and adjustments.
+        """
+        with self._lock:
+            rtn = dict(self._stats)
+            rtn['factor'] = self._factor
+        rtn['limit'] = self.limit
+        return rtn
+
+    def stop(self):
+        """
+        Stop tracemalloc, if this governor started it.
+        """
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+
+_governor = None
+_governor_lock = threading.Lock()
+
+
+def governor():
+    """
+    The process wide governor, configured from the MEMORY_LIMIT and
+    MEMORY_TRACE environment variables.
+    """
+    global _governor
+    if _governor is None:
+        with _governor_lock:
+            if _governor is None:
+                trace = os.environ.get('MEMORY_TRACE', '').strip().lower()
+                _governor = MemoryGovernor(
+                    limit=parse_size(os.environ.get(
+                        'MEMORY_LIMIT', constants.DEFAULT_MEMORY_LIMIT)),
+                    trace=trace in ('true', 'yes', 'on', '1'))
+    return _governor
@@ -2,7 +2,9 @@
 application-wide parameters
 """
 import os
+import re
 
+import constants
 from singleton import Singleton
 
 class MissingEnvironmentVariable(Exception):
@@ -10,20 +12,53 @@ class MissingEnvironmentVariable(Exception):
     Required environment variable is missing
     """
 
-class SysParams(dict, metaclass=Singleton):
+class Params(dict):
     """
-    A utility class intended to hold all system-wide and configurable
-    parameters.
+    The configurable parameters of a run (see SysParams for the
+    application-wide instance).
     """
     _required_env = ['OAUTH_CLIENT_ID', 'OAUTH_CLIENT_SECRET',
                      'FOUNDATION', 'CC_URL']
 
     _overridable = {
+        'CC_CACHE_SIZE': constants.DEFAULT_CC_CACHE_SIZE,
+        'CC_CACHE_TTL': constants.DEFAULT_CC_CACHE_TTL,
+        'CC_CACHE_DIR': constants.DEFAULT_CC_CACHE_DIR,
+        'CC_CACHE_DIR_SIZE': constants.DEFAULT_CC_CACHE_DIR_SIZE,
+        'CC_CACHE_DIR_AGE': constants.DEFAULT_CC_CACHE_DIR_AGE,
+        'CC_MAX_CONCURRENCY': constants.DEFAULT_CC_MAX_CONCURRENCY,
+        'CC_MAX_RETRIES': constants.DEFAULT_CC_MAX_RETRIES,
+        'RESULTS_SINK': constants.DEFAULT_RESULTS_SINK,
+        'DB_SCAN_CONNECTIONS': constants.DEFAULT_DB_SCAN_CONNECTIONS,
+        'DB_SCAN_PARTITIONS': constants.DEFAULT_DB_SCAN_PARTITIONS,
+        'DB_QUERY_CACHE': constants.DEFAULT_DB_QUERY_CACHE,
+        'DB_QUERY_CACHE_SIZE': constants.DEFAULT_DB_QUERY_CACHE_SIZE,
+        'DB_QUERY_CACHE_TTL': constants.DEFAULT_DB_QUERY_CACHE_TTL,
+        'DIFF_MODE': constants.DEFAULT_DIFF_MODE,
+        'SAMPLE_PREFIXES': constants.DEFAULT_SAMPLE_PREFIXES,
+        'SAMPLE_PAGES': constants.DEFAULT_SAMPLE_PAGES,
+        'DRIFT_THRESHOLD': constants.DEFAULT_DRIFT_THRESHOLD,
+        'REPORT_PATH': constants.DEFAULT_REPORT_PATH,
+        'REPORT_FORMAT': constants.DEFAULT_REPORT_FORMAT,
+        'REPORT_COMPRESS': constants.DEFAULT_REPORT_COMPRESS,
+        'REPORT_DETAILS': constants.DEFAULT_REPORT_DETAILS,
+        'COORDINATE': constants.DEFAULT_COORDINATE,
+        'FOUNDATIONS': constants.DEFAULT_FOUNDATIONS,
+        'LEASE_TTL': constants.DEFAULT_LEASE_TTL,
+        'LEASE_HOLD': constants.DEFAULT_LEASE_HOLD,
+        'MYSQL_SERVICE': constants.DEFAULT_MYSQL_SERVICE,
+        'RUN_DEADLINE': constants.DEFAULT_RUN_DEADLINE,
     }
 
-    def __init__(self):
+    def __init__(self, values=None):
+        """
+        :param values: the parameters (default: read from the environment)
+        """
         super().__init__()
-        self.reload()
+        if values is None:
+            self.reload()
+        else:
+            self.update(values)
 
     def reload(self):
         #  Get required environment variables, fail if any are missing.
@@ -39,3 +74,56 @@ class SysParams(dict, metaclass=Singleton):
         #  Get optional/overridable environment variables
         self.update({key: os.getenv(key, val) for
                      key, val in self._overridable.items()})
+
+    def for_foundation(self, foundation):
+        """
+        A copy of the parameters for one foundation: FOUNDATION is set, and
+        an environment variable <NAME>__<FOUNDATION> (the foundation name in
+        upper case, other than letters and digits as '_') overrides NAME,
+        ie: OAUTH_CLIENT_SECRET__PROD or MYSQL_HOST__PROD.
+
+        :param foundation: the name of the foundation
+        :return: Params
+        """
+        suffix = '__' + re.sub(r'[^A-Z0-9]', '_', foundation.upper())
+        params = Params(self)
+        params['FOUNDATION'] = foundation
+        params.update({key[:-len(suffix)]: value
+                       for key, value in os.environ.items()
+                       if key.endswith(suffix) and len(key) > len(suffix)})
+        return params
+
+    def get_int(self, key):
+        """
+        Return a parameter as an int (environment overrides are strings).
+        """
+        return int(self[key])
+
+    def get_float(self, key):
+        """
+        Return a parameter as a float.
+        """
+        return float(self[key])
+
+    def get_list(self, key):
+        """
+        Return a comma separated parameter as a list of stripped items.
+        """
+        return [item.strip() for item in str(self[key]).split(',')
+                if item.strip()]
+
+    def get_bool(self, key):
+        """
+        Return a parameter as a bool: 'true', 'yes', 'on' and '1' are true.
+        """
+        value = self[key]
+        if isinstance(value, str):
+            return value.strip().lower() in ('true', 'yes', 'on', '1')
+        return bool(value)
+
+
+class SysParams(Params, metaclass=Singleton):
+    """
+    A utility class intended to hold all system-wide and configurable
+    parameters.
+    """
@@ -0,0 +1,195 @@
+"""
+Database query result cache.
+
+Results of read-only queries are cached per (normalized SQL, arguments)
+in a bounded LRU with a TTL.  An entry also records the UPDATE_TIME (from
+information_schema.TABLES) of each table the query reads, and is only
+reused while those are unchanged, so a write by cf-fetcher invalidates it.
+Table versions are themselves cached for a few seconds, which keeps the
+probe cheap when several queries run back to back.
+
+UPDATE_TIME is NULL for a table not written since the server started (and
+always, for InnoDB tables, before MySQL 5.7); entries for such tables are
+bounded by the TTL alone.
+
+Note(s):
+    1. Requires Python 3
+"""
+import re
+import threading
+import time
+
+import constants
+from cache import LRUCache
+from logger import Logger
+
+# Quoted strings/identifiers are kept as they are; other whitespace runs
+# are collapsed
+_TOKENS = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|\s+""")
+_TABLES = re.compile(r"\b(?:FROM|JOIN)\s+`?(\w+)`?(?:\.`?(\w+)`?)?",
+                     re.IGNORECASE)
+_READ = re.compile(r"^\(?\s*SELECT\b", re.IGNORECASE)
+_LOCKING = re.compile(r"\bFOR\s+UPDATE\b|\bLOCK\s+IN\s+SHARE\s+MODE\b",
+                      re.IGNORECASE)
+_WRITE = re.compile(r"^\s*(?:INSERT|UPDATE|DELETE|REPLACE|CREATE|ALTER|DROP|"
+                    r"TRUNCATE|RENAME|LOAD)\b", re.IGNORECASE)
+
+
+def normalize(sql):
+    """
+    Normalize a query for use as a cache key: whitespace outside quotes is
+    collapsed and a trailing semicolon dropped.
+    """
+    normal = _TOKENS.sub(lambda match: match.group(1) or ' ', sql).strip()
+    return normal[:-1].rstrip() if normal.endswith(';') else normal
+
+
+def tables(sql):
+    """
+    The names of the tables a query reads (FROM and JOIN clauses).
+    """
+    return tuple(sorted({second or first for first, second
+                         in _TABLES.findall(sql)
+                         if (first.lower() != 'information_schema')}))
+
+
+class CachedResult(object):
+    """
+    A cursor-like view of cached rows: iteration, fetchone, fetchmany and
+    fetchall, column_names and rowcount.
+    """
+    def __init__(self, rows, column_names=()):
+        self._rows = rows
+        self._pos = 0
+        self.column_names = tuple(column_names)
+        self.rowcount = len(rows)
+
+    def __iter__(self):
+        while self._pos < len(self._rows):
+            self._pos += 1
+            yield self._rows[self._pos - 1]
+
+    def fetchone(self):
+        if self._pos >= len(self._rows):
+            return None
+        self._pos += 1
+        return self._rows[self._pos - 1]
+
+    def fetchmany(self, size=1):
+        rows = list(self._rows[self._pos:self._pos + size])
+        self._pos += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = list(self._rows[self._pos:])
+        self._pos = len(self._rows)
+        return rows
+
+    def close(self):
+        pass
+
+
+class QueryCache(object):
+    """
+    LRU/TTL cache of read-only query results, invalidated by table writes.
+    """
+    _stat_names = ('hits', 'misses', 'invalidations', 'probes', 'too_large')
+
+    def __init__(self, maxsize, ttl, probe_ttl=constants.DB_QUERY_CACHE_PROBE,
+                 max_rows=constants.DB_QUERY_CACHE_MAX_ROWS,
+                 clock=time.monotonic, logger=None):
+        """
+        :param maxsize: results held
+        :param ttl: seconds a result is reused at most
+        :param probe_ttl: seconds a table's UPDATE_TIME is trusted
+        :param max_rows: larger results are not cached
+        :param clock: time source (seconds)
+        :param logger: logger to use (default: the application-wide one)
+        """
+        self.logger = Logger().logger if logger is None else logger
+        self._results = LRUCache(maxsize=maxsize, ttl=ttl, clock=clock)
+        self._versions = LRUCache(maxsize=constants.DB_QUERY_CACHE_TABLES,
+                                  ttl=probe_ttl, clock=clock)
+        self._max_rows = max_rows
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(self._stat_names, 0)
+        super().__init__()
+
+    def _count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    @property
+    def stats(self):
+        """
+        A snapshot of the cache counters.
+        """
+        with self._lock:
+            rtn = dict(self._stats)
+        rtn['size'] = len(self._results)
+        return rtn
+
+    def clear(self):
+        """
+        Drop all cached results and table versions.
+        """
+        self._results.clear()
+        self._versions.clear()
+
+    def _table_versions(self, names, probe):
+        """
+        The UPDATE_TIME of each table, probing those not recently probed.
+        """
+        versions = {}
+        missing = []
+        for name in names:
+            version = self._versions.get(name, self)
+            if version is self:
+                missing.append(name)
+            else:
+                versions[name] = version
+        if missing:
+            self._count('probes')
+            probed = probe(missing)
+            for name in missing:
+                versions[name] = probed.get(name)
+                self._versions.put(name, versions[name])
+        return versions
+
+    def query(self, sql, args, run, probe):
+        """
+        Run a query through the cache.
+
+        :param sql: the SQL query string
+        :param args: query parameters, if any
+        :param run: callable(sql, args) executing the query: a cursor
+        :param probe: callable(table names) -> {table name: UPDATE_TIME}
+        :return: cursor (uncacheable statements) or CachedResult
+        """
+        normal = normalize(sql)
+        if not _READ.match(normal) or _LOCKING.search(normal):
+            if _WRITE.match(normal):
+                self.clear()
+            return run(sql, args)
+
+        key = (normal, tuple(args) if args is not None else None)
+        versions = self._table_versions(tables(normal), probe)
+        cached = self._results.get(key)
+        if cached is not None:
+            cached_versions, rows, columns = cached
+            if cached_versions == versions:
+                self._count('hits')
+                self.logger.debug("Query cache hit: %s", normal)
+                return CachedResult(rows, columns)
+            self._count('invalidations')
+            self._results.pop(key)
+
+        self._count('misses')
+        cursor = run(sql, args)
+        rows = tuple(cursor.fetchall())
+        columns = getattr(cursor, 'column_names', None) or ()
+        if len(rows) <= self._max_rows:
+            self._results.put(key, (versions, rows, columns))
+        else:
+            self._count('too_large')
+        return CachedResult(rows, columns)
@@ -0,0 +1,237 @@
+"""
+Adaptive (AIMD) request limiting for the Cloud Controller.
+
+Each foundation gets an AdaptiveLimiter gating both the request rate (a
+token bucket) and the number of requests in flight.  Successful replies
+grow the rate and concurrency additively; a 429, or an
+X-RateLimit-Remaining budget running out, cuts them multiplicatively and
+pauses all requests until the server's Retry-After/X-RateLimit-Reset.
+
+Note(s):
+    1. Requires Python 3
+"""
+import contextlib
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+
+def backoff_delay(attempt, base=0.5, cap=30.0, rand=random.random):
+    """
+    Exponential backoff with jitter: a delay in [d/2, d] where
+    d = min(cap, base * 2**attempt).
+
+    :param attempt: zero based retry number
+    :param base: delay of the first retry (seconds)
+    :param cap: maximum delay (seconds)
+    """
+    delay = min(cap, base * (2 ** attempt))
+    return delay / 2 + delay / 2 * rand()
+
+
+def parse_retry_after(value, now=None):
+    """
+    Parse a Retry-After header (delta seconds or HTTP date) into seconds.
+
+    :return: seconds to wait, or None if absent/unparseable
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when - (time.time() if now is None else now))
+
+
+class SlotTimeout(Exception):
+    """
+    No request slot within the time allowed
+    """
+
+
+class AdaptiveLimiter(object):
+    """
+    AIMD rate and concurrency limiter for one foundation.
+    """
+    def __init__(self, rate=10.0, concurrency=2, max_rate=50.0,
+                 max_concurrency=8, min_rate=0.5, increase=1.0,
+                 decrease=0.5, reserve=5, clock=time.monotonic,
+                 wallclock=time.time):
+        """
+        :param rate: initial requests per second
+        :param concurrency: initial requests in flight
+        :param max_rate: rate ceiling
+        :param max_concurrency: in-flight ceiling
+        :param min_rate: rate floor
+        :param increase: additive rate step per successful reply
+        :param decrease: multiplicative factor applied on throttling
+        :param reserve: X-RateLimit-Remaining at which requests pause
+        :param clock: monotonic time source
+        :param wallclock: epoch time source (for X-RateLimit-Reset)
+        """
+        self.max_rate = max_rate
+        self.max_concurrency = max(1, max_concurrency)
+        self._min_rate = min_rate
+        self._increase = increase
+        self._decrease = decrease
+        self._reserve = reserve
+        self._clock = clock
+        self._wallclock = wallclock
+
+        self._rate = min(rate, max_rate)
+        self._concurrency = float(min(concurrency, self.max_concurrency))
+        self._tokens = 1.0
+        self._refilled = clock()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        self._stats = {'requests': 0, 'throttled': 0, 'paused': 0}
+        super().__init__()
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def concurrency(self):
+        return int(self._concurrency)
+
+    @property
+    def stats(self):
+        with self._cond:
+            rtn = dict(self._stats)
+            rtn.update(rate=self._rate, concurrency=int(self._concurrency))
+        return rtn
+
+    def _refill(self, now):
+        """
+        Add tokens for the time elapsed (burst of at most one second).
+        """
+        self._tokens = min(max(self._rate, 1.0),
+                           self._tokens + (now - self._refilled) * self._rate)
+        self._refilled = now
+
+    def acquire(self, timeout=None):
+        """
+        Block until a request may be sent.
+
+        :param timeout: seconds to wait at most (None: no limit)
+        :return: True, or False if no request may be sent within timeout
+                 (at once if requests are paused, or rate limited, past it)
+        """
+        with self._cond:
+            expires = None if timeout is None else self._clock() + timeout
+            while True:
+                now = self._clock()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight >= int(self._concurrency):
+                    wait = None
+                elif self._tokens < 1.0:
+                    wait = (1.0 - self._tokens) / self._rate
+                else:
+                    self._tokens -= 1.0
+                    self._in_flight += 1
+                    self._stats['requests'] += 1
+                    return True
+                if expires is not None:
+                    left = expires - now
+                    if left <= 0 or (wait is not None and wait > left):
+                        return False
+                    wait = left if wait is None else wait
+                self._cond.wait(wait)
+
+    def release(self):
+        """
+        A request has completed.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, timeout=None):
+        """
+        Context manager holding a request slot.
+
+        :param timeout: seconds to wait for it at most (None: no limit)
+        :raises SlotTimeout: if no slot is had within timeout
+        """
+        if not self.acquire(timeout):
+            raise SlotTimeout("No request slot within {:.1f}s".format(timeout))
+        try:
+            yield
+        finally:
+            self.release()
+
+    def _pause(self, seconds):
+        self._paused_until = max(self._paused_until, self._clock() + seconds)
+        self._stats['paused'] += 1
+
+    def _cut(self):
+        self._rate = max(self._min_rate, self._rate * self._decrease)
+        self._concurrency = max(1.0, self._concurrency * self._decrease)
+        self._tokens = min(self._tokens, 0.0)
+
+    def observe(self, reply):
+        """
+        Adjust to a reply's status and rate-limit headers.
+
+        :param reply: the reply to a request sent through this limiter
+        :return: seconds requests are paused for (0 if not throttled)
+        """
+        headers = reply.headers
+        with self._cond:
+            pause = 0.0
+            if reply.status_code == requests.codes.too_many_requests:
+                self._stats['throttled'] += 1
+                self._cut()
+                pause = parse_retry_after(headers.get('Retry-After'),
+                                          self._wallclock())
+                if pause is None:
+                    pause = self._reset_in(headers) or 1.0 / self._rate
+            else:
+                remaining = self._header_int(headers, 'X-RateLimit-Remaining')
+                reset_in = self._reset_in(headers)
+                if remaining is not None and remaining <= self._reserve:
+                    self._cut()
+                    pause = reset_in or 0.0
+                else:
+                    self._rate = min(self.max_rate, self._rate + self._increase)
+                    self._concurrency = min(float(self.max_concurrency),
+                                            self._concurrency +
+                                            1.0 / max(self._concurrency, 1.0))
+                    if remaining is not None and reset_in:
+                        # never plan to spend faster than the window allows
+                        self._rate = max(self._min_rate,
+                                         min(self._rate,
+                                             (remaining - self._reserve) / reset_in))
+            if pause:
+                self._pause(pause)
+            self._cond.notify_all()
+            return pause
+
+    @staticmethod
+    def _header_int(headers, name):
+        try:
+            return int(headers.get(name))
+        except (TypeError, ValueError):
+            return None
+
+    def _reset_in(self, headers):
+        """
+        Seconds until X-RateLimit-Reset (an epoch time), or None.
+        """
+        reset = self._header_int(headers, 'X-RateLimit-Reset')
+        if reset is None:
+            return None
+        return max(0.0, reset - self._wallclock())
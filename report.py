@@ -0,0 +1,197 @@
+"""
+Streaming discrepancy report writers (NDJSON, CSV, optionally gzipped).
+
+Discrepancies are written one at a time as the diff finds them, through
+buffered, chunked I/O to a file or stdout, so a report never has to be
+held in memory.  A report on stdout sends the log to stderr, so the two
+are not interleaved.
+
+Note(s):
+    1. Requires Python 3
+"""
+import abc
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+
+import constants
+from logger import Logger
+
+FIELDS = ('foundation', 'resource', 'guid', 'kind')
+# 'kind' of the trailer row written when a run is cut short
+INCOMPLETE = 'incomplete'
+
+
+class ReportWriter(abc.ABC):
+    """
+    Base report writer: a context manager with write(discrepancy).
+    Subclasses format the rows (see _emit).
+    """
+    def __init__(self, stream, foundation, resource, closers=(),
+                 details=False):
+        """
+        :param stream: text stream to write to
+        :param foundation: the name of the foundation
+        :param resource: the resource diffed, ie: 'applications'
+        :param closers: underlying streams to close after the text stream
+        :param details: include discrepancy details (see differ.enrich)
+        """
+        self._stream = stream
+        self._foundation = foundation
+        self._resource = resource
+        self._details = details
+        self._closers = list(closers)
+        self.written = 0
+        super().__init__()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+        return False
+
+    @abc.abstractmethod
+    def _emit(self, values, details=None, reason=None):
+        """
+        Write one row.
+
+        :param values: the FIELDS values
+        :param details: the discrepancy's details (details reports only)
+        :param reason: why the report is incomplete (trailer row only)
+        """
+
+    def write(self, discrepancy):
+        """
+        Write one discrepancy (see differ.Discrepancy).
+        """
+        self._emit((self._foundation, self._resource,
+                    discrepancy.guid, discrepancy.kind),
+                   details=getattr(discrepancy, 'details', None))
+        self.written += 1
+
+    def mark_incomplete(self, reason):
+        """
+        End the report with a trailer row (guid empty, kind 'incomplete')
+        saying that it is partial, ie: the run deadline passed mid-diff.
+        """
+        self._emit((self._foundation, self._resource, '', INCOMPLETE),
+                   reason=reason)
+
+    def close(self):
+        """
+        Flush and close the report (stdout itself is left open).
+        """
+        if self._stream is None:
+            return
+        self._stream.close()
+        for closer in self._closers:
+            closer.close()
+        self._stream = None
+
+
+class NDJSONWriter(ReportWriter):
+    """
+    One JSON object per line.
+    """
+    def _emit(self, values, details=None, reason=None):
+        record = dict(zip(FIELDS, values))
+        if reason is not None:
+            record['reason'] = reason
+        elif self._details:
+            record['details'] = details
+        self._stream.write(json.dumps(record, default=str))
+        self._stream.write('\n')
+
+
+class CSVWriter(ReportWriter):
+    """
+    CSV with a header row.  Details, if any, are a JSON encoded column.
+    The 'incomplete' trailer row has the reason as a trailing column of
+    its own.
+    """
+    def __init__(self, stream, foundation, resource, closers=(),
+                 details=False):
+        super().__init__(stream, foundation, resource, closers, details)
+        self._csv = csv.writer(stream)
+        self._csv.writerow(FIELDS + (('details',) if details else ()))
+
+    def _emit(self, values, details=None, reason=None):
+        if self._details:
+            values += ('' if details is None else
+                       json.dumps(details, default=str),)
+        if reason is not None:
+            values += (reason,)
+        self._csv.writerow(values)
+
+
+WRITERS = {'ndjson': NDJSONWriter,
+           'csv': CSVWriter}
+
+
+def _open_stream(path, compress, buffer_size):
+    """
+    Open a buffered text stream on path ('-' for stdout).
+
+    :return: (text stream, list of underlying streams to close after it)
+    """
+    closers = []
+    if path == '-':
+        # stdout carries the report: log records go to stderr instead
+        Logger().redirect(sys.stderr)
+        sys.stdout.flush()
+        raw = io.BufferedWriter(io.FileIO(sys.stdout.fileno(), 'w',
+                                          closefd=False), buffer_size)
+    else:
+        raw = open(path, 'wb', buffering=buffer_size)
+    if compress:
+        # GzipFile does not close the stream it wraps
+        closers.append(raw)
+        raw = io.BufferedWriter(gzip.GzipFile(fileobj=raw, mode='wb'),
+                                buffer_size)
+    stream = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+    return stream, closers
+
+
+def foundation_path(path, foundation):
+    """
+    The report path of one of several foundations: the foundation's name
+    inserted before the extension, ie: 'diff.csv.gz' becomes
+    'diff.prod-east.csv.gz' ('-', stdout, is left as it is).
+
+    :param path: the report path
+    :param foundation: the name of the foundation
+    """
+    if path == '-':
+        return path
+    stem, ext = os.path.splitext(path)
+    if ext == '.gz':
+        stem, inner = os.path.splitext(stem)
+        ext = inner + ext
+    return "{}.{}{}".format(stem, foundation, ext)
+
+
+def open_report(path, fmt, foundation, resource, compress=False,
+                buffer_size=constants.REPORT_BUFFER, details=False):
+    """
+    Open a streaming report writer.
+
+    :param path: output file, or '-' for stdout
+    :param fmt: 'ndjson' or 'csv'
+    :param foundation: the name of the foundation
+    :param resource: the resource diffed, ie: 'applications'
+    :param compress: gzip the output (also implied by a '.gz' path)
+    :param buffer_size: I/O buffer (chunk) size in bytes
+    :param details: include discrepancy details (see differ.enrich)
+    :return: ReportWriter
+    """
+    try:
+        writer_class = WRITERS[fmt.lower()]
+    except KeyError:
+        raise ValueError("Unknown report format {}".format(fmt))
+    compress = compress or path.endswith('.gz')
+    stream, closers = _open_stream(path, compress, buffer_size)
+    return writer_class(stream, foundation, resource, closers, details)
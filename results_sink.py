@@ -0,0 +1,166 @@
+"""
+Persist diff results into MySQL results tables.
+
+Each run writes one summary row to cf_diff_runs and one row per
+discrepant GUID to cf_diff_discrepancies.  GUIDs are stored with a binary
+collation: a source column that tells GUIDs apart by case may report
+both 'abc...' and 'ABC...' in one run.  Discrepancies are buffered and
+written with batched multi-row INSERTs, all inside a single transaction
+per run, so a run is recorded completely or not at all.
+
+Note(s):
+    1. Requires Python 3
+"""
+import collections
+import datetime
+import sys
+
+import constants
+import differ
+from logger import Logger
+
+RUNS_TABLE = 'cf_diff_runs'
+DISCREPANCIES_TABLE = 'cf_diff_discrepancies'
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS {} (
+        id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT,
+        foundation VARCHAR(64) NOT NULL,
+        resource VARCHAR(64) NOT NULL,
+        started_at DATETIME NOT NULL,
+        finished_at DATETIME NULL,
+        cc_count INT NULL,
+        db_count INT NULL,
+        missing_in_db INT NOT NULL DEFAULT 0,
+        missing_in_cc INT NOT NULL DEFAULT 0,
+        complete TINYINT(1) NOT NULL DEFAULT 1,
+        PRIMARY KEY (id),
+        KEY cf_diff_runs_history (foundation, resource, started_at)
+    )""".format(RUNS_TABLE),
+    """CREATE TABLE IF NOT EXISTS {} (
+        run_id BIGINT UNSIGNED NOT NULL,
+        guid VARCHAR(36) CHARACTER SET ascii COLLATE ascii_bin NOT NULL,
+        kind VARCHAR(16) NOT NULL,
+        PRIMARY KEY (run_id, guid),
+        KEY cf_diff_discrepancies_guid (guid)
+    )""".format(DISCREPANCIES_TABLE),
+]
+
+
+class ResultsSink(object):
+    """
+    Context manager recording one diff run.  Discrepancies are passed in
+    one at a time with write(); the run is committed on a clean exit and
+    rolled back if the block raises.
+    """
+    def __init__(self, db, foundation, resource,
+                 batch_size=constants.DB_INSERT_BATCH, logger=None):
+        """
+        :param db: StatsDB object
+        :param foundation: the name of the foundation
+        :param resource: the resource (table) diffed, ie: 'applications'
+        :param batch_size: discrepancy rows per INSERT
+        :param logger: logger to use (default: the application-wide one)
+        """
+        self.logger = Logger().logger if logger is None else logger
+        self._db = db
+        self._foundation = foundation
+        self._resource = resource
+        self._batch_size = batch_size
+        self._txn = None
+        self._cursor = None
+        self._run_id = None
+        self._batch = []
+        self.counts = collections.Counter()
+        self.cc_count = None
+        self.db_count = None
+        self.complete = True
+        super().__init__()
+
+    @property
+    def run_id(self):
+        return self._run_id
+
+    def ensure_tables(self):
+        """
+        Create the results tables if needed.  DDL commits implicitly in
+        MySQL, so this runs before the run's transaction is started.
+        """
+        for sql in _SCHEMA:
+            self._db.query(sql)
+
+    def __enter__(self):
+        self.ensure_tables()
+        # The run is recorded even once the run deadline has passed
+        self._txn = self._db.transaction(timeout=constants.DB_GRACE_TIMEOUT)
+        self._cursor = self._txn.__enter__()
+        self._cursor.execute(
+            "INSERT INTO {} (foundation, resource, started_at) "
+            "VALUES (%s, %s, %s)".format(RUNS_TABLE),
+            (self._foundation, self._resource, self._now()))
+        self._run_id = self._cursor.lastrowid
+        self.logger.debug("Results run %s started", self._run_id)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        txn, self._txn = self._txn, None
+        if exc_type is not None:
+            txn.__exit__(exc_type, exc_value, exc_traceback)
+            return False
+        try:
+            self._flush()
+            self._finish()
+        except Exception:
+            txn.__exit__(*sys.exc_info())
+            raise
+        txn.__exit__(None, None, None)
+        self.logger.debug("Results run %s stored: %s",
+                          self._run_id, dict(self.counts))
+        return False
+
+    @staticmethod
+    def _now():
+        return datetime.datetime.utcnow().replace(microsecond=0)
+
+    def set_counts(self, cc_count, db_count):
+        """
+        Record the total counts for the run summary.
+        """
+        self.cc_count = cc_count
+        self.db_count = db_count
+
+    def mark_incomplete(self, reason):
+        """
+        Record the run as partial (ie: the run deadline passed mid-diff).
+        """
+        self.complete = False
+        self.logger.debug("Results run %s incomplete: %s", self._run_id, reason)
+
+    def write(self, discrepancy):
+        """
+        Add one discrepancy (see differ.Discrepancy) to the run.
+        """
+        self.counts[discrepancy.kind] += 1
+        self._batch.append((self._run_id, discrepancy.guid, discrepancy.kind))
+        if len(self._batch) >= self._batch_size:
+            self._flush()
+
+    def _flush(self):
+        if self._batch:
+            self._db.insert_many(self._cursor, DISCREPANCIES_TABLE,
+                                 ['run_id', 'guid', 'kind'], self._batch,
+                                 batch_size=self._batch_size)
+            self._batch = []
+
+    def _finish(self):
+        """
+        Complete the run summary row.
+        """
+        self._cursor.execute(
+            "UPDATE {} SET finished_at = %s, cc_count = %s, db_count = %s, "
+            "missing_in_db = %s, missing_in_cc = %s, complete = %s "
+            "WHERE id = %s".format(RUNS_TABLE),
+            (self._now(), self.cc_count, self.db_count,
+             self.counts[differ.MISSING_IN_DB],
+             self.counts[differ.MISSING_IN_CC], int(self.complete),
+             self._run_id))
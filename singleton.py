@@ -1,20 +1,29 @@
 """
 A general purpose singleton metaclass.
 """
+import threading
+
 
 class Singleton(type):
     """
-    Basic singleton type
+    Basic singleton type, safe to call from several threads: the instance
+    is created once under a (per class) lock, and once created it is
+    returned without locking.
     """
+    def __init__(cls, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        cls.__instance = None
+        cls.__lock = threading.Lock()
+
     def __call__(cls, *args, **kwargs):
         """
         Override the type 'call'
         """
-        try:
-            if not cls.__instance:
-                raise AttributeError
-            else:
-                return cls.__instance
-        except AttributeError:
-            cls.__instance = super().__call__(*args, **kwargs)
-            return cls.__instance
+        instance = cls.__instance
+        if instance is None:
+            with cls.__lock:
+                instance = cls.__instance
+                if instance is None:
+                    instance = super().__call__(*args, **kwargs)
+                    cls.__instance = instance
+        return instance
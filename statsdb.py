@@ -4,30 +4,176 @@ cf_diff DB objects
 Note(s):
     1. Requires Python 3
 """
+import collections
+import concurrent.futures
+import contextlib
 import json
+import logging
 import os
-import mysql.connector
+import threading
 
+import constants
+import memory_governor
+from deadline import Deadline, DeadlineExceeded
 from logger import Logger
 from parameters import SysParams
+from query_cache import QueryCache
+
+
+def hex_ranges(partitions):
+    """
+    Split the GUID keyspace into contiguous ranges by hex prefix.
+
+    The first range has no lower bound and the last no upper bound, so
+    every value (whatever its case or first character) falls in exactly
+    one range, and the ranges are in ascending order.
+
+    The bounds are lower case hex prefixes, which compare the same way
+    under a binary collation and a case insensitive one, so the ranges'
+    rows concatenate into the column's collation order (see guid_order)
+    either way.
+
+    :param partitions: number of ranges (at most 256: one range per two
+                       hex digit prefix)
+    :return: list of (lower, upper) bounds, None meaning unbounded
+    """
+    digits = 1 if partitions <= 16 else 2
+    space = 16 ** digits
+    partitions = min(max(1, partitions), space)
+    bounds = ['{:0{}x}'.format(space * index // partitions, digits)
+              for index in range(1, partitions)]
+    lowers = [None] + bounds
+    uppers = bounds + [None]
+    return list(zip(lowers, uppers))
+
+
+class _ReadAhead(object):
+    """
+    The batches the ranges of a parallel scan have read ahead of the
+    caller, within a budget of batches shared by the ranges.  The caller
+    reads the ranges in turn; the range it is reading (the head) may
+    always hold a couple of batches, so it is never held up by the ranges
+    after it having used the budget.
+    """
+    _head_batches = 2
+
+    def __init__(self, limit):
+        """
+        :param limit: callable returning the budget (batches)
+        """
+        self._limit = limit
+        self._head = 0
+        self._held = 0
+        self._batches = collections.defaultdict(collections.deque)
+        self._finished = set()
+        self._stopped = False
+        self._cond = threading.Condition()
+        super().__init__()
+
+    def reserve(self, index):
+        """
+        Wait for room for one more batch of a range (before reading it).
+
+        :param index: the range's position in the scan
+        :return: False if the scan has stopped
+        """
+        with self._cond:
+            while not self._stopped and self._held >= self._limit() and not (
+                    index == self._head and
+                    len(self._batches[index]) < self._head_batches):
+                self._cond.wait()
+            if self._stopped:
+                return False
+            self._held += 1
+            return True
+
+    def put(self, index, batch):
+        """
+        Add the batch a range reserved room for.
+        """
+        with self._cond:
+            self._batches[index].append(batch)
+            self._cond.notify_all()
+
+    def finish(self, index, reserved):
+        """
+        Mark a range read (or failed).
+
+        :param reserved: give back a reservation the range did not use
+        """
+        with self._cond:
+            if reserved:
+                self._held -= 1
+            self._finished.add(index)
+            self._cond.notify_all()
+
+    def batches(self):
+        """
+        Generator of the head range's batches; the next range then becomes
+        the head.
+        """
+        while True:
+            with self._cond:
+                batches = self._batches[self._head]
+                while not batches and self._head not in self._finished:
+                    self._cond.wait()
+                if not batches:
+                    del self._batches[self._head]
+                    self._head += 1
+                    self._cond.notify_all()
+                    return
+                batch = batches.popleft()
+                self._held -= 1
+                self._cond.notify_all()
+            yield batch
+
+    def stop(self):
+        """
+        Stop the ranges still reading.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
 
 
 class StatsDB(object):
     """
     Generic PCF database object.
     """
-    # table index tuple: index name, table name, column name
-    _table_indices = []
-    def __init__(self):
+    # table index tuple: index name, table name, column(s)
+    # (covering indices for the diff queries)
+    _table_indices = [('cf_diff_applications_guid', 'applications',
+                       'guid, updated_at')]
+    # Query result cache (see query_cache), when enabled
+    _query_cache = None
+    # Unlimited, unless a run deadline is given
+    _deadline = Deadline()
+    # Connections are closed after use, unless a context pools them
+    _pool = None
+    # Query results are read as the query runs (see _execute)
+    _buffered = True
+
+    def __init__(self, deadline=None, context=None):
         """
+        :param deadline: run Deadline bounding connects and queries
+                         (default: the context's, or none)
+        :param context: RunContext providing the parameters, logger and
+                        connection pool (default: the application-wide
+                        parameters and logger, no pool)
         """
         mysql_env = {'user': ('username', 'MYSQL_USER'),
                      'password': ('password', 'MYSQL_PASSWORD'),
                      'host': ('hostname', 'MYSQL_HOST'),
                      'database': ('name', 'MYSQL_CF_DATABASE')}
 
-        self.logger = Logger().logger
-        self.params = SysParams()
+        if context is None:
+            self.logger = Logger().logger
+            self.params = SysParams()
+        else:
+            self.logger = context.logger
+            self.params = context.params
+            self._pool = context.db_pool
+            deadline = context.deadline if deadline is None else deadline
         self.logger.debug("Initializing StatsDB")
 
         missing = []
@@ -35,8 +181,10 @@ class StatsDB(object):
         vcap = os.environ.get('VCAP_SERVICES')
         if vcap:
             # If the VCAP environment variable is set then fetch
-            # mysql credentials from there
-            vcap_creds = json.loads(vcap)['p-mysql'][0]['credentials']
+            # mysql credentials from there: from the binding named by
+            # MYSQL_SERVICE (ie: MYSQL_SERVICE__<FOUNDATION>), or the first
+            vcap_creds = self._vcap_credentials(json.loads(vcap)['p-mysql'],
+                                                self.params['MYSQL_SERVICE'])
             for kw_key, (vc_key, _) in mysql_env.items():
                 try:
                     msql_creds[kw_key] = vcap_creds[vc_key]
@@ -45,7 +193,7 @@ class StatsDB(object):
         else:
             for param, (_, env_key) in mysql_env.items():
                 try:
-                    msql_creds[param] = msql_creds.get(param) or os.environ[env_key]
+                    msql_creds[param] = self.params.get(env_key) or os.environ[env_key]
                 except KeyError:
                     missing.append(env_key)
 
@@ -59,10 +207,18 @@ class StatsDB(object):
         self._database = msql_creds['database']
         self._autocommit = msql_creds.get('autocommit', False)
         self._buffered = msql_creds.get('buffered', True)
+        self._scan_connections = self.params.get_int('DB_SCAN_CONNECTIONS')
+        self._scan_partitions = self.params.get_int('DB_SCAN_PARTITIONS')
+        if deadline is not None:
+            self._deadline = deadline
+        if self.params.get_bool('DB_QUERY_CACHE'):
+            self._query_cache = QueryCache(
+                self.params.get_int('DB_QUERY_CACHE_SIZE'),
+                self.params.get_float('DB_QUERY_CACHE_TTL'),
+                logger=self.logger)
+        # The connection (and the mysql module) is set up by the first query
         self._conn = None
-        self._connect()
         self._cursor = None
-        self._make_table_indices(self._table_indices)
 
         super().__init__()
 
@@ -90,18 +246,184 @@ class StatsDB(object):
         self.logger.debug("DB object context exit")
         self.end()
 
+    def _existing_indices(self, tables):
+        """
+        Read the indices defined on tables from information_schema.
+
+        :param tables: table names
+        :return: dict of {(table_name, index_name): [column, ...]}
+        """
+        sql = ("SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME "
+               "FROM information_schema.STATISTICS "
+               "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({}) "
+               "ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX"
+               .format(', '.join("'{}'".format(table) for table in tables)))
+        existing = {}
+        for table_name, index_name, column in self.query(sql):
+            existing.setdefault((table_name, index_name), []).append(column)
+        return existing
+
     def _make_table_indices(self, index_list):
         """
-        Create table indices.
+        Create the table indices that do not exist yet.  An index is
+        skipped if its name exists on the table or if another index
+        already leads with the same columns.
 
         :param index_list: list of index tuples (index_name, table_name, column)
+        :return: list of the indices created
         """
-        self.logger.debug('Creating %d table indices', len(index_list))
-        index_sql = 'CREATE OR REPLACE INDEX {} ON {}({})'
+        if not index_list:
+            return []
+        existing = self._existing_indices({table for _, table, _ in index_list})
+        created = []
+        index_sql = 'CREATE INDEX {} ON {}({})'
         for (index_name, table_name, column) in index_list:
+            columns = [col.strip() for col in column.split(',')]
+            covered = [name for (table, name), cols in existing.items()
+                       if table == table_name and
+                       (name == index_name or cols[:len(columns)] == columns)]
+            if covered:
+                self.logger.debug('Index %s on %s exists (%s)', index_name,
+                                  table_name, ', '.join(covered))
+                continue
             sql = index_sql.format(index_name, table_name, column)
-            self.logger.debug('Index: %s', sql)
+            self.logger.info('Creating index: %s', sql)
             self.query(sql)
+            created.append(index_name)
+        return created
+
+    def ensure_indices(self):
+        """
+        Create any missing declared indices.  Failure (for instance a user
+        without the INDEX privilege) is logged, not raised: the diff still
+        works, only slower.
+
+        :return: list of the indices created
+        """
+        try:
+            return self._make_table_indices(self._table_indices)
+        except Exception as exn:
+            self.logger.warning("Index provisioning failed: %s", str(exn))
+            return []
+
+    def explain(self, sql):
+        """
+        Return the EXPLAIN plan of a query as a list of dicts.
+        """
+        cursor = self.query("EXPLAIN " + sql)
+        columns = cursor.column_names
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def verify_query_plan(self, sql):
+        """
+        EXPLAIN a query and warn if any table is read with a full scan or
+        sorted without an index.
+
+        :param sql: the SQL query string
+        :return: True if the plan uses indices throughout
+        """
+        good = True
+        for step in self.explain(sql):
+            extra = step.get('Extra') or ''
+            if step.get('type') == 'ALL' or 'Using filesort' in extra:
+                self.logger.warning("Query plan for <%s> does a full scan of "
+                                    "%s (type %s, %s)", sql, step.get('table'),
+                                    step.get('type'), extra or 'no extra')
+                good = False
+            else:
+                self.logger.debug("Query plan for <%s>: %s uses %s", sql,
+                                  step.get('table'), step.get('key'))
+        return good
+
+    def _vcap_credentials(self, services, name):
+        """
+        The credentials of a bound p-mysql service.
+
+        :param services: the p-mysql entries of VCAP_SERVICES
+        :param name: the binding's name (empty: the first binding)
+        :return: dict of credentials (empty if no binding has that name)
+        """
+        if not name:
+            return services[0]['credentials']
+        for service in services:
+            if service.get('name') == name:
+                return service['credentials']
+        self.logger.error("No p-mysql service named %s bound", name)
+        return {}
+
+    def _new_connection(self, timeout=None):
+        """
+        Open and return a new connection to the database server.
+
+        The connection (socket) timeout and the session's SELECT time
+        limit are the time remaining to the run deadline, if there is one.
+        A connection is taken from the context's pool if one of the same
+        timeout class (bounded by the deadline, or the same fixed timeout)
+        is idle.  The socket timeout of a reused deadline bounded
+        connection is the time that remained when it was opened, so its
+        SELECT time limit is set again to the time remaining now.
+
+        :param timeout: fixed timeout in seconds instead of the deadline's
+        :raises DeadlineExceeded: if the deadline has passed
+        """
+        bounded = timeout is None
+        if bounded:
+            timeout = self._deadline.whole_seconds()
+        conn = (self._pool.get(None if bounded else timeout)
+                if self._pool is not None else None)
+        if conn is not None:
+            if bounded and timeout is not None:
+                self._limit_execution_time(conn, timeout)
+            return conn
+
+        import mysql.connector
+        kwargs = {} if timeout is None else {'connection_timeout': timeout}
+        try:
+            conn = mysql.connector.connect(user=self._user,
+                                           password=self._password,
+                                           host=self._host,
+                                           database=self._database, **kwargs)
+        except:
+            msg = "Failed to create MySQL connection"
+            self.logger.error(msg)
+            self.logger.debug("%s (user: %s, pwd: %s, host: %s, db: %s)",
+                              msg, self._user, self._password, self._host,
+                              self._database)
+            if bounded and self._deadline.expired:
+                raise DeadlineExceeded("Deadline exceeded connecting")
+            raise
+        if bounded and timeout is not None:
+            self._limit_execution_time(conn, timeout)
+        return conn
+
+    def _limit_execution_time(self, conn, seconds):
+        """
+        Bound the SELECT statements of a session (MySQL 5.7.8 and later;
+        ignored where unsupported).
+        """
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SET SESSION max_execution_time = {:d}"
+                           .format(int(seconds * 1000)))
+            cursor.close()
+        except Exception as exn:
+            self.logger.debug("max_execution_time not set: %s", str(exn))
+
+    def _release(self, conn, timeout=None):
+        """
+        Return a connection to the context's pool (ending any transaction
+        its reads opened), or close it if there is no pool or it is full.
+
+        :param timeout: the fixed timeout conn was opened with, if any
+        """
+        if self._pool is not None:
+            try:
+                conn.rollback()
+                if self._pool.put(conn, timeout):
+                    return
+            except Exception as exn:
+                self.logger.debug("Connection not pooled: %s", str(exn))
+        conn.close()
 
     def _connect(self):
         """
@@ -110,23 +432,76 @@ class StatsDB(object):
         """
         self.logger.debug("Make DB connection")
         if self._conn:
-            self._conn.close()
+            self._release(self._conn)
+            self._conn = None
         try:
-            self._conn = mysql.connector.connect(user=self._user,
-                                                 password=self._password,
-                                                 host=self._host,
-                                                 database=self._database)
+            self._conn = self._new_connection()
             self._cursor = self._conn.cursor(buffered=self._buffered)
             self._conn.autocommit = self._autocommit
         except:
-            msg = "Failed to create MySQL connection"
-            self.logger.error(msg)
-            self.logger.debug("%s (user: %s, pwd: %s, host: %s, db: %s)",
-                              msg, self._user, self._password, self._host,
-                              self._database)
             self._conn = None
             raise
 
+    @contextlib.contextmanager
+    def transaction(self, timeout=None):
+        """
+        Context manager running statements in one transaction on a
+        dedicated connection: committed on success, rolled back on error.
+
+        :param timeout: fixed connection timeout instead of the deadline's
+                        (for bookkeeping that must outlive the deadline)
+        :return: cursor for the transaction
+        """
+        self.logger.debug("Begin transaction")
+        conn = self._new_connection(timeout)
+        cursor = conn.cursor()
+        committed = False
+        try:
+            conn.start_transaction()
+            yield cursor
+            conn.commit()
+            committed = True
+            self.logger.debug("Transaction committed")
+        except:
+            self.logger.warning("Transaction rolled back")
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            if committed:
+                self._release(conn, timeout)
+            else:
+                conn.close()
+
+    @staticmethod
+    def insert_many(cursor, table, columns, rows,
+                    batch_size=constants.DB_INSERT_BATCH):
+        """
+        Insert rows in batches; each batch is sent by executemany as a
+        single multi-row INSERT.
+
+        :param cursor: cursor (normally from transaction())
+        :param table: table name
+        :param columns: list of column names
+        :param rows: iterable of row tuples
+        :param batch_size: rows per INSERT statement
+        :return: number of rows inserted
+        """
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            table, ', '.join(columns), ', '.join(['%s'] * len(columns)))
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+            count += len(batch)
+        return count
+
     @staticmethod
     def row_to_dict(row, column_list):
         """
@@ -136,37 +511,84 @@ class StatsDB(object):
         :param column_list: column name mapping
         :return: dict
         """
-        Logger().logger.debug("Convert query row to dict")
+        logger = Logger().logger
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug("Convert query row to dict")
 
         if len(row) != len(column_list):
-            Logger().logger.warning("WARNING: query row %d items, %d expected",
-                                    len(row), len(column_list))
+            logger.warning("WARNING: query row %d items, %d expected",
+                           len(row), len(column_list))
             rtn = {}
         else:
             rtn = dict(zip(column_list, row))
-        Logger().logger.debug("row_to_dict returning dict length %d", len(rtn))
+        if debug:
+            logger.debug("row_to_dict returning dict length %d", len(rtn))
         return rtn
 
-    def query(self, sql):
+    def query(self, sql, args=None):
         """
         Set the cursor and run the query.
 
         If the connection is closed (timed out) then reconnect and try again.
+        With the query cache enabled, read-only queries may be answered
+        from it (see query_cache), as a cursor-like CachedResult.
 
         :param sql: the SQL query string
+        :param args: query parameters (for %s placeholders), if any
         :return: cursor object resulting from query
         """
+        if self._query_cache is not None:
+            return self._query_cache.query(sql, args, self._execute,
+                                           self._table_versions)
+        return self._execute(sql, args)
+
+    def _execute(self, sql, args=None):
+        """
+        Run a query on the shared cursor (see query).
+        """
         self.logger.debug("Run SQL query: %s", sql)
         self._connect()
         try:
             self.logger.debug("Execute SQL")
-            self._cursor.execute(sql)
+            if args is None:
+                self._cursor.execute(sql)
+            else:
+                self._cursor.execute(sql, args)
         except:
             self.logger.warning("mySQL query failed: %s", sql)
+            if self._deadline.expired:
+                raise DeadlineExceeded("Deadline exceeded during query")
             raise
-        self._conn.close()
+        if self._buffered:
+            # The rows are read already: the connection can be reused (an
+            # unbuffered one is kept until the next query reads them)
+            self._release(self._conn)
+            self._conn = None
         return self._cursor
 
+    def _table_versions(self, tables):
+        """
+        The last write time of tables, from information_schema (the query
+        cache's invalidation probe).
+
+        :param tables: table names
+        :return: dict of {table_name: UPDATE_TIME or None}
+        """
+        sql = ("SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES "
+               "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({})"
+               .format(', '.join(['%s'] * len(tables))))
+        return dict(self._execute(sql, tuple(tables)).fetchall())
+
+    @property
+    def query_cache_stats(self):
+        """
+        Query cache counters (None when the cache is disabled).
+        """
+        if self._query_cache is None:
+            return None
+        return self._query_cache.stats
+
     def query_dict(self, sql, column_list):
         """
         Execute an SQL query, then return a list of dicts where each list
@@ -211,3 +633,222 @@ class StatsDB(object):
         else:
             retn = self.query(sql)
         return retn
+
+    def guids(self, table, column='guid', connections=None, partitions=None):
+        """
+        Generator of the distinct GUIDs in a table, in ascending order (of
+        the column's collation, see guid_order).
+
+        The rows are fetched in batches (see _scan_range), so only a few
+        batches are held at a time.  With more than one connection the
+        keyspace is split into hex prefix ranges (see hex_ranges) which
+        are read concurrently, one connection per range, and yielded in
+        range order.
+
+        :param table: table name
+        :param column: GUID column name
+        :param connections: concurrent connections (default DB_SCAN_CONNECTIONS)
+        :param partitions: ranges to split into (default DB_SCAN_PARTITIONS)
+        """
+        connections = connections or self._scan_connections
+        if connections <= 1:
+            for batch in self._scan_range(table, column, None, None):
+                yield from batch
+            return
+        ranges = hex_ranges(max(partitions or self._scan_partitions,
+                                connections))
+        yield from self._parallel_scan(table, column, ranges, connections)
+
+    def _parallel_scan(self, table, column, ranges, connections):
+        """
+        Read ranges concurrently, yielding their rows in range order.  At
+        most 'connections' ranges are read at a time, and the batches read
+        ahead of the caller are bounded by DB_SCAN_READ_AHEAD rows (see
+        _ReadAhead); both are scaled down under memory pressure (see
+        memory_governor).
+        """
+        self.logger.debug("Scan %s.%s: %d ranges over %d connections",
+                          table, column, len(ranges), connections)
+        governor = memory_governor.governor()
+        read_ahead = _ReadAhead(lambda: governor.scale(
+            constants.DB_SCAN_READ_AHEAD // constants.DB_FETCH_BATCH))
+        pending = collections.deque()
+        todo = enumerate(ranges)
+        with concurrent.futures.ThreadPoolExecutor(connections) as pool:
+
+            def submit_more():
+                while len(pending) < governor.scale(connections):
+                    index, bounds = next(todo, (None, None))
+                    if bounds is None:
+                        return
+                    pending.append(pool.submit(self._read_range, table,
+                                               column, bounds, index,
+                                               read_ahead))
+
+            try:
+                submit_more()
+                while pending:
+                    for batch in read_ahead.batches():
+                        yield from batch
+                    pending.popleft().result()
+                    self._deadline.check("scanning {}".format(table))
+                    submit_more()
+            finally:
+                read_ahead.stop()
+                for future in pending:
+                    future.cancel()
+
+    def _read_range(self, table, column, bounds, index, read_ahead):
+        """
+        Read one range of a parallel scan into the read-ahead, a batch at
+        a time as its budget allows, until done or stopped.
+        """
+        scan = self._scan_range(table, column, *bounds)
+        reserved = False
+        try:
+            while read_ahead.reserve(index):
+                reserved = True
+                batch = next(scan, None)
+                if batch is None:
+                    break
+                read_ahead.put(index, batch)
+                reserved = False
+        finally:
+            scan.close()
+            read_ahead.finish(index, reserved)
+
+    def _scan_range(self, table, column, lower, upper):
+        """
+        Read one GUID range on its own connection, with an unbuffered
+        cursor: a generator of batches (lists) of GUIDs in [lower, upper),
+        ascending, their size scaled to the memory budget.
+        """
+        sql, args = self.range_sql(table, column, lower, upper)
+        governor = memory_governor.governor()
+        conn = self._new_connection()
+        done = False
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, args)
+            while True:
+                rows = cursor.fetchmany(governor.scale(
+                    constants.DB_FETCH_BATCH, constants.DB_MIN_FETCH_BATCH))
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+                self._deadline.check("scanning {}".format(table))
+            cursor.close()
+            done = True
+        except DeadlineExceeded:
+            raise
+        except Exception:
+            if self._deadline.expired:
+                raise DeadlineExceeded("Deadline exceeded during scan")
+            raise
+        finally:
+            if done:
+                self._release(conn)
+            else:
+                conn.close()
+
+    @staticmethod
+    def range_sql(table, column, lower, upper):
+        """
+        The query (and arguments) reading one range of a parallel scan.
+        The bounds compare, and the rows are ordered, in the column's
+        collation, so the ranges of hex_ranges read in turn yield the
+        column in guid_order.
+        """
+        where, args = [], []
+        if lower is not None:
+            where.append("{} >= %s".format(column))
+            args.append(lower)
+        if upper is not None:
+            where.append("{} < %s".format(column))
+            args.append(upper)
+        sql = "SELECT DISTINCT {0} FROM {1}".format(column, table)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        return sql + " ORDER BY {}".format(column), tuple(args)
+
+    def guid_order(self, table, column='guid'):
+        """
+        The sort key of the order guids() yields a column in, which is the
+        column's collation's.  A binary collation orders GUIDs by code
+        point, as Python does; any other (ie: utf8_general_ci) orders them
+        regardless of case, so as their lower case forms.
+
+        :return: None (code point order) or str.lower
+        """
+        cursor = self.query(
+            "SELECT COLLATION_NAME FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+            "AND COLUMN_NAME = %s", (table, column))
+        rows = cursor.fetchall()
+        collation = rows[0][0] if rows else None
+        if collation is None or collation == 'binary' or \
+                collation.endswith('_bin'):
+            return None
+        return str.lower
+
+    @staticmethod
+    def guids_sql(table, column='guid'):
+        """
+        The query behind guids()
+        """
+        return "SELECT DISTINCT {0} FROM {1} ORDER BY {0}".format(column, table)
+
+    def guids_with_prefixes(self, table, prefixes, column='guid'):
+        """
+        Return the distinct GUIDs starting with any of the given prefixes.
+
+        :param table: table name
+        :param prefixes: GUID prefixes, ie: ['ab', '3f']
+        :param column: GUID column name
+        :return: list of GUIDs
+        """
+        if not prefixes:
+            return []
+        sql = "SELECT DISTINCT {0} FROM {1} WHERE {2}".format(
+            column, table, ' OR '.join(["{} LIKE %s".format(column)] *
+                                       len(prefixes)))
+        cursor = self.query(sql, tuple(prefix + '%' for prefix in prefixes))
+        return [guid for (guid,) in cursor]
+
+    def lookup(self, table, guids, columns=None, column='guid'):
+        """
+        Look up many rows by GUID, one 'WHERE guid IN (...)' query per
+        DB_IN_BATCH GUIDs.
+
+        :param table: table name
+        :param guids: iterable of GUIDs
+        :param columns: columns to return (default: all)
+        :param column: GUID column name
+        :return: dict of GUID: row dict, for the GUIDs found
+        """
+        if columns is not None and column not in columns:
+            columns = [column] + list(columns)
+        select = ', '.join(columns) if columns is not None else '*'
+        guids = list(guids)
+        found = {}
+        for start in range(0, len(guids), constants.DB_IN_BATCH):
+            chunk = guids[start:start + constants.DB_IN_BATCH]
+            sql = "SELECT {} FROM {} WHERE {} IN ({})".format(
+                select, table, column, ', '.join(['%s'] * len(chunk)))
+            cursor = self.query(sql, tuple(chunk))
+            names = columns if columns is not None else cursor.column_names
+            for row in cursor:
+                record = dict(zip(names, row))
+                found[record[column]] = record
+        return found
+
+    def existing_guids(self, table, guids, column='guid'):
+        """
+        Return the subset of guids present in a table.
+
+        :param table: table name
+        :param guids: iterable of GUIDs
+        :param column: GUID column name
+        :return: set of GUIDs found
+        """
+        return set(self.lookup(table, guids, columns=[column], column=column))
@@ -0,0 +1,64 @@
+"""
+Unit tests for the cf-diff tool cache module
+"""
+import unittest
+
+import cache
+
+#pylint: disable=protected-access, invalid-name
+
+
+class FakeClock(object):
+    """
+    Manually advanced time source.
+    """
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRUCache(unittest.TestCase):
+    """
+    Test basic operation of the LRUCache class.
+    """
+    def testGetPut(self):
+        """
+        Test a simple put/get round trip and the hit/miss counters
+        """
+        lru = cache.LRUCache(maxsize=2)
+        self.assertIsNone(lru.get('a'))
+        lru.put('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        stats = lru.stats
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (1, 1, 1))
+
+    def testEviction(self):
+        """
+        Test that the least recently used entry is evicted
+        """
+        lru = cache.LRUCache(maxsize=2)
+        lru.put('a', 1)
+        lru.put('b', 2)
+        lru.get('a')
+        lru.put('c', 3)
+        self.assertEqual(lru.get('b', 'gone'), 'gone')
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+        self.assertEqual(lru.stats['evictions'], 1)
+
+    def testExpiry(self):
+        """
+        Test that entries older than the TTL are dropped
+        """
+        clock = FakeClock()
+        lru = cache.LRUCache(maxsize=2, ttl=10, clock=clock)
+        lru.put('a', 1)
+        clock.now += 5
+        self.assertEqual(lru.get('a'), 1)
+        clock.now += 6
+        self.assertIsNone(lru.get('a'))
+        self.assertEqual(lru.stats['expired'], 1)
+        self.assertEqual(len(lru), 0)
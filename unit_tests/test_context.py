@@ -0,0 +1,202 @@
+"""
+Unit tests for the cf-diff tool context module
+"""
+import json
+import logging
+import os
+import pytest
+import threading
+import unittest
+
+from mock import patch, MagicMock
+
+import cc_fetcher
+import context
+import deadline
+import parameters
+import singleton
+import statsdb
+
+#pylint: disable=protected-access, invalid-name
+
+
+class TestSingleton(unittest.TestCase):
+    """
+    Test the singleton metaclass under threads.
+    """
+    def testRace(self):
+        """
+        Test that threads racing to create the instance get the same one
+        """
+        created = []
+        barrier = threading.Barrier(8)
+
+        class Slow(object, metaclass=singleton.Singleton):
+            def __init__(self):
+                created.append(self)
+                super().__init__()
+
+        def first_call(results):
+            barrier.wait()
+            results.append(Slow())
+
+        results = []
+        threads = [threading.Thread(target=first_call, args=(results,))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(created), 1)
+        self.assertTrue(all(result is created[0] for result in results))
+
+        class Other(Slow):
+            pass
+        self.assertIsNot(Other(), Slow())
+
+
+class TestConnectionPool(unittest.TestCase):
+    """
+    Test the idle connection pool.
+    """
+    def testGetPut(self):
+        """
+        Test connections are reused up to the size, dead ones dropped
+        """
+        pool = context.ConnectionPool(size=2)
+        self.assertIsNone(pool.get())
+        live, dead, extra = MagicMock(), MagicMock(), MagicMock()
+        dead.is_connected.return_value = False
+        self.assertTrue(pool.put(live))
+        self.assertTrue(pool.put(dead))
+        self.assertFalse(pool.put(extra))
+        self.assertIs(pool.get(), live)
+        dead.close.assert_called_once_with()
+        self.assertIsNone(pool.get())
+
+        pool.put(live)
+        pool.close()
+        live.close.assert_called_once_with()
+        self.assertIsNone(pool.get())
+
+    def testTimeoutClasses(self):
+        """
+        Test connections are only reused for their own timeout class
+        """
+        pool = context.ConnectionPool(size=2)
+        bounded, grace, extra = MagicMock(), MagicMock(), MagicMock()
+        self.assertTrue(pool.put(bounded))
+        self.assertTrue(pool.put(grace, 30))
+        self.assertFalse(pool.put(extra, 30))
+        self.assertIsNone(pool.get(10))
+        self.assertIs(pool.get(30), grace)
+        self.assertIsNone(pool.get(30))
+        self.assertIs(pool.get(), bounded)
+
+
+class TestRunContext(unittest.TestCase):
+    """
+    Test run contexts.
+    """
+    _env_dict = {'CC_URL': 'a/b/{foundation}/d',
+                 'FOUNDATION': 'foundation',
+                 'OAUTH_CLIENT_ID': 'client_id',
+                 'OAUTH_CLIENT_SECRET': 'shhhh',
+                 'MYSQL_USER': 'mysqlUser',
+                 'MYSQL_PASSWORD': 'mysqlPassword',
+                 'MYSQL_HOST': 'mysqlHost',
+                 'MYSQL_CF_DATABASE': 'mysqlDB',
+                 'OAUTH_CLIENT_ID__EAST': 'east_id',
+                 'MYSQL_HOST__EAST': 'eastHost'}
+
+    def setUp(self):
+        """
+        Test setups: patch out functions across all tests.
+        """
+        patch.dict(os.environ, self._env_dict).start()
+        parameters.SysParams().reload()
+
+    def tearDown(self):
+        """
+        Test teardowns: clean up test-wide patches.
+        """
+        patch.stopall()
+
+    def testDefaults(self):
+        """
+        Test a context defaults to the application-wide objects
+        """
+        run_context = context.RunContext()
+        self.assertIs(run_context.params, parameters.SysParams())
+        self.assertIsNone(run_context.deadline.budget)
+        self.assertIs(run_context.db_pool, run_context.db_pool)
+        session = run_context.session
+        self.assertIs(run_context.session, session)
+        adapter = session.get_adapter('https://cc.example.com')
+        self.assertEqual(adapter._pool_maxsize,
+                         parameters.SysParams().get_int('CC_MAX_CONCURRENCY'))
+        with patch.object(session, 'close') as mock_close:
+            run_context.close()
+        mock_close.assert_called_once_with()
+
+    def testForFoundation(self):
+        """
+        Test fetchers and databases of two foundations do not share state
+        """
+        run_deadline = deadline.Deadline(60)
+        root = context.RunContext(deadline=run_deadline)
+        east = root.for_foundation('east')
+        west = root.for_foundation('west')
+        self.assertIs(east.deadline, run_deadline)
+        self.assertIsNot(east.session, west.session)
+        self.assertIsNot(east.db_pool, west.db_pool)
+
+        fetchers = {}
+
+        def make(name, run_context):
+            fetchers[name] = (cc_fetcher.CCFetcher(context=run_context),
+                              statsdb.StatsDB(context=run_context))
+
+        threads = [threading.Thread(target=make, args=args)
+                   for args in (('east', east), ('west', west))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        east_cc, east_db = fetchers['east']
+        west_cc, west_db = fetchers['west']
+        self.assertEqual(east_cc._oauth_id, 'east_id')
+        self.assertEqual(west_cc._oauth_id, 'client_id')
+        self.assertEqual(east_db._host, 'eastHost')
+        self.assertEqual(west_db._host, 'mysqlHost')
+        self.assertIs(east_cc._http, east.session)
+        self.assertIs(east_db._pool, east.db_pool)
+        self.assertIs(west_db._deadline, run_deadline)
+        self.assertEqual(parameters.SysParams()['FOUNDATION'], 'foundation')
+
+        self.assertIsInstance(east.logger, logging.LoggerAdapter)
+        self.assertEqual(east.logger.extra, {'foundation': 'east'})
+        for run_context in (east, west, root):
+            run_context.close()
+
+    def testForFoundationVcap(self):
+        """
+        Test that with bound services each foundation's database is the
+        binding its MYSQL_SERVICE names
+        """
+        def binding(name, host):
+            return {'name': name,
+                    'credentials': {'username': 'u', 'password': 'p',
+                                    'hostname': host, 'name': 'cf'}}
+        vcap = {'p-mysql': [binding('leases', 'leasesHost'),
+                            binding('east-db', 'eastHost')]}
+        with patch.dict(os.environ, {'VCAP_SERVICES': json.dumps(vcap),
+                                     'MYSQL_SERVICE__EAST': 'east-db',
+                                     'MYSQL_SERVICE__WEST': 'west-db'}):
+            root = context.RunContext(params=parameters.Params())
+            self.assertEqual(statsdb.StatsDB(context=root)._host,
+                             'leasesHost')
+            east = root.for_foundation('east')
+            self.assertEqual(statsdb.StatsDB(context=east)._host, 'eastHost')
+            with pytest.raises(SystemExit):
+                statsdb.StatsDB(context=root.for_foundation('west'))
@@ -0,0 +1,93 @@
+"""
+Unit tests for the cf-diff tool deadline module
+"""
+import unittest
+
+import pytest
+from mock import patch
+
+import deadline
+
+#pylint: disable=protected-access, invalid-name
+
+
+class TestDeadline(unittest.TestCase):
+    """
+    Test the run deadline budget.
+    """
+    def setUp(self):
+        self.now = 100.0
+
+    def clock(self):
+        return self.now
+
+    def testUnlimited(self):
+        """
+        Test that without a budget nothing is bounded
+        """
+        run = deadline.Deadline(clock=self.clock)
+        self.now += 10 ** 6
+        self.assertIsNone(run.remaining())
+        self.assertFalse(run.expired)
+        self.assertEqual(run.timeout(5), 5)
+        self.assertIsNone(run.timeout())
+        self.assertIsNone(run.whole_seconds())
+        run.check()
+
+    def testRemaining(self):
+        """
+        Test call timeouts are capped by the time remaining
+        """
+        run = deadline.Deadline(30, clock=self.clock)
+        self.now += 10
+        self.assertEqual(run.remaining(), 20)
+        self.assertEqual(run.timeout(5), 5)
+        self.assertEqual(run.timeout(60), 20)
+        self.now += 19.5
+        self.assertEqual(run.timeout(), 0.5)
+        self.assertEqual(run.whole_seconds(), 1)
+
+    def testExpired(self):
+        """
+        Test that no call is started once the deadline has passed
+        """
+        run = deadline.Deadline(1, clock=self.clock)
+        self.now += 2
+        self.assertTrue(run.expired)
+        self.assertEqual(run.remaining(), 0)
+        with pytest.raises(deadline.DeadlineExceeded):
+            run.timeout(5)
+        with pytest.raises(deadline.DeadlineExceeded) as exn:
+            run.check("counting")
+        self.assertEqual(str(exn.value), "Deadline exceeded before counting")
+
+    def testSleep(self):
+        """
+        Test that a backoff sleep never outlasts the deadline
+        """
+        run = deadline.Deadline(10, clock=self.clock)
+        with patch('time.sleep') as mock_sleep:
+            run.sleep(2)
+            with pytest.raises(deadline.DeadlineExceeded):
+                run.sleep(10)
+        mock_sleep.assert_called_once_with(2)
+
+    def testCancel(self):
+        """
+        Test a derived deadline expires with its parent, or when cancelled
+        on its own
+        """
+        run = deadline.Deadline(30, clock=self.clock)
+        share = run.derive()
+        self.assertEqual(share.remaining(), 30)
+        share.cancel("Lease lost")
+        self.assertTrue(share.expired)
+        self.assertFalse(run.expired)
+        self.assertEqual(share.remaining(), 0)
+        for call in (share.check, share.timeout, lambda: share.sleep(1)):
+            with pytest.raises(deadline.DeadlineExceeded) as exn:
+                call()
+            self.assertEqual(str(exn.value), "Lease lost")
+        other = run.derive()
+        self.now += 31
+        self.assertTrue(other.expired)
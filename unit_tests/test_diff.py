@@ -1,13 +1,23 @@
 """
 Unit tests for the cf-diff tool cf_diff module
 """
-from mock import patch, MagicMock
+from mock import ANY, call, patch, MagicMock
 from testfixtures import LogCapture
+import collections
+import json
 import logging
 import os
+import shutil
+import tempfile
 import unittest
 
 import cf_diff
+import context
+import deadline
+import differ
+import estimator
+import parameters
+import report
 import statsdb
 
 #pylint: disable=protected-access, invalid-name
@@ -39,12 +49,226 @@ class TestCFDiff(unittest.TestCase):
         with patch("cc_fetcher.CCFetcher.__init__", return_value=None) as mock_fetcher, \
              patch("statsdb.StatsDB.__init__", return_value=None) as mock_stats, \
              patch("cf_diff.get_counts", return_value=(1, 2)) as mock_counts, \
+             patch("cf_diff.prepare_db") as mock_prepare, \
              LogCapture(level=logging.INFO) as log_info:
             cf_diff.main()
         mock_counts.assert_called_once()
+        mock_prepare.assert_called_once()
         log_info.check(('logger', 'INFO',
                         '[Foundation foundation] CloudController: 1, Database: 2'))
 
+    def testMainReport(self):
+        """
+        Test that a report path runs the GUID diff into a report writer
+        """
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'report.ndjson')
+        found = [differ.Discrepancy('g1', differ.MISSING_IN_DB)]
+
+        def fake_diff(foundation, cc_obj, db_obj, consumers, details=False,
+                      counts=None):
+            for consumer in consumers:
+                consumer.write(found[0])
+            return {differ.MISSING_IN_DB: 1, differ.MISSING_IN_CC: 0}
+
+        with patch("cc_fetcher.CCFetcher.__init__", return_value=None), \
+             patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("cf_diff.get_counts", return_value=(1, 2)), \
+             patch("cf_diff.prepare_db"), \
+             patch("cf_diff.diff_guids", side_effect=fake_diff), \
+             patch.dict(parameters.SysParams(), {'REPORT_PATH': path}), \
+             LogCapture(level=logging.INFO) as log_info:
+            cf_diff.main()
+        with open(path) as infile:
+            self.assertEqual(json.loads(infile.read())['guid'], 'g1')
+        shutil.rmtree(tmpdir)
+        log_info.check(('logger', 'INFO',
+                        '[Foundation foundation] CloudController: 1, Database: 2'),
+                       ('logger', 'INFO',
+                        '[Foundation foundation] missing in Database: 1, '
+                        'missing in CloudController: 0'))
+
+    def testMainCoordinate(self):
+        """
+        Test that coordination mode audits only the foundations it leases
+        """
+        manager = MagicMock()
+        manager.owner = 'me'
+        lease = MagicMock()
+        lease.lost = False
+        manager.claim.side_effect = [lease, None, lease]
+        with patch("cc_fetcher.CCFetcher.__init__", return_value=None), \
+             patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("leases.LeaseManager", return_value=manager), \
+             patch("cf_diff.audit",
+                   side_effect=[True, RuntimeError("down")]) as mock_audit, \
+             patch.dict(parameters.SysParams(), {'COORDINATE': 'true',
+                                                 'FOUNDATIONS': 'a, b,c'}), \
+             LogCapture(level=logging.INFO) as log_info:
+            cf_diff.main()
+        manager.ensure_table.assert_called_once_with()
+        self.assertEqual(manager.claim.call_args_list,
+                         [call('a', 'applications', deadline=ANY),
+                          call('b', 'applications', deadline=ANY),
+                          call('c', 'applications', deadline=ANY)])
+        self.assertEqual([c[0][0] for c in mock_audit.call_args_list],
+                         ['a', 'c'])
+        self.assertEqual(lease.__exit__.call_count, 2)
+        log_info.check(('logger', 'ERROR',
+                        '[Foundation c] audit failed, lease released: down'),
+                       ('logger', 'INFO', 'me audited 1 of 3 foundations: a'))
+
+    def testCoordinate(self):
+        """
+        Test each foundation is audited against its own database, the leases
+        staying on the shared one, and that an audit whose lease is lost
+        stops and is not counted as audited
+        """
+        manager = MagicMock()
+        manager.owner = 'me'
+        lease = MagicMock()
+        lease.lost = False
+        manager.claim.return_value = lease
+        shared_db = MagicMock()
+        audits = []
+
+        def fake_audit(foundation, cc_fetcher, db_obj, fcontext):
+            audits.append((foundation, db_obj, fcontext.params['MYSQL_HOST']))
+            if foundation == 'west':
+                # the heartbeat finds the lease taken over
+                manager.claim.call_args[1]['deadline'].cancel("lost")
+                lease.lost = True
+                self.assertTrue(fcontext.deadline.expired)
+                return False
+            return True
+
+        run = context.RunContext(params=parameters.Params(
+            {'LEASE_TTL': '60', 'LEASE_HOLD': '600', 'MYSQL_HOST': 'shared',
+             'REPORT_PATH': ''}))
+        with patch("cc_fetcher.CCFetcher.__init__", return_value=None), \
+             patch("cf_diff.StatsDB",
+                   side_effect=lambda context: context.params) as mock_stats, \
+             patch("leases.LeaseManager", return_value=manager) as mock_mgr, \
+             patch("cf_diff.audit", side_effect=fake_audit), \
+             patch.dict(os.environ, {'MYSQL_HOST__WEST': 'west-db'}), \
+             LogCapture(level=logging.INFO) as log_info:
+            self.assertEqual(cf_diff.coordinate(['east', 'west'], shared_db,
+                                                run), ['east'])
+        mock_mgr.assert_called_once_with(shared_db, ttl=60.0, hold=600.0,
+                                         logger=run.logger)
+        self.assertEqual(mock_stats.call_count, 2)
+        self.assertEqual([(name, host) for name, _, host in audits],
+                         [('east', 'shared'), ('west', 'west-db')])
+        self.assertFalse(run.deadline.expired)
+        log_info.check(('logger', 'WARNING',
+                        '[Foundation west] lease lost, audit abandoned'),
+                       ('logger', 'INFO', 'me audited 1 of 2 foundations: east'))
+
+    def testCoordinateReports(self):
+        """
+        Test each coordinated foundation's report is a file of its own,
+        unless the foundation names one
+        """
+        manager = MagicMock()
+        manager.owner = 'me'
+        lease = MagicMock()
+        lease.lost = False
+        manager.claim.return_value = lease
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, 'r.ndjson')
+        own_path = os.path.join(tmpdir, 'north.ndjson')
+
+        def fake_audit(foundation, cc_fetcher, db_obj, fcontext):
+            params = fcontext.params
+            with report.open_report(params['REPORT_PATH'], 'ndjson',
+                                    foundation, 'applications') as writer:
+                writer.write(differ.Discrepancy(foundation + '-guid',
+                                                differ.MISSING_IN_DB))
+            return True
+
+        run = context.RunContext(params=parameters.Params(
+            {'LEASE_TTL': '60', 'LEASE_HOLD': '600', 'REPORT_PATH': path}))
+        with patch("cc_fetcher.CCFetcher.__init__", return_value=None), \
+             patch("cf_diff.StatsDB"), \
+             patch("leases.LeaseManager", return_value=manager), \
+             patch("cf_diff.audit", side_effect=fake_audit), \
+             patch.dict(os.environ, {'REPORT_PATH__NORTH': own_path}):
+            cf_diff.coordinate(['east', 'west', 'north'], MagicMock(), run)
+        self.assertEqual(sorted(os.listdir(tmpdir)),
+                         ['north.ndjson', 'r.east.ndjson', 'r.west.ndjson'])
+        for name, foundation in (('r.east.ndjson', 'east'),
+                                 ('r.west.ndjson', 'west'),
+                                 ('north.ndjson', 'north')):
+            with open(os.path.join(tmpdir, name)) as infile:
+                self.assertEqual(json.loads(infile.read())['guid'],
+                                 foundation + '-guid')
+        shutil.rmtree(tmpdir)
+
+    def testAuditDeadline(self):
+        """
+        Test a diff cut short by the deadline keeps its partial results
+        """
+        def fake_diff(foundation, cc_obj, db_obj, consumers, details=False,
+                      counts=None):
+            counts[differ.MISSING_IN_DB] += 1
+            raise deadline.DeadlineExceeded("Deadline exceeded")
+
+        report_writer = MagicMock()
+        report_writer.__enter__.return_value = report_writer
+        cc_obj = MagicMock()
+        cc_obj.cache_stats = {'misses': 1, 'hits': 2}
+        db_obj = MagicMock()
+        db_obj.query_cache_stats = {'hits': 0, 'misses': 1}
+        with patch("cf_diff.get_counts", return_value=(1, 2)), \
+             patch("cf_diff.prepare_db"), \
+             patch("cf_diff.diff_guids", side_effect=fake_diff), \
+             patch("report.open_report", return_value=report_writer), \
+             patch.dict(parameters.SysParams(), {'REPORT_PATH': 'r.ndjson'}), \
+             LogCapture(level=logging.INFO) as log_info:
+            self.assertFalse(cf_diff.audit('f', cc_obj, db_obj))
+        report_writer.mark_incomplete.assert_called_once_with(
+            "Deadline exceeded")
+        log_info.check(('logger', 'INFO',
+                        '[Foundation f] CloudController: 1, Database: 2'),
+                       ('logger', 'INFO',
+                        '[Foundation f] missing in Database: 1, '
+                        'missing in CloudController: 0'),
+                       ('logger', 'WARNING',
+                        '[Foundation f] results are incomplete: '
+                        'Deadline exceeded'),
+                       ('logger', 'INFO',
+                        '[Foundation f] CloudController response cache: '
+                        'hits 2, misses 1'),
+                       ('logger', 'INFO',
+                        '[Foundation f] Database query cache: '
+                        'hits 0, misses 1'))
+
+        cc_obj.cache_stats = db_obj.query_cache_stats = None
+
+        # The results sink's setup running past the deadline
+        db_obj.query.side_effect = deadline.DeadlineExceeded("too late")
+        with patch("cf_diff.get_counts", return_value=(1, 2)), \
+             patch("cf_diff.prepare_db"), \
+             patch("cf_diff.diff_guids") as mock_diff, \
+             patch.dict(parameters.SysParams(), {'RESULTS_SINK': 'true'}), \
+             LogCapture(level=logging.INFO) as log_info:
+            self.assertFalse(cf_diff.audit('f', cc_obj, db_obj))
+        mock_diff.assert_not_called()
+        log_info.check(('logger', 'INFO',
+                        '[Foundation f] CloudController: 1, Database: 2'),
+                       ('logger', 'INFO',
+                        '[Foundation f] missing in Database: 0, '
+                        'missing in CloudController: 0'),
+                       ('logger', 'WARNING',
+                        '[Foundation f] results are incomplete: too late'))
+
+        with patch("cf_diff.get_counts",
+                   side_effect=deadline.DeadlineExceeded("late")), \
+             LogCapture(level=logging.INFO) as log_info:
+            self.assertFalse(cf_diff.audit('f', cc_obj, db_obj))
+        log_info.check(('logger', 'WARNING',
+                        '[Foundation f] incomplete, no results: late'))
+
     def testGetCounts(self):
         """
         """
@@ -66,3 +290,96 @@ class TestCFDiff(unittest.TestCase):
         sql = 'SELECT COUNT(DISTINCT GUID) FROM applications'
         mock_stats.query.assert_called_once_with(sql)
         self.assertEqual(db, db_value)
+
+    def testDiffGuids(self):
+        """
+        Test that every discrepancy reaches every consumer
+        """
+        cc_obj = MagicMock()
+        cc_obj.app_guids.return_value = ['c', 'a', 'b']
+        db_obj = MagicMock()
+        db_obj.guid_order.return_value = None
+        db_obj.guids.return_value = iter(['b', 'd'])
+        consumer = MagicMock()
+        counts = cf_diff.diff_guids('f', cc_obj, db_obj, [consumer])
+        self.assertEqual(counts, {differ.MISSING_IN_DB: 2,
+                                  differ.MISSING_IN_CC: 1})
+        written = [c[0][0].guid for c in consumer.write.call_args_list]
+        self.assertEqual(written, ['a', 'c', 'd'])
+
+    def testDiffGuidsMixedCase(self):
+        """
+        Test mixed-case GUIDs under a case-insensitive collation, where the
+        database orders 'B' between 'a' and 'c'
+        """
+        cc_obj = MagicMock()
+        cc_obj.app_guids.return_value = ['c1', 'B2', 'a3']
+        db_obj = MagicMock()
+        db_obj.guid_order.return_value = str.lower
+        db_obj.guids.return_value = iter(['a3', 'B2', 'c1', 'D4'])
+        consumer = MagicMock()
+        counts = cf_diff.diff_guids('f', cc_obj, db_obj, [consumer])
+        self.assertEqual(counts, {differ.MISSING_IN_CC: 1})
+        consumer.write.assert_called_once_with(('D4', differ.MISSING_IN_CC))
+
+    def testDiffGuidsDetails(self):
+        """
+        Test that discrepancies are enriched from the side that has them
+        """
+        cc_obj = MagicMock()
+        cc_obj.app_guids.return_value = ['a']
+        cc_obj.lookup_apps.return_value = {'a': {'name': 'A'}}
+        db_obj = MagicMock()
+        db_obj.guid_order.return_value = None
+        db_obj.guids.return_value = iter(['d'])
+        db_obj.lookup.return_value = {}
+        consumer = MagicMock()
+        cf_diff.diff_guids('f', cc_obj, db_obj, [consumer], details=True)
+        written = [c[0][0] for c in consumer.write.call_args_list]
+        self.assertEqual(written, [('a', differ.MISSING_IN_DB, {'name': 'A'}),
+                                   ('d', differ.MISSING_IN_CC, None)])
+        cc_obj.lookup_apps.assert_called_once_with('f', ['a'])
+        db_obj.lookup.assert_called_once_with('applications', ['d'])
+
+    def testPrepareDB(self):
+        """
+        Test that indices are provisioned and both diff queries verified
+        """
+        db_obj = MagicMock()
+        db_obj.guids_sql.return_value = "SELECT guids"
+        db_obj.verify_query_plan.side_effect = [True, RuntimeError("no")]
+        cf_diff.prepare_db(db_obj)
+        db_obj.ensure_indices.assert_called_once_with()
+        db_obj.verify_query_plan.assert_has_calls([call(cf_diff.COUNT_SQL),
+                                                   call("SELECT guids")])
+
+    def testMainEstimate(self):
+        """
+        Test that estimate mode only runs the full diff over threshold
+        """
+        for escalate in (False, True):
+            with patch("cc_fetcher.CCFetcher.__init__", return_value=None), \
+                 patch("statsdb.StatsDB.__init__", return_value=None), \
+                 patch("cf_diff.get_counts", return_value=(1, 2)), \
+                 patch("cf_diff.prepare_db"), \
+                 patch("cf_diff.estimate", return_value=escalate) as mock_est, \
+                 patch("cf_diff.diff_guids",
+                       return_value=collections.Counter()) as mock_diff, \
+                 patch.dict(parameters.SysParams(), {'DIFF_MODE': 'estimate'}), \
+                 LogCapture(level=logging.INFO):
+                cf_diff.main()
+            mock_est.assert_called_once()
+            self.assertEqual(mock_diff.call_count, int(escalate))
+            if escalate:
+                self.assertEqual(mock_diff.call_args[0][3], [])
+
+    def testEstimate(self):
+        """
+        Test the estimate is logged and compared to the threshold
+        """
+        est = estimator.make_estimate(differ.MISSING_IN_DB, 100, 5, 1000)
+        with patch("estimator.estimate_drift", return_value=[est]), \
+             patch.dict(parameters.SysParams(), {'DRIFT_THRESHOLD': '0.01'}), \
+             LogCapture(level=logging.INFO) as log_info:
+            self.assertTrue(cf_diff.estimate('foundation', None, None, 1000, 990))
+        self.assertIn('estimated missing_in_db: 50', str(log_info))
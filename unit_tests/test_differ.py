@@ -0,0 +1,76 @@
+"""
+Unit tests for the cf-diff tool differ module
+"""
+import unittest
+
+from mock import call, MagicMock
+
+import differ
+
+#pylint: disable=protected-access, invalid-name
+
+
+class TestDiffSorted(unittest.TestCase):
+    """
+    Test the sorted-merge GUID diff.
+    """
+    def testDiff(self):
+        """
+        Test discrepancies on both sides, with duplicates
+        """
+        cc = ['a', 'b', 'b', 'd', 'f']
+        db = ['b', 'c', 'c', 'd', 'e']
+        self.assertEqual(list(differ.diff_sorted(cc, db)),
+                         [('a', differ.MISSING_IN_DB),
+                          ('c', differ.MISSING_IN_CC),
+                          ('e', differ.MISSING_IN_CC),
+                          ('f', differ.MISSING_IN_DB)])
+
+    def testOneSideEmpty(self):
+        """
+        Test that an empty side makes everything on the other discrepant
+        """
+        self.assertEqual(list(differ.diff_sorted([], iter(['x', 'y']))),
+                         [('x', differ.MISSING_IN_CC),
+                          ('y', differ.MISSING_IN_CC)])
+        self.assertEqual(list(differ.diff_sorted(['x'], [])),
+                         [('x', differ.MISSING_IN_DB)])
+        self.assertEqual(list(differ.diff_sorted([], [])), [])
+
+    def testIdentical(self):
+        """
+        Test that identical streams produce nothing
+        """
+        guids = ['g{:03d}'.format(i) for i in range(100)]
+        self.assertEqual(list(differ.diff_sorted(guids, iter(guids))), [])
+
+    def testKey(self):
+        """
+        Test merging in a case-insensitive order: no false discrepancies,
+        and GUIDs reported as the side holding them has them
+        """
+        cc = ['a1', 'B2', 'c3']
+        db = ['A1', 'b2', 'b2', 'C0', 'c3']
+        self.assertEqual(list(differ.diff_sorted(cc, db, key=str.lower)),
+                         [('C0', differ.MISSING_IN_CC)])
+        # in code point order 'B2' < 'a1', so the streams are unsorted
+        self.assertNotEqual(list(differ.diff_sorted(cc, db)),
+                            [('C0', differ.MISSING_IN_CC)])
+
+    def testEnrich(self):
+        """
+        Test discrepancies are looked up in batches on the side holding them
+        """
+        found = [differ.Discrepancy('a', differ.MISSING_IN_DB),
+                 differ.Discrepancy('b', differ.MISSING_IN_CC),
+                 differ.Discrepancy('c', differ.MISSING_IN_DB)]
+        lookup_cc = MagicMock(side_effect=lambda guids: {'a': {'name': 'A'}})
+        lookup_db = MagicMock(side_effect=lambda guids: {'b': {'id': 2}})
+        enriched = list(differ.enrich(found, lookup_cc, lookup_db,
+                                      batch_size=2))
+        self.assertEqual(enriched,
+                         [('a', differ.MISSING_IN_DB, {'name': 'A'}),
+                          ('b', differ.MISSING_IN_CC, {'id': 2}),
+                          ('c', differ.MISSING_IN_DB, None)])
+        self.assertEqual(lookup_cc.call_args_list, [call(['a']), call(['c'])])
+        lookup_db.assert_called_once_with(['b'])
@@ -0,0 +1,80 @@
+"""
+Unit tests for the cf-diff tool estimator module
+"""
+import random
+import unittest
+
+from mock import MagicMock
+
+import differ
+import estimator
+
+#pylint: disable=protected-access, invalid-name
+
+
+class TestEstimator(unittest.TestCase):
+    """
+    Test sampled drift estimation.
+    """
+    def testWilsonInterval(self):
+        """
+        Test the interval against known values and edge cases
+        """
+        low, high = estimator.wilson_interval(10, 100)
+        self.assertAlmostEqual(low, 0.0552, places=4)
+        self.assertAlmostEqual(high, 0.1744, places=4)
+        low, high = estimator.wilson_interval(0, 100)
+        self.assertEqual(low, 0.0)
+        self.assertAlmostEqual(high, 0.0370, places=4)
+        self.assertEqual(estimator.wilson_interval(0, 0), (0.0, 1.0))
+
+    def testSamplePrefixes(self):
+        """
+        Test prefix choice: distinct, two hex digits, sorted
+        """
+        prefixes = estimator.sample_prefixes(5, random.Random(1))
+        self.assertEqual(len(set(prefixes)), 5)
+        self.assertEqual(prefixes, sorted(prefixes))
+        self.assertTrue(all(len(p) == 2 and int(p, 16) < 256 for p in prefixes))
+        self.assertEqual(len(estimator.sample_prefixes(1000)), 256)
+
+    def testEstimateDrift(self):
+        """
+        Test both sides are sampled, checked against the other side and
+        scaled to their population
+        """
+        cc_obj = MagicMock()
+        db_obj = MagicMock()
+        db_obj.guids_with_prefixes.return_value = ['a1', 'a2', 'a3', 'a4']
+        cc_obj.existing_app_guids.return_value = {'a1', 'a2', 'a3'}
+        cc_obj.sample_app_guids.return_value = ['c{}'.format(i)
+                                                for i in range(10)]
+        db_obj.existing_guids.return_value = {'c{}'.format(i) for i in range(8)}
+
+        in_cc, in_db = estimator.estimate_drift('f', cc_obj, db_obj,
+                                                cc_count=1000, db_count=2000,
+                                                prefixes=3, pages=2,
+                                                rng=random.Random(0))
+
+        prefixes = db_obj.guids_with_prefixes.call_args[0][1]
+        self.assertEqual(len(prefixes), 3)
+        cc_obj.existing_app_guids.assert_called_once_with(
+            'f', ['a1', 'a2', 'a3', 'a4'])
+        self.assertEqual(cc_obj.sample_app_guids.call_args[0][:2], ('f', 2))
+        self.assertEqual((in_cc.kind, in_cc.sampled, in_cc.found, in_cc.count),
+                         (differ.MISSING_IN_CC, 4, 1, 500))
+        self.assertEqual((in_db.kind, in_db.sampled, in_db.found, in_db.count),
+                         (differ.MISSING_IN_DB, 10, 2, 200))
+        self.assertTrue(in_db.low < in_db.rate < in_db.high)
+
+    def testExceeds(self):
+        """
+        Test the escalation decision
+        """
+        clean = estimator.make_estimate(differ.MISSING_IN_DB, 100, 0, 10)
+        drift = estimator.make_estimate(differ.MISSING_IN_CC, 100, 2, 10)
+        empty = estimator.make_estimate(differ.MISSING_IN_CC, 0, 0, 10)
+        self.assertFalse(estimator.exceeds([clean], 0.01))
+        self.assertTrue(estimator.exceeds([clean, drift], 0.01))
+        self.assertFalse(estimator.exceeds([clean, drift], 0.05))
+        self.assertTrue(estimator.exceeds([clean, empty], 0.05))
@@ -1,6 +1,7 @@
 """
 Unit tests for the cf-diff tool cc_fetcher module
 """
+import json
 import logging
 import os
 import pytest
@@ -11,6 +12,9 @@ from mock import patch, MagicMock
 from testfixtures import LogCapture
 
 import cc_fetcher
+import context
+import deadline
+import parameters
 
 #pylint: disable=protected-access, invalid-name
 
@@ -57,7 +61,7 @@ class TestFetcher(unittest.TestCase):
             fetcher._cc_url_format = url_fmt
             auth_url = fetcher._get_oauth_url(foundation)
         self.assertEqual(auth_url, '/'.join([url, "oauth", "token"]))
-        mock_get.assert_called_once_with(url, verify=False)
+        mock_get.assert_called_once_with(url, verify=False, timeout=(10, 60))
 
     def testGetOauthUrlNotOK(self):
         """
@@ -78,7 +82,7 @@ class TestFetcher(unittest.TestCase):
             fetcher = cc_fetcher.CCFetcher()
             fetcher._cc_url_format = url_fmt
             auth_url = fetcher._get_oauth_url(foundation)
-        mock_get.assert_called_once_with(url, verify=False)
+        mock_get.assert_called_once_with(url, verify=False, timeout=(10, 60))
 
     def testGetOauthUrlRaises(self):
         """
@@ -94,7 +98,7 @@ class TestFetcher(unittest.TestCase):
             fetcher = cc_fetcher.CCFetcher()
             fetcher._cc_url_format = url_fmt
             auth_url = fetcher._get_oauth_url(foundation)
-        mock_get.assert_called_once_with(url, verify=False)
+        mock_get.assert_called_once_with(url, verify=False, timeout=(10, 60))
 
     def testGetAccessToken(self):
         """
@@ -126,7 +130,8 @@ class TestFetcher(unittest.TestCase):
         mock_oauth.fetch_token.assert_called_once_with(token_url=url,
                                                        client_id=fetcher._oauth_id,
                                                        client_secret=fetcher._oauth_secret,
-                                                       verify=False)
+                                                       verify=False,
+                                                       timeout=(10, 60))
         self.assertEqual(token, test_token)
 
     def testGetAccessTokenErr(self):
@@ -164,7 +169,8 @@ class TestFetcher(unittest.TestCase):
         mock_oauth.fetch_token.assert_called_once_with(token_url=url,
                                                        client_id=fetcher._oauth_id,
                                                        client_secret=fetcher._oauth_secret,
-                                                       verify=False)
+                                                       verify=False,
+                                                       timeout=(10, 60))
 
     def testHeader(self):
         """
@@ -193,6 +199,359 @@ class TestFetcher(unittest.TestCase):
             count = fetcher._request_app_count("some_foundation")
             self.assertEqual(count, test_count)
 
+    def testRequestCached(self):
+        """
+        Test that a fresh cached reply is reused without a request
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._access_token = "a token"
+        mock_reply = MagicMock()
+        mock_reply.status_code = 200
+        mock_reply.headers = {}
+        mock_reply.json = MagicMock(return_value={'total_results': 42})
+
+        with patch('requests.get', return_value=mock_reply) as mock_request:
+            first = fetcher._request_app_count("some_foundation")
+            second = fetcher._request_app_count("some_foundation")
+        self.assertEqual((first, second), (42, 42))
+        mock_request.assert_called_once()
+        self.assertEqual(fetcher.cache_stats['hits'], 1)
+        self.assertEqual(fetcher.cache_stats['misses'], 1)
+
+    def testRequestRevalidate(self):
+        """
+        Test that a stale cached reply is revalidated and reused on a 304
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._access_token = "a token"
+        fetcher._cache._ttl = -1
+        mock_reply = MagicMock()
+        mock_reply.status_code = 200
+        mock_reply.headers = {'ETag': '"v1"'}
+        mock_reply.json = MagicMock(return_value={'total_results': 42})
+        not_modified = MagicMock()
+        not_modified.status_code = 304
+        not_modified.headers = {}
+
+        with patch('requests.get',
+                   side_effect=[mock_reply, not_modified]) as mock_request:
+            fetcher._request_app_count("some_foundation")
+            count = fetcher._request_app_count("some_foundation")
+        self.assertEqual(count, 42)
+        headers = mock_request.call_args[1]['headers']
+        self.assertEqual(headers['If-None-Match'], '"v1"')
+        self.assertEqual(fetcher.cache_stats['revalidated'], 1)
+
+    def testAppGuids(self):
+        """
+        Test app_guids follows v3 pagination across pages
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._cc_url_format = 'a/b/{foundation}/d'
+        fetcher._access_token = "a token"
+        pages = [{'pagination': {'next': {'href': 'a/b/f/d/v3/apps?page=2'}},
+                  'resources': [{'guid': 'g1'}, {'guid': 'g2'}]},
+                 {'pagination': {'next': None},
+                  'resources': [{'guid': 'g3'}]}]
+        replies = []
+        for page in pages:
+            reply = MagicMock()
+            reply.status_code = 200
+            reply.headers = {}
+            reply.iter_content = MagicMock(
+                return_value=[json.dumps(page).encode('utf-8')])
+            replies.append(reply)
+
+        with patch('requests.get', side_effect=replies) as mock_request:
+            guids = fetcher.app_guids("f")
+        self.assertEqual(guids, ['g1', 'g2', 'g3'])
+        self.assertEqual(mock_request.call_args_list[0][0][0],
+                         'a/b/f/d/v3/apps?per_page=5000')
+        self.assertEqual(mock_request.call_args_list[1][0][0],
+                         'a/b/f/d/v3/apps?page=2')
+        # pages are streamed into the parser, and their replies closed
+        self.assertTrue(mock_request.call_args[1]['stream'])
+        for reply in replies:
+            reply.close.assert_called_once_with()
+
+    def testAppGuidsFailed(self):
+        """
+        Test that a failed page aborts the listing
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._access_token = "a token"
+        reply = MagicMock()
+        reply.status_code = 500
+        reply.headers = {}
+        with patch('requests.get', return_value=reply) as mock_request, \
+             patch('time.sleep') as mock_sleep, \
+             pytest.raises(cc_fetcher.FailedRequest):
+            fetcher.app_guids("f")
+        self.assertEqual(mock_request.call_count, fetcher._max_retries + 1)
+        self.assertEqual(mock_sleep.call_count, fetcher._max_retries)
+
+    def testAppGuidsConcurrent(self):
+        """
+        Test that the remaining v3 pages are fetched once the count is known
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._cc_url_format = 'a/b/{foundation}/d'
+        fetcher._access_token = "a token"
+
+        def get(url, **_):
+            page = int(url.split('page=')[-1]) if '&page=' in url else 1
+            reply = MagicMock()
+            reply.status_code = 200
+            reply.headers = {}
+            body = {'pagination': {'total_pages': 4},
+                    'resources': [{'guid': 'g{}'.format(page)}]}
+            reply.iter_content = MagicMock(
+                return_value=[json.dumps(body).encode('utf-8')])
+            return reply
+
+        with patch('requests.get', side_effect=get) as mock_request:
+            guids = fetcher.app_guids("f")
+        self.assertEqual(guids, ['g1', 'g2', 'g3', 'g4'])
+        self.assertEqual(mock_request.call_count, 4)
+
+    def testAppGuidsMemoryPressure(self):
+        """
+        Test that pages are fetched one at a time under memory pressure
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._cc_url_format = 'a/b/{foundation}/d'
+        fetcher._access_token = "a token"
+        governor = MagicMock()
+        governor.scale.return_value = 1
+        replies = [self.page_reply(['g1'], total_pages=3),
+                   self.page_reply(['g2']), self.page_reply(['g3'])]
+        with patch('requests.get', side_effect=replies), \
+             patch('memory_governor.governor', return_value=governor):
+            guids = fetcher.app_guids("f")
+        self.assertEqual(guids, ['g1', 'g2', 'g3'])
+        governor.scale.assert_called_with(fetcher._max_concurrency)
+
+    def testRequestThrottled(self):
+        """
+        Test that a 429 is retried after backoff and slows the limiter
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._access_token = "a token"
+        throttled = MagicMock()
+        throttled.status_code = 429
+        throttled.headers = {'Retry-After': '0'}
+        mock_reply = MagicMock()
+        mock_reply.status_code = 200
+        mock_reply.headers = {}
+        mock_reply.json = MagicMock(return_value={'total_results': 42})
+
+        with patch('requests.get',
+                   side_effect=[throttled, mock_reply]) as mock_request, \
+             patch('time.sleep') as mock_sleep:
+            count = fetcher._request_app_count("throttled_foundation")
+        self.assertEqual(count, 42)
+        self.assertEqual(mock_request.call_count, 2)
+        mock_sleep.assert_called_once()
+        stats = fetcher._limiter("throttled_foundation").stats
+        self.assertEqual(stats['throttled'], 1)
+
+    def testRequestTimeout(self):
+        """
+        Test that a timed out request is retried within the deadline
+        """
+        fetcher = cc_fetcher.CCFetcher(deadline=deadline.Deadline(100))
+        fetcher._access_token = "a token"
+        mock_reply = MagicMock()
+        mock_reply.status_code = 200
+        mock_reply.headers = {}
+        mock_reply.json = MagicMock(return_value={'total_results': 42})
+
+        with patch('requests.get',
+                   side_effect=[requests.exceptions.ReadTimeout,
+                                mock_reply]) as mock_request, \
+             patch('time.sleep') as mock_sleep:
+            count = fetcher._request_app_count("timeout_foundation")
+        self.assertEqual(count, 42)
+        mock_sleep.assert_called_once()
+        timeout = mock_request.call_args[1]['timeout']
+        self.assertEqual(timeout[0], 10)
+        self.assertTrue(59 < timeout[1] <= 60)
+
+    def testRequestTimeoutAfterSlot(self):
+        """
+        Test a request's timeout is taken once its limiter slot is granted
+        """
+        now = [0.0]
+        fetcher = cc_fetcher.CCFetcher(deadline=deadline.Deadline(
+            100, clock=lambda: now[0]))
+        fetcher._access_token = "a token"
+        limiter = fetcher._limiter("f")
+        acquire = limiter.acquire
+
+        def slow_acquire(timeout=None):
+            acquired = acquire(timeout)
+            now[0] += 95
+            return acquired
+        mock_reply = MagicMock()
+        mock_reply.status_code = 200
+        mock_reply.headers = {}
+        with patch.object(limiter, 'acquire', side_effect=slow_acquire), \
+             patch('requests.get', return_value=mock_reply) as mock_request:
+            fetcher._get("f", "a/b/f/d/v2/apps", lambda reply: 1)
+        self.assertEqual(mock_request.call_args[1]['timeout'], (5, 5))
+
+    def testRequestPausedPastDeadline(self):
+        """
+        Test a pause (Retry-After) outlasting the deadline ends the request
+        at once rather than waiting it out
+        """
+        fetcher = cc_fetcher.CCFetcher(deadline=deadline.Deadline(1))
+        fetcher._access_token = "a token"
+        throttled = MagicMock()
+        throttled.status_code = 429
+        throttled.headers = {'Retry-After': '3600'}
+        with patch('requests.get', return_value=throttled) as mock_request, \
+             patch('time.sleep'), \
+             pytest.raises(deadline.DeadlineExceeded) as exn:
+            fetcher._get("f", "a/b/f/d/v2/apps", lambda reply: 1)
+        mock_request.assert_called_once()
+        self.assertIn("No request slot", str(exn.value))
+
+    def testBodyReadError(self):
+        """
+        Test a listing page whose body fails to stream in is fetched again
+        """
+        fetcher = cc_fetcher.CCFetcher(deadline=deadline.Deadline(100))
+        fetcher._cc_url_format = 'a/b/{foundation}/d'
+        fetcher._access_token = "a token"
+        broken = self.page_reply(['g1'])
+        broken.iter_content.side_effect = requests.exceptions.ConnectionError(
+            "Read timed out")
+        good = self.page_reply(['g1', 'g2'])
+        with patch('requests.get', side_effect=[broken, good]), \
+             patch('time.sleep') as mock_sleep, \
+             LogCapture() as log_capture:
+            self.assertEqual(fetcher.app_guids("f"), ['g1', 'g2'])
+        mock_sleep.assert_called_once()
+        broken.close.assert_called_once_with()
+        self.assertIn('WARNING', [record.levelname for record
+                                  in log_capture.records
+                                  if 'failed (ConnectionError), retry in'
+                                  in record.getMessage()])
+
+        # ... but not past the deadline
+        now = [0]
+        fetcher = cc_fetcher.CCFetcher(deadline=deadline.Deadline(
+            10, clock=lambda: now[0]))
+        fetcher._cc_url_format = 'a/b/{foundation}/d'
+        fetcher._access_token = "a token"
+        with patch('requests.get', return_value=broken), \
+             patch('time.sleep',
+                   side_effect=lambda seconds: now.__setitem__(0, 20)), \
+             pytest.raises(deadline.DeadlineExceeded):
+            fetcher.app_guids("f")
+
+    def testRequestDeadline(self):
+        """
+        Test that no request is sent once the deadline has passed
+        """
+        clock = MagicMock(side_effect=[0] + [10] * 10)
+        fetcher = cc_fetcher.CCFetcher(deadline=deadline.Deadline(
+            5, clock=clock))
+        fetcher._access_token = "a token"
+        with patch('requests.get') as mock_request, \
+             pytest.raises(deadline.DeadlineExceeded):
+            fetcher._request_app_count("late_foundation")
+        mock_request.assert_not_called()
+
+    def testContext(self):
+        """
+        Test that a fetcher in a context uses its parameters and session
+        """
+        session = MagicMock()
+        session.get.return_value.status_code = 200
+        session.get.return_value.headers = {}
+        session.get.return_value.json.return_value = {'total_results': 7}
+        params = parameters.SysParams().for_foundation('other')
+        params['CC_MAX_RETRIES'] = '0'
+        with context.RunContext(params, session=session) as run_context:
+            fetcher = cc_fetcher.CCFetcher(context=run_context)
+            self.assertIs(fetcher.params, params)
+            self.assertEqual(fetcher._max_retries, 0)
+            fetcher._access_token = "a token"
+            with patch('requests.get') as mock_request:
+                self.assertEqual(fetcher._request_app_count("other"), 7)
+            mock_request.assert_not_called()
+            session.get.assert_called_once()
+        session.close.assert_called_once_with()
+
+    def page_reply(self, guids, total_pages=1):
+        """
+        A v3 listing reply holding the given GUIDs.
+        """
+        reply = MagicMock()
+        reply.status_code = 200
+        reply.headers = {}
+        body = {'pagination': {'total_pages': total_pages},
+                'resources': [{'guid': guid} for guid in guids]}
+        reply.iter_content = MagicMock(
+            return_value=[json.dumps(body).encode('utf-8')])
+        return reply
+
+    def testGuidChunks(self):
+        """
+        Test GUIDs are packed into comma separated chunks that fit
+        """
+        guids = ['g{}'.format(i) for i in range(5)]
+        self.assertEqual(list(cc_fetcher.guid_chunks(guids, 5)),
+                         ['g0,g1', 'g2,g3', 'g4'])
+        self.assertEqual(list(cc_fetcher.guid_chunks(['toolong', 'g'], 3)),
+                         ['toolong', 'g'])
+        self.assertEqual(list(cc_fetcher.guid_chunks([], 10)), [])
+
+    def testLookupApps(self):
+        """
+        Test bulk lookups are split to the URL limit and run concurrently
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._cc_url_format = 'a/b/{foundation}/d'
+        fetcher._access_token = "a token"
+        guids = ['g{:02d}'.format(i) for i in range(60)]
+        prefix = 'a/b/f/d/v3/apps?per_page=5000&guids='
+
+        def reply(url, **_):
+            chunk = url[len(prefix):].split(',')
+            return self.page_reply([guid for guid in chunk if guid in
+                                    ('g01', 'g55')])
+
+        with patch('requests.get', side_effect=reply) as mock_request, \
+             patch('constants.CC_MAX_URL_LENGTH', len(prefix) + 4 * 20 - 1):
+            found = fetcher.lookup_apps("f", guids, fields=('name',))
+            self.assertEqual(fetcher.existing_app_guids("f", []), set())
+        self.assertEqual(sorted(found), ['g01', 'g55'])
+        self.assertEqual(found['g01'], {'guid': 'g01', 'name': None})
+        urls = sorted(args[0] for args, _ in mock_request.call_args_list)
+        self.assertEqual(len(urls), 3)
+        self.assertEqual(urls[0], prefix + ','.join(guids[:20]))
+
+    def testSampleAppGuids(self):
+        """
+        Test sampling random listing pages
+        """
+        fetcher = cc_fetcher.CCFetcher()
+        fetcher._cc_url_format = 'a/b/{foundation}/d'
+        fetcher._access_token = "a token"
+        rng = MagicMock()
+        rng.sample.return_value = [5, 1]
+        replies = [self.page_reply(['p1'], total_pages=9),
+                   self.page_reply(['p5'])]
+        with patch('requests.get', side_effect=replies) as mock_request:
+            guids = fetcher.sample_app_guids("f", 2, 3, rng=rng)
+        self.assertEqual(guids, ['p1', 'p5'])
+        self.assertEqual(rng.sample.call_args[0], (range(1, 10), 2))
+        self.assertEqual(mock_request.call_args_list[1][0][0],
+                         'a/b/f/d/v3/apps?per_page=3&page=5')
+
     def testAppCount(self):
         """
         Test the app_count function
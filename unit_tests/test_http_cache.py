@@ -0,0 +1,135 @@
+"""
+Unit tests for the cf-diff tool http_cache module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+import http_cache
+
+#pylint: disable=protected-access, invalid-name
+
+
+def make_response(content=b'{"total_results": 42}', status=200, headers=None):
+    """
+    Build a real requests.Response with the given body and headers.
+    """
+    response = requests.models.Response()
+    response.status_code = status
+    response.headers = requests.structures.CaseInsensitiveDict(headers or {})
+    response.encoding = 'utf-8'
+    response._content = content
+    return response
+
+
+class TestResponseCache(unittest.TestCase):
+    """
+    Test basic operation of the ResponseCache class.
+    """
+    def setUp(self):
+        self.now = 1000.0
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def clock(self):
+        return self.now
+
+    def testFreshAndStale(self):
+        """
+        Test TTL freshness and the conditional headers of a stale entry
+        """
+        rcache = http_cache.ResponseCache(4, 10, clock=self.clock)
+        rcache.store('f', 'u', make_response(headers={'ETag': '"abc"'}), 42)
+        entry = rcache.lookup('f', 'u')
+        self.assertTrue(rcache.is_fresh(entry))
+        self.now += 11
+        self.assertFalse(rcache.is_fresh(entry))
+        self.assertEqual(rcache.conditional_headers(entry),
+                         {'If-None-Match': '"abc"'})
+        self.assertIsNone(rcache.lookup('other', 'u'))
+
+    def testTrimMemory(self):
+        """
+        Test that trimming drops the memory tier but keeps the disk tier
+        """
+        rcache = http_cache.ResponseCache(4, 10, directory=self.tmpdir,
+                                          clock=self.clock)
+        rcache.store('f', 'u', make_response(), 42)
+        rcache.trim_memory()
+        self.assertEqual(rcache.stats['size'], 0)
+        self.assertIsNotNone(rcache.lookup('f', 'u'))
+        self.assertEqual(rcache.stats['disk_hits'], 1)
+
+    def testNotCacheable(self):
+        """
+        Test that errors and no-store replies are not cached
+        """
+        rcache = http_cache.ResponseCache(4, 10, clock=self.clock)
+        rcache.store('f', 'u', make_response(status=500), None)
+        rcache.store('f', 'v', make_response(headers={'Cache-Control': 'no-store'}),
+                     42)
+        self.assertIsNone(rcache.lookup('f', 'u'))
+        self.assertIsNone(rcache.lookup('f', 'v'))
+        self.assertEqual(rcache.stats['misses'], 2)
+        self.assertEqual(rcache.stats['stores'], 0)
+
+    def testRevalidated(self):
+        """
+        Test that a 304 restarts the entry TTL
+        """
+        rcache = http_cache.ResponseCache(4, 10, clock=self.clock)
+        value = {'total_results': 42}
+        rcache.store('f', 'u', make_response(headers={'ETag': '"abc"'}), value)
+        entry = rcache.lookup('f', 'u')
+        self.now += 20
+        rtn = rcache.revalidated('f', 'u', entry, make_response(status=304))
+        self.assertIs(rtn, value)
+        self.assertTrue(rcache.is_fresh(entry))
+        self.assertEqual(rcache.stats['revalidated'], 1)
+
+    def testDiskTier(self):
+        """
+        Test that entries survive in the disk tier across cache instances
+        """
+        first = http_cache.ResponseCache(4, 10, directory=self.tmpdir,
+                                         clock=self.clock)
+        first.store('f', 'u', make_response(headers={'ETag': '"abc"'}),
+                    [{'total_results': 42}, ['g1']])
+
+        second = http_cache.ResponseCache(4, 10, directory=self.tmpdir,
+                                          clock=self.clock)
+        entry = second.lookup('f', 'u')
+        self.assertEqual(entry.value, [{'total_results': 42}, ['g1']])
+        self.assertEqual(entry.etag, '"abc"')
+        self.assertEqual(second.stats['disk_hits'], 1)
+
+    def testDiskBounded(self):
+        """
+        Test that the disk tier drops expired entries and stays under its
+        size limit, oldest entries first
+        """
+        rcache = http_cache.ResponseCache(4, 10, directory=self.tmpdir,
+                                          max_bytes=1000, max_age=3600,
+                                          clock=self.clock)
+        for number in range(5):
+            rcache.store('f', 'u{}'.format(number), make_response(),
+                         'x' * 200)
+            path = rcache._path(rcache._key('f', 'u{}'.format(number)))
+            os.utime(path, (self.now + number, self.now + number))
+        stats = rcache.stats
+        self.assertLessEqual(stats['disk_bytes'], 1000)
+        self.assertGreater(stats['disk_evictions'], 0)
+        rcache.trim_memory()
+        self.assertIsNone(rcache.lookup('f', 'u0'))
+        self.assertIsNotNone(rcache.lookup('f', 'u4'))
+
+        self.now += 7200
+        reopened = http_cache.ResponseCache(4, 10, directory=self.tmpdir,
+                                            max_age=3600, clock=self.clock)
+        self.assertEqual(reopened.stats['disk_bytes'], 0)
+        self.assertEqual(os.listdir(self.tmpdir), [])
@@ -0,0 +1,99 @@
+"""
+Unit tests for the cf-diff tool json_stream module
+"""
+import json
+import pytest
+import unittest
+
+import json_stream
+
+#pylint: disable=protected-access, invalid-name
+
+
+def chunked(text, size):
+    """
+    Split an encoded document into fixed size byte chunks.
+    """
+    body = text.encode('utf-8')
+    return [body[i:i + size] for i in range(0, len(body), size)]
+
+
+class TestPageExtractor(unittest.TestCase):
+    """
+    Test the incremental page parser.
+    """
+    v3_page = json.dumps({
+        'pagination': {'total_results': 2, 'next': {'href': 'http://n/2'}},
+        'resources': [
+            {'guid': 'g1', 'name': 'café', 'state': 'STARTED',
+             'relationships': {'space': {'data': {'guid': 'space1'}}}},
+            {'guid': 'g2', 'name': 'app2', 'state': 12345678,
+             'relationships': {'space': {'data': {'guid': 'space2'}}}},
+        ],
+        'trailing': [1, 2, 3],
+    })
+
+    v2_page = json.dumps({
+        'total_results': 1,
+        'total_pages': 1,
+        'next_url': None,
+        'resources': [{'metadata': {'guid': 'v2guid'},
+                       'entity': {'name': 'app'}}],
+    })
+
+    def testV3(self):
+        """
+        Test GUID/field extraction and summary from a v3 page
+        """
+        summary, records = json_stream.extract_page(
+            chunked(self.v3_page, 4096), fields=('name', 'state'))
+        self.assertEqual(records,
+                         [{'guid': 'g1', 'name': 'café', 'state': 'STARTED'},
+                          {'guid': 'g2', 'name': 'app2', 'state': 12345678}])
+        self.assertEqual(summary['pagination']['next']['href'], 'http://n/2')
+        self.assertNotIn('trailing', summary)
+
+    def testV2(self):
+        """
+        Test metadata.guid extraction from a v2 page
+        """
+        summary, records = json_stream.extract_page(
+            chunked(self.v2_page, 4096), fields=('entity.name', 'entity.missing'))
+        self.assertEqual(records, [{'guid': 'v2guid', 'entity.name': 'app',
+                                    'entity.missing': None}])
+        self.assertEqual(summary['total_results'], 1)
+        self.assertIsNone(summary['next_url'])
+
+    def testTinyChunks(self):
+        """
+        Test that values, keys and multi-byte characters split across
+        chunk boundaries are reassembled
+        """
+        for size in (1, 2, 3, 7):
+            _, records = json_stream.extract_page(
+                chunked(self.v3_page, size), fields=('name', 'state'))
+            self.assertEqual([r['state'] for r in records],
+                             ['STARTED', 12345678])
+            self.assertEqual(records[0]['name'], 'café')
+
+    def testEmpty(self):
+        """
+        Test empty pages and empty resource lists
+        """
+        self.assertEqual(json_stream.extract_page([b'{}']), ({}, []))
+        self.assertEqual(json_stream.extract_page([b'{"resources": [ ]}']),
+                         ({}, []))
+
+    def testTruncated(self):
+        """
+        Test that a truncated page is an error, not a short result
+        """
+        with pytest.raises(json_stream.IncompletePage):
+            json_stream.extract_page(chunked(self.v3_page[:-40], 16))
+
+    def testMalformed(self):
+        """
+        Test that a structurally invalid page is rejected
+        """
+        with pytest.raises(ValueError):
+            json_stream.extract_page([b'["not", "an", "object"]'])
@@ -0,0 +1,202 @@
+"""
+Unit tests for the cf-diff tool leases module
+
+The TestLeasesMySQL tests run several worker processes against a real
+database; they are skipped unless CF_DIFF_TEST_MYSQL is set, along with
+the usual MYSQL_USER, MYSQL_PASSWORD, MYSQL_HOST and MYSQL_CF_DATABASE.
+"""
+import multiprocessing
+import os
+import time
+import unittest
+import uuid
+
+import pytest
+from mock import MagicMock, PropertyMock
+from testfixtures import LogCapture
+
+import constants
+import leases
+from deadline import Deadline
+
+#pylint: disable=protected-access, invalid-name
+
+
+def fake_db(*rowcounts):
+    """
+    A StatsDB stand in whose transactions report the given row counts.
+    """
+    db = MagicMock()
+    cursor = db.transaction.return_value.__enter__.return_value
+    type(cursor).rowcount = PropertyMock(side_effect=rowcounts)
+    return db, cursor
+
+
+class TestLeases(unittest.TestCase):
+    """
+    Test lease claims and their life cycle.
+    """
+    def testClaim(self):
+        """
+        Test a claim is one conditional update, won by a single instance
+        """
+        db, cursor = fake_db(1, 0)
+        manager = leases.LeaseManager(db, owner='me', ttl=1.5, hold=10)
+        lease = manager.claim('f', 'applications')
+        self.assertEqual((lease.foundation, lease.resource),
+                         ('f', 'applications'))
+        sql, args = cursor.execute.call_args[0]
+        self.assertIn("expires_at <= NOW(6)", sql)
+        self.assertEqual(args, ('me', 1500000, 'f', 'applications'))
+        self.assertIsNone(manager.claim('f', 'applications'))
+        self.assertEqual(manager.heartbeat, 0.5)
+
+    def testLogger(self):
+        """
+        Test a lease logs through the logger its manager was given
+        """
+        db, _ = fake_db(1)
+        logger = MagicMock()
+        manager = leases.LeaseManager(db, owner='me', logger=logger)
+        lease = manager.claim('f', 'applications')
+        self.assertIs(lease.logger, logger)
+        logger.debug.assert_called_with("Lease %s/%s %s by %s", 'f',
+                                        'applications', "claimed", 'me')
+
+    def testFinish(self):
+        """
+        Test finished work keeps its lease for the hold time
+        """
+        db, cursor = fake_db(1, 1)
+        manager = leases.LeaseManager(db, owner='me', ttl=60, hold=10)
+        with manager.claim('f', 'applications') as lease:
+            pass
+        self.assertFalse(lease.lost)
+        sql, args = cursor.execute.call_args[0]
+        self.assertIn("finished_at = NOW(6)", sql)
+        self.assertEqual(args, (10000000, 'f', 'applications', 'me'))
+
+    def testRelease(self):
+        """
+        Test failed work gives its lease up at once
+        """
+        db, cursor = fake_db(1, 1)
+        manager = leases.LeaseManager(db, owner='me')
+        with pytest.raises(RuntimeError):
+            with manager.claim('f', 'applications'):
+                raise RuntimeError("audit failed")
+        sql, args = cursor.execute.call_args[0]
+        self.assertIn("SET expires_at = NOW(6) WHERE", sql)
+        self.assertEqual(args, ('f', 'applications', 'me'))
+
+    def testNotDone(self):
+        """
+        Test work cut short (not done) gives its lease up too
+        """
+        db, cursor = fake_db(1, 1)
+        manager = leases.LeaseManager(db, owner='me')
+        with manager.claim('f', 'applications') as lease:
+            lease.done = False
+        self.assertIn("SET expires_at = NOW(6) WHERE",
+                      cursor.execute.call_args[0][0])
+        db.transaction.assert_called_with(
+            timeout=constants.DB_GRACE_TIMEOUT)
+
+    def testHeartbeat(self):
+        """
+        Test heartbeats renew the lease until it is found taken over, and
+        that the work's deadline is then cancelled
+        """
+        db, cursor = fake_db(1, 1, 1, 0)
+        manager = leases.LeaseManager(db, owner='me', heartbeat=0.01)
+        work = Deadline()
+        with LogCapture() as log_capture:
+            with manager.claim('f', 'applications', deadline=work) as lease:
+                deadline = time.time() + 5
+                while not lease.lost and time.time() < deadline:
+                    time.sleep(0.01)
+        self.assertTrue(lease.lost)
+        self.assertTrue(work.expired)
+        # claim (2 statements), 3 heartbeats, and no finish once lost
+        self.assertEqual(cursor.execute.call_count, 5)
+        log_capture.check_present(
+            ('logger', 'WARNING',
+             'Lease f/applications lost to another instance'))
+
+
+def _worker(names, results, ttl, hold, pause):
+    """
+    Process body: audit (sleep) whatever units can be claimed.
+    """
+    import statsdb
+    manager = leases.LeaseManager(statsdb.StatsDB(), ttl=ttl, hold=hold)
+    for name in names:
+        lease = manager.claim(name, 'applications')
+        if lease is None:
+            continue
+        with lease:
+            time.sleep(pause)
+        results.put((name, manager.owner))
+
+
+def _crashing_worker(name, ttl):
+    """
+    Process body: claim a unit, then die without finishing it.
+    """
+    import statsdb
+    manager = leases.LeaseManager(statsdb.StatsDB(), ttl=ttl)
+    lease = manager.claim(name, 'applications')
+    os._exit(0 if lease is not None else 1)
+
+
+@pytest.mark.skipif(not os.environ.get('CF_DIFF_TEST_MYSQL'),
+                    reason="CF_DIFF_TEST_MYSQL not set")
+class TestLeasesMySQL(unittest.TestCase):
+    """
+    Test several processes sharing work through a local database.
+    """
+    def setUp(self):
+        import statsdb
+        self.db = statsdb.StatsDB()
+        self.prefix = 'test-{}-'.format(uuid.uuid4().hex[:8])
+        leases.LeaseManager(self.db).ensure_table()
+
+    def tearDown(self):
+        with self.db.transaction() as cursor:
+            cursor.execute("DELETE FROM {} WHERE foundation LIKE %s"
+                           .format(leases.LEASES_TABLE), (self.prefix + '%',))
+
+    def testNoDoubleWork(self):
+        """
+        Test each unit is done exactly once by competing processes
+        """
+        names = ['{}{}'.format(self.prefix, i) for i in range(8)]
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=_worker,
+                                           args=(names, results, 5, 60, 0.2))
+                   for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join(30)
+        done = [results.get(timeout=5) for _ in names]
+        self.assertEqual(sorted(name for name, _ in done), names)
+        self.assertTrue(results.empty())
+
+    def testCrashedWorker(self):
+        """
+        Test the unit of a crashed process is picked up once its lease lapses
+        """
+        name = self.prefix + 'crash'
+        worker = multiprocessing.Process(target=_crashing_worker,
+                                         args=(name, 1))
+        worker.start()
+        worker.join(30)
+        self.assertEqual(worker.exitcode, 0)
+        manager = leases.LeaseManager(self.db, ttl=5)
+        self.assertIsNone(manager.claim(name, 'applications'))
+        time.sleep(1.5)
+        lease = manager.claim(name, 'applications')
+        self.assertIsNotNone(lease)
+        with lease:
+            pass
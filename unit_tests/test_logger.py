@@ -0,0 +1,84 @@
+"""
+Unit tests for the cf-diff tool logger module
+"""
+import io
+import json
+import logging
+import unittest
+
+import logger
+
+#pylint: disable=protected-access, invalid-name
+
+
+class TestHandlers(unittest.TestCase):
+    """
+    Test the handler factory and formatters.
+    """
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.log = logging.getLogger('test_logger')
+        self.log.propagate = False
+        self.log.setLevel(logging.DEBUG)
+
+    def tearDown(self):
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+
+    def testJsonFormat(self):
+        """
+        Test JSON records, including 'extra' fields
+        """
+        handler, listener = logger.make_handler(self.stream, fmt='json')
+        self.assertIsNone(listener)
+        self.log.addHandler(handler)
+        self.log.info("count %d", 42, extra={'foundation': 'px-stg'})
+        entry = json.loads(self.stream.getvalue())
+        self.assertEqual(entry['message'], 'count 42')
+        self.assertEqual(entry['level'], 'INFO')
+        self.assertEqual(entry['foundation'], 'px-stg')
+
+    def testQueueMode(self):
+        """
+        Test that queued records are all written once the listener stops
+        """
+        handler, listener = logger.make_handler(self.stream, mode='queue')
+        self.log.addHandler(handler)
+        for i in range(100):
+            self.log.debug("record %d", i)
+        listener.stop()
+        lines = self.stream.getvalue().splitlines()
+        self.assertEqual(lines, ["record {}".format(i) for i in range(100)])
+
+    def testQueueFullDrops(self):
+        """
+        Test that a full queue drops records rather than blocking
+        """
+        handler, listener = logger.make_handler(self.stream, mode='queue',
+                                                queue_size=1)
+        listener.stop()
+        self.log.addHandler(handler)
+        for i in range(3):
+            self.log.info("record %d", i)
+        self.assertEqual(handler.dropped, 2)
+
+
+class TestLogger(unittest.TestCase):
+    """
+    Test the application logger.
+    """
+    def testRedirect(self):
+        """
+        Test that records go to the new stream once redirected
+        """
+        app_logger = logger.Logger()
+        handler = app_logger._stream_handler
+        original = handler.stream
+        stream = io.StringIO()
+        try:
+            app_logger.redirect(stream)
+            handler.emit(logging.makeLogRecord({'msg': 'to the new stream'}))
+        finally:
+            app_logger.redirect(original)
+        self.assertEqual(stream.getvalue(), 'to the new stream\n')
+        self.assertIs(handler.stream, original)
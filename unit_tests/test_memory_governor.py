@@ -0,0 +1,157 @@
+"""
+Unit tests for the cf-diff tool memory_governor module
+"""
+import os
+import tracemalloc
+import unittest
+
+from mock import patch, MagicMock
+from testfixtures import LogCapture
+
+import memory_governor
+
+#pylint: disable=protected-access, invalid-name
+
+MIB = 1024 ** 2
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemoryGovernor(unittest.TestCase):
+    """
+    Test the memory budget scaling.
+    """
+    def make(self, usage, limit=100 * MIB, **kwargs):
+        """
+        A governor whose RSS is usage (a list, so tests can change it).
+        """
+        clock = FakeClock()
+        governor = memory_governor.MemoryGovernor(
+            limit=limit, high=0.75, low=0.5, interval=1.0,
+            rss=lambda: usage[0], clock=clock, **kwargs)
+        return governor, clock
+
+    def testParseSize(self):
+        """
+        Test memory sizes as Cloud Foundry and people write them
+        """
+        self.assertEqual(memory_governor.parse_size('2048m'), 2048 * MIB)
+        self.assertEqual(memory_governor.parse_size('2G'), 2048 * MIB)
+        self.assertEqual(memory_governor.parse_size('512MB'), 512 * MIB)
+        self.assertEqual(memory_governor.parse_size('1048576'), MIB)
+        self.assertIsNone(memory_governor.parse_size(''))
+        self.assertIsNone(memory_governor.parse_size(None))
+
+    def testRSS(self):
+        """
+        Test the resident set size is read (where /proc exists)
+        """
+        rss = memory_governor.rss_bytes()
+        if os.path.exists('/proc/self/statm'):
+            self.assertGreater(rss, MIB)
+        with patch('builtins.open', side_effect=OSError):
+            self.assertIsNone(memory_governor.rss_bytes())
+
+    def testShrinkAndGrow(self):
+        """
+        Test sizes halve near the limit and grow back with headroom
+        """
+        usage = [80 * MIB]
+        governor, clock = self.make(usage)
+        with LogCapture() as log_capture:
+            self.assertEqual(governor.scale(8), 4)
+        log_capture.check(('logger', 'WARNING',
+                           'Memory at 80% of limit, scaling buffers to 0.50'))
+        # Sampled at most once per interval
+        self.assertEqual(governor.scale(8), 4)
+        clock.now += 1
+        self.assertEqual(governor.scale(8), 2)
+        usage[0] = 60 * MIB
+        clock.now += 1
+        self.assertEqual(governor.scale(8), 2)
+        usage[0] = 10 * MIB
+        clock.now += 1
+        self.assertEqual(governor.factor, 0.375)
+        for _ in range(10):
+            clock.now += 1
+            governor.sample()
+        self.assertEqual(governor.scale(8), 8)
+        stats = governor.stats
+        self.assertEqual((stats['shrinks'], stats['grows']), (2, 6))
+        self.assertEqual(stats['peak_rss'], 80 * MIB)
+
+    def testMinimum(self):
+        """
+        Test the scale factor and scaled sizes have floors
+        """
+        governor, clock = self.make([99 * MIB], min_factor=0.25)
+        for _ in range(5):
+            governor.sample()
+            clock.now += 1
+        self.assertEqual(governor.factor, 0.25)
+        self.assertEqual(governor.scale(1000, minimum=500), 500)
+        self.assertEqual(governor.scale(2), 1)
+
+    def testUnlimited(self):
+        """
+        Test that without a limit (or an RSS reading) nothing is scaled
+        """
+        governor, _ = self.make([10 ** 12], limit=None)
+        self.assertEqual(governor.scale(8), 8)
+        governor, _ = self.make([None])
+        self.assertEqual(governor.scale(8), 8)
+
+    def testOnShrink(self):
+        """
+        Test shrink callbacks run, and bound methods are held weakly
+        """
+        governor, clock = self.make([90 * MIB])
+        callback = MagicMock()
+        governor.on_shrink(callback)
+
+        class Owner(object):
+            calls = 0
+
+            def trim(self):
+                Owner.calls += 1
+
+        owner = Owner()
+        governor.on_shrink(owner.trim)
+        governor.sample()
+        del owner
+        clock.now += 1
+        governor.sample()
+        self.assertEqual(callback.call_count, 2)
+        self.assertEqual(Owner.calls, 1)
+
+    def testTrace(self):
+        """
+        Test the tracemalloc peak is tracked when tracing is requested
+        """
+        if tracemalloc.is_tracing():
+            self.skipTest("tracemalloc already running")
+        governor, _ = self.make([10 * MIB], trace=True)
+        try:
+            data = [bytearray(1024) for _ in range(100)]
+            governor.sample(force=True)
+            self.assertGreater(governor.stats['traced_peak'], 100 * 1024)
+            del data
+        finally:
+            governor.stop()
+        self.assertFalse(tracemalloc.is_tracing())
+
+    def testGovernor(self):
+        """
+        Test the process wide governor is configured from the environment
+        """
+        with patch.object(memory_governor, '_governor', None), \
+             patch.dict(os.environ, {'MEMORY_LIMIT': '2048m'}):
+            governor = memory_governor.governor()
+            self.assertIs(memory_governor.governor(), governor)
+            self.assertEqual(governor.limit, 2048 * MIB)
@@ -25,7 +25,7 @@ class TestParams(unittest.TestCase):
                     'CC_URL': 'e/f/g/h'}
         with patch.dict(os.environ, test_env) as mock_env:
             param = parameters.SysParams()
-        self.assertEqual(param, test_env)
+        self.assertEqual({key: param[key] for key in test_env}, test_env)
 
     def testParamMissing(self):
         """
@@ -42,3 +42,54 @@ class TestParams(unittest.TestCase):
             except KeyError:
                 pass
             param = parameters.SysParams().reload()
+
+    def testParamConversion(self):
+        """
+        Test the typed parameter accessors
+        """
+        test_env = {'OAUTH_CLIENT_ID': 'id',
+                    'OAUTH_CLIENT_SECRET': 'shhh',
+                    'FOUNDATION': 'foundation',
+                    'CC_URL': 'e/f/g/h',
+                    'CC_CACHE_SIZE': '7',
+                    'CC_CACHE_TTL': '1.5'}
+        with patch.dict(os.environ, test_env):
+            param = parameters.SysParams()
+            param.reload()
+            self.assertEqual(param.get_int('CC_CACHE_SIZE'), 7)
+            self.assertEqual(param.get_float('CC_CACHE_TTL'), 1.5)
+            param['SOME_FLAG'] = 'Yes'
+            self.assertTrue(param.get_bool('SOME_FLAG'))
+            param['SOME_FLAG'] = 'off'
+            self.assertFalse(param.get_bool('SOME_FLAG'))
+            param['SOME_FLAG'] = ' a,b ,, c'
+            self.assertEqual(param.get_list('SOME_FLAG'), ['a', 'b', 'c'])
+            param.pop('SOME_FLAG')
+            os.environ.pop('CC_CACHE_SIZE')
+            os.environ.pop('CC_CACHE_TTL')
+            param.reload()
+
+    def testForFoundation(self):
+        """
+        Test per-foundation copies of the parameters
+        """
+        test_env = {'OAUTH_CLIENT_ID': 'id',
+                    'OAUTH_CLIENT_SECRET': 'shhh',
+                    'FOUNDATION': 'foundation',
+                    'CC_URL': 'e/f/g/h',
+                    'OAUTH_CLIENT_SECRET__PROD_EAST': 'prod secret',
+                    'MYSQL_HOST__PROD_EAST': 'prod-db',
+                    '__PROD_EAST': 'no name'}
+        with patch.dict(os.environ, test_env):
+            param = parameters.SysParams()
+            param.reload()
+            prod = param.for_foundation('prod-east')
+        self.assertIsInstance(prod, parameters.Params)
+        self.assertNotIsInstance(prod, parameters.SysParams)
+        self.assertEqual(prod['FOUNDATION'], 'prod-east')
+        self.assertEqual(prod['OAUTH_CLIENT_SECRET'], 'prod secret')
+        self.assertEqual(prod['MYSQL_HOST'], 'prod-db')
+        self.assertEqual(prod['OAUTH_CLIENT_ID'], 'id')
+        self.assertNotIn('', prod)
+        self.assertEqual(param['OAUTH_CLIENT_SECRET'], 'shhh')
+        self.assertIs(parameters.SysParams(), param)
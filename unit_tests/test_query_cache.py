@@ -0,0 +1,141 @@
+"""
+Unit tests for the cf-diff tool query_cache module
+"""
+import unittest
+
+from mock import MagicMock
+
+import query_cache
+
+#pylint: disable=protected-access, invalid-name
+
+
+class TestQueryCacheHelpers(unittest.TestCase):
+    """
+    Test SQL normalization and table extraction.
+    """
+    def testNormalize(self):
+        """
+        Test whitespace is collapsed outside quotes only
+        """
+        self.assertEqual(query_cache.normalize(
+            "  SELECT a,\n\tb  FROM t WHERE c = 'x  y' ;"),
+                         "SELECT a, b FROM t WHERE c = 'x  y'")
+        self.assertEqual(query_cache.normalize('SELECT "it\\"s  " FROM  `t  u`'),
+                         'SELECT "it\\"s  " FROM `t  u`')
+
+    def testTables(self):
+        """
+        Test the tables read by a query are found
+        """
+        self.assertEqual(query_cache.tables(
+            "SELECT COUNT(DISTINCT GUID) FROM applications"),
+                         ('applications',))
+        self.assertEqual(query_cache.tables(
+            "SELECT * FROM db.`spaces` s JOIN apps a ON a.s = s.guid"),
+                         ('apps', 'spaces'))
+        self.assertEqual(query_cache.tables(
+            "SELECT TABLE_NAME FROM information_schema.TABLES"), ())
+
+    def testCachedResult(self):
+        """
+        Test the cursor-like interface over cached rows
+        """
+        result = query_cache.CachedResult(((1,), (2,), (3,), (4,)), ['n'])
+        self.assertEqual(result.column_names, ('n',))
+        self.assertEqual(result.rowcount, 4)
+        self.assertEqual(result.fetchone(), (1,))
+        self.assertEqual(result.fetchmany(2), [(2,), (3,)])
+        self.assertEqual(list(result), [(4,)])
+        self.assertIsNone(result.fetchone())
+        self.assertEqual(result.fetchall(), [])
+
+
+class TestQueryCache(unittest.TestCase):
+    """
+    Test caching, expiry and invalidation of query results.
+    """
+    def setUp(self):
+        self.now = 100.0
+        self.versions = {'applications': 'v1'}
+        self.run = MagicMock(side_effect=self.fake_run)
+        self.probe = MagicMock(side_effect=lambda names: {
+            name: self.versions.get(name) for name in names})
+        self.qcache = query_cache.QueryCache(4, 60, probe_ttl=5,
+                                             max_rows=10, clock=self.clock)
+
+    def clock(self):
+        return self.now
+
+    @staticmethod
+    def fake_run(sql, args):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [(42,)]
+        cursor.column_names = ('count',)
+        return cursor
+
+    def query(self, sql, args=None):
+        return self.qcache.query(sql, args, self.run, self.probe)
+
+    def testHit(self):
+        """
+        Test a repeated query (up to whitespace) is answered from the cache
+        """
+        sql = "SELECT COUNT(*) FROM applications"
+        self.assertEqual(self.query(sql).fetchall(), [(42,)])
+        result = self.query("SELECT  COUNT(*)\nFROM applications")
+        self.assertEqual(result.fetchall()[0][0], 42)
+        self.assertEqual(self.run.call_count, 1)
+        # the table version is probed once, then trusted for probe_ttl
+        self.assertEqual(self.probe.call_count, 1)
+        self.query(sql, ('arg',))
+        self.assertEqual(self.run.call_count, 2)
+        stats = self.qcache.stats
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (1, 2, 2))
+
+    def testInvalidated(self):
+        """
+        Test a write to a table (a new UPDATE_TIME) invalidates its results
+        """
+        sql = "SELECT COUNT(*) FROM applications"
+        self.query(sql)
+        self.versions['applications'] = 'v2'
+        self.query(sql)
+        self.assertEqual(self.run.call_count, 1)
+        self.now += 6
+        self.query(sql)
+        self.assertEqual(self.run.call_count, 2)
+        self.assertEqual(self.qcache.stats['invalidations'], 1)
+        self.query(sql)
+        self.assertEqual(self.run.call_count, 2)
+
+    def testExpired(self):
+        """
+        Test results are not reused beyond the TTL
+        """
+        self.query("SELECT 1")
+        self.now += 61
+        self.query("SELECT 1")
+        self.assertEqual(self.run.call_count, 2)
+        self.probe.assert_not_called()
+
+    def testNotCached(self):
+        """
+        Test writes, locking reads and large results bypass the cache
+        """
+        self.qcache.query("SELECT 1", None, self.run, self.probe)
+        for sql in ("SHOW TABLES", "SELECT * FROM t FOR UPDATE",
+                    "EXPLAIN SELECT * FROM t"):
+            self.query(sql)
+            self.query(sql)
+        self.assertEqual(self.qcache.stats['size'], 1)
+        self.query("CREATE INDEX i ON t(c)")
+        self.assertEqual(self.qcache.stats['size'], 0)
+
+        run = MagicMock()
+        run.return_value.fetchall.return_value = [(n,) for n in range(11)]
+        result = self.qcache.query("SELECT n FROM t", None, run, self.probe)
+        self.assertEqual(len(result.fetchall()), 11)
+        self.assertEqual(self.qcache.stats['too_large'], 1)
+        self.assertEqual(self.qcache.stats['size'], 0)
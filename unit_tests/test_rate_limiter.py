@@ -0,0 +1,141 @@
+"""
+Unit tests for the cf-diff tool rate_limiter module
+"""
+import threading
+import unittest
+
+from mock import MagicMock
+
+import rate_limiter
+
+#pylint: disable=protected-access, invalid-name
+
+
+def make_reply(status=200, headers=None):
+    """
+    A minimal reply object.
+    """
+    reply = MagicMock()
+    reply.status_code = status
+    reply.headers = headers or {}
+    return reply
+
+
+class FakeClock(object):
+    """
+    Manually advanced time source.
+    """
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class TestBackoff(unittest.TestCase):
+    """
+    Test the backoff helpers.
+    """
+    def testBackoffDelay(self):
+        """
+        Test the exponential schedule, jitter range and cap
+        """
+        self.assertEqual(rate_limiter.backoff_delay(0, rand=lambda: 1.0), 0.5)
+        self.assertEqual(rate_limiter.backoff_delay(3, rand=lambda: 1.0), 4.0)
+        self.assertEqual(rate_limiter.backoff_delay(3, rand=lambda: 0.0), 2.0)
+        self.assertEqual(rate_limiter.backoff_delay(20, rand=lambda: 1.0), 30.0)
+
+    def testParseRetryAfter(self):
+        """
+        Test delta-seconds and HTTP-date Retry-After values
+        """
+        self.assertEqual(rate_limiter.parse_retry_after('7'), 7.0)
+        self.assertIsNone(rate_limiter.parse_retry_after(None))
+        self.assertIsNone(rate_limiter.parse_retry_after('soon'))
+        date = 'Wed, 21 Oct 2015 07:28:10 GMT'
+        self.assertEqual(rate_limiter.parse_retry_after(date, now=1445412480),
+                         10.0)
+
+
+class TestAdaptiveLimiter(unittest.TestCase):
+    """
+    Test the AIMD behaviour of the AdaptiveLimiter class.
+    """
+    def testAdditiveIncrease(self):
+        """
+        Test that successful replies grow rate and concurrency to the caps
+        """
+        limiter = rate_limiter.AdaptiveLimiter(rate=1.0, concurrency=1,
+                                               max_rate=3.0, max_concurrency=2)
+        for _ in range(10):
+            limiter.observe(make_reply())
+        self.assertEqual(limiter.rate, 3.0)
+        self.assertEqual(limiter.concurrency, 2)
+
+    def testThrottled(self):
+        """
+        Test that a 429 halves the rate and pauses for Retry-After
+        """
+        clock = FakeClock()
+        limiter = rate_limiter.AdaptiveLimiter(rate=8.0, concurrency=4,
+                                               clock=clock)
+        pause = limiter.observe(make_reply(429, {'Retry-After': '5'}))
+        self.assertEqual(pause, 5.0)
+        self.assertEqual(limiter.rate, 4.0)
+        self.assertEqual(limiter.concurrency, 2)
+        self.assertEqual(limiter._paused_until, clock.now + 5.0)
+
+    def testAcquireTimeout(self):
+        """
+        Test that a pause, or a wait for a slot, past the timeout fails at once
+        """
+        clock = FakeClock()
+        limiter = rate_limiter.AdaptiveLimiter(rate=8.0, concurrency=1,
+                                               clock=clock)
+        limiter.observe(make_reply(429, {'Retry-After': '3600'}))
+        self.assertFalse(limiter.acquire(timeout=1.0))
+        with self.assertRaises(rate_limiter.SlotTimeout):
+            with limiter.slot(1.0):
+                pass
+        clock.now += 3600
+        self.assertTrue(limiter.acquire(timeout=1.0))
+
+    def testRemainingBudget(self):
+        """
+        Test the X-RateLimit headers: pace to the window, pause when spent
+        """
+        clock = FakeClock()
+        wallclock = FakeClock(5000.0)
+        limiter = rate_limiter.AdaptiveLimiter(rate=40.0, max_rate=50.0,
+                                               reserve=5, clock=clock,
+                                               wallclock=wallclock)
+        limiter.observe(make_reply(headers={'X-RateLimit-Remaining': '105',
+                                            'X-RateLimit-Reset': '5010'}))
+        self.assertEqual(limiter.rate, 10.0)
+
+        pause = limiter.observe(make_reply(headers={'X-RateLimit-Remaining': '3',
+                                                    'X-RateLimit-Reset': '5030'}))
+        self.assertEqual(pause, 30.0)
+        self.assertEqual(limiter.rate, 5.0)
+
+    def testConcurrencyBound(self):
+        """
+        Test that no more than 'concurrency' requests are in flight
+        """
+        limiter = rate_limiter.AdaptiveLimiter(rate=1000.0, concurrency=2,
+                                               max_rate=1000.0)
+        limiter._tokens = 1000.0
+        limiter.acquire()
+        limiter.acquire()
+        blocked = threading.Event()
+
+        def third():
+            limiter.acquire()
+            blocked.set()
+
+        worker = threading.Thread(target=third)
+        worker.start()
+        self.assertFalse(blocked.wait(0.1))
+        limiter.release()
+        self.assertTrue(blocked.wait(1.0))
+        worker.join()
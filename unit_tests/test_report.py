@@ -0,0 +1,161 @@
+"""
+Unit tests for the cf-diff tool report module
+"""
+import csv
+import gzip
+import json
+import os
+import pytest
+import shutil
+import sys
+import tempfile
+import unittest
+
+from mock import patch
+
+import differ
+import report
+
+#pylint: disable=protected-access, invalid-name
+
+FOUND = [differ.Discrepancy('g1', differ.MISSING_IN_DB),
+         differ.Discrepancy('g2', differ.MISSING_IN_CC)]
+
+
+class TestReport(unittest.TestCase):
+    """
+    Test the streaming report writers.
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, fmt, compress=False):
+        path = os.path.join(self.tmpdir, name)
+        with report.open_report(path, fmt, 'fnd', 'applications',
+                                compress=compress, buffer_size=16) as writer:
+            for item in FOUND:
+                writer.write(item)
+        self.assertEqual(writer.written, len(FOUND))
+        return path
+
+    def testNDJSON(self):
+        """
+        Test one JSON object per discrepancy
+        """
+        path = self.write('report.ndjson', 'ndjson')
+        with open(path) as infile:
+            rows = [json.loads(line) for line in infile]
+        self.assertEqual(rows[0], {'foundation': 'fnd',
+                                   'resource': 'applications',
+                                   'guid': 'g1', 'kind': differ.MISSING_IN_DB})
+        self.assertEqual(len(rows), 2)
+
+    def testCSV(self):
+        """
+        Test CSV output with a header row
+        """
+        path = self.write('report.csv', 'CSV')
+        with open(path, newline='') as infile:
+            rows = list(csv.reader(infile))
+        self.assertEqual(rows[0], list(report.FIELDS))
+        self.assertEqual(rows[2], ['fnd', 'applications', 'g2',
+                                   differ.MISSING_IN_CC])
+
+    def testDetails(self):
+        """
+        Test discrepancy details are written when requested
+        """
+        found = [differ.DetailedDiscrepancy('g1', differ.MISSING_IN_DB,
+                                            {'name': 'app'}),
+                 differ.DetailedDiscrepancy('g2', differ.MISSING_IN_CC, None)]
+        for fmt in ('ndjson', 'csv'):
+            path = os.path.join(self.tmpdir, 'report.' + fmt)
+            with report.open_report(path, fmt, 'fnd', 'applications',
+                                    details=True) as writer:
+                for item in found:
+                    writer.write(item)
+            with open(path, newline='') as infile:
+                if fmt == 'ndjson':
+                    rows = [json.loads(line) for line in infile]
+                    self.assertEqual(rows[0]['details'], {'name': 'app'})
+                    self.assertIsNone(rows[1]['details'])
+                else:
+                    rows = list(csv.reader(infile))
+                    self.assertEqual(rows[0][-1], 'details')
+                    self.assertEqual(json.loads(rows[1][-1]), {'name': 'app'})
+                    self.assertEqual(rows[2][-1], '')
+
+    def testIncomplete(self):
+        """
+        Test a partial report ends with an 'incomplete' trailer row
+        """
+        for fmt, details in (('ndjson', False), ('csv', False), ('csv', True)):
+            path = os.path.join(self.tmpdir, 'report.' + fmt)
+            with report.open_report(path, fmt, 'fnd', 'applications',
+                                    details=details) as writer:
+                writer.write(FOUND[0])
+                writer.mark_incomplete("Deadline exceeded")
+            self.assertEqual(writer.written, 1)
+            with open(path, newline='') as infile:
+                if fmt == 'ndjson':
+                    last = [json.loads(line) for line in infile][-1]
+                    self.assertEqual((last['kind'], last['reason']),
+                                     (report.INCOMPLETE, "Deadline exceeded"))
+                else:
+                    last = list(csv.reader(infile))[-1]
+                    # the reason follows the (empty) details column
+                    self.assertEqual(last, ['fnd', 'applications', '',
+                                            report.INCOMPLETE] +
+                                     ([''] if details else []) +
+                                     ["Deadline exceeded"])
+
+    def testCompressed(self):
+        """
+        Test gzip output, requested explicitly or by a .gz path
+        """
+        for name, compress in (('report.out', True), ('report.csv.gz', False)):
+            path = self.write(name, 'csv', compress=compress)
+            with gzip.open(path, 'rt', newline='') as infile:
+                rows = list(csv.reader(infile))
+            self.assertEqual(len(rows), 3)
+
+    def testStdout(self):
+        """
+        Test writing to stdout leaves stdout open
+        """
+        with patch('logger.Logger.redirect') as mock_redirect:
+            with report.open_report('-', 'ndjson', 'fnd',
+                                    'applications') as writer:
+                writer.write(FOUND[0])
+        self.assertFalse(sys.stdout.closed)
+        # the log moves out of the report's way
+        mock_redirect.assert_called_once_with(sys.stderr)
+
+    def testAbstract(self):
+        """
+        Test that a writer must implement the row format
+        """
+        with pytest.raises(TypeError):
+            report.ReportWriter(sys.stdout, 'fnd', 'applications')
+
+    def testUnknownFormat(self):
+        """
+        Test that an unknown format is rejected before anything is opened
+        """
+        with pytest.raises(ValueError):
+            report.open_report(os.path.join(self.tmpdir, 'r'), 'xml',
+                               'fnd', 'applications')
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def testFoundationPath(self):
+        """
+        Test a foundation's report path keeps the path's extensions
+        """
+        self.assertEqual(report.foundation_path('out/r.ndjson', 'east'),
+                         'out/r.east.ndjson')
+        self.assertEqual(report.foundation_path('r.csv.gz', 'east'),
+                         'r.east.csv.gz')
+        self.assertEqual(report.foundation_path('-', 'east'), '-')
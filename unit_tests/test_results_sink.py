@@ -0,0 +1,101 @@
+"""
+Unit tests for the cf-diff tool results_sink module
+"""
+import contextlib
+import pytest
+import unittest
+
+from mock import MagicMock
+
+import constants
+import differ
+import results_sink
+from statsdb import StatsDB
+
+#pylint: disable=protected-access, invalid-name
+
+
+class FakeDB(object):
+    """
+    StatsDB stand-in recording the transaction outcome.
+    """
+    def __init__(self):
+        self.cursor = MagicMock()
+        self.cursor.lastrowid = 7
+        self.query = MagicMock()
+        self.outcome = None
+        self.timeout = None
+        self.insert_many = StatsDB.insert_many
+
+    @contextlib.contextmanager
+    def transaction(self, timeout=None):
+        self.timeout = timeout
+        try:
+            yield self.cursor
+            self.outcome = 'commit'
+        except:
+            self.outcome = 'rollback'
+            raise
+
+
+class TestResultsSink(unittest.TestCase):
+    """
+    Test basic operation of the ResultsSink class.
+    """
+    def testRun(self):
+        """
+        Test one committed run: summary row, batched discrepancy rows
+        """
+        db = FakeDB()
+        found = [differ.Discrepancy('g{}'.format(i), differ.MISSING_IN_DB)
+                 for i in range(5)]
+        found.append(differ.Discrepancy('x', differ.MISSING_IN_CC))
+        with results_sink.ResultsSink(db, 'fnd', 'applications',
+                                      batch_size=2) as sink:
+            sink.set_counts(10, 6)
+            for item in found:
+                sink.write(item)
+
+        self.assertEqual(db.outcome, 'commit')
+        self.assertEqual(db.query.call_count, len(results_sink._SCHEMA))
+        self.assertEqual(db.timeout, constants.DB_GRACE_TIMEOUT)
+        self.assertEqual(sink.run_id, 7)
+        batches = [c[0][1] for c in db.cursor.executemany.call_args_list]
+        self.assertEqual([len(b) for b in batches], [2, 2, 2])
+        self.assertEqual(batches[0][0], (7, 'g0', differ.MISSING_IN_DB))
+        insert_run, update_run = db.cursor.execute.call_args_list
+        self.assertIn('INSERT INTO cf_diff_runs', insert_run[0][0])
+        self.assertEqual(update_run[0][1][1:], (10, 6, 5, 1, 1, 7))
+
+    def testRollback(self):
+        """
+        Test that an error inside the run rolls the whole run back
+        """
+        db = FakeDB()
+        with pytest.raises(KeyError), \
+             results_sink.ResultsSink(db, 'fnd', 'applications') as sink:
+            sink.write(differ.Discrepancy('g', differ.MISSING_IN_DB))
+            raise KeyError
+        self.assertEqual(db.outcome, 'rollback')
+        db.cursor.executemany.assert_not_called()
+
+    def testIncomplete(self):
+        """
+        Test that a run cut short is committed and marked incomplete
+        """
+        db = FakeDB()
+        with results_sink.ResultsSink(db, 'fnd', 'applications') as sink:
+            sink.write(differ.Discrepancy('g', differ.MISSING_IN_DB))
+            sink.mark_incomplete("deadline")
+        self.assertEqual(db.outcome, 'commit')
+        update_run = db.cursor.execute.call_args_list[-1]
+        self.assertEqual(update_run[0][1][-2:], (0, 7))
+
+    def testCaseDistinctGuids(self):
+        """
+        Test GUIDs differing only in case are distinct discrepancy keys
+        """
+        schema = results_sink._SCHEMA[1]
+        self.assertIn("guid VARCHAR(36) CHARACTER SET ascii COLLATE ascii_bin",
+                      schema)
+        self.assertIn("PRIMARY KEY (run_id, guid)", schema)
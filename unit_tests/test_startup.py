@@ -0,0 +1,36 @@
+"""
+Unit tests for cf-diff cold start (lazy imports, time to first request)
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'benchmarks'))
+
+import bench_startup  # noqa: E402
+import constants  # noqa: E402
+
+#pylint: disable=protected-access, invalid-name
+
+
+class TestStartup(unittest.TestCase):
+    """
+    Test the cold start path of a scheduled run.
+    """
+    def testFirstRequest(self):
+        """
+        Test that the first request goes out before any of the lazily
+        imported modules are loaded.  (The time it takes is measured
+        against the budget by benchmarks/bench_startup.py, not here.)
+        """
+        _, loaded = bench_startup.time_to_first_request()
+        self.assertEqual(loaded, [])
+
+    def testImportBreakdown(self):
+        """
+        Test that importing cf_diff does not pull in the lazy modules
+        """
+        modules = [row[2].strip() for row in bench_startup.import_breakdown()]
+        self.assertIn('cf_diff', modules)
+        for lazy in constants.LAZY_MODULES:
+            self.assertNotIn(lazy, modules)
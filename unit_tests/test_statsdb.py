@@ -4,11 +4,17 @@ Unit tests for the cf-diff tool statsdb module
 import logging
 import os
 import pytest
+import time
 import unittest
 
 from mock import call, patch, MagicMock
 from testfixtures import LogCapture
 
+import cf_diff
+import constants
+import context
+import deadline
+import query_cache
 import statsdb
 
 #pylint: disable=protected-access, invalid-name
@@ -48,14 +54,86 @@ class TestStatsDB(unittest.TestCase):
         index_list = [('someName', 'someTable', 'someColumn'),
                       ('anotherName', 'anotherTable', 'anotherColumn')]
         with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB._existing_indices", return_value={}), \
              patch("statsdb.StatsDB.query") as mock_query:
             stats_obj = statsdb.StatsDB()
             stats_obj.logger = MagicMock()
-            stats_obj._make_table_indices(index_list)
+            created = stats_obj._make_table_indices(index_list)
 
-        queries = [call("CREATE OR REPLACE INDEX {} ON {}({})".format(n,t,c))
+        queries = [call("CREATE INDEX {} ON {}({})".format(n,t,c))
                    for n, t, c in index_list]
         mock_query.assert_has_calls(queries)
+        self.assertEqual(created, ['someName', 'anotherName'])
+
+    def testMakeIndicesExisting(self):
+        """
+        test that existing (by name or leading columns) indices are skipped
+        """
+        index_list = [('byName', 'tableA', 'guid'),
+                      ('byColumns', 'tableB', 'guid, updated_at'),
+                      ('missing', 'tableB', 'name')]
+        existing = {('tableA', 'byName'): ['other'],
+                    ('tableB', 'PRIMARY'): ['guid', 'updated_at', 'id']}
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB._existing_indices",
+                   return_value=existing) as mock_existing, \
+             patch("statsdb.StatsDB.query") as mock_query:
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            created = stats_obj._make_table_indices(index_list)
+
+        mock_existing.assert_called_once_with({'tableA', 'tableB'})
+        mock_query.assert_called_once_with("CREATE INDEX missing ON tableB(name)")
+        self.assertEqual(created, ['missing'])
+
+    def testExistingIndices(self):
+        """
+        test reading index definitions from information_schema
+        """
+        rows = [('t', 'idx', 'a'), ('t', 'idx', 'b'), ('t', 'PRIMARY', 'id')]
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB.query", return_value=rows) as mock_query:
+            stats_obj = statsdb.StatsDB()
+            existing = stats_obj._existing_indices(['t'])
+        self.assertEqual(existing, {('t', 'idx'): ['a', 'b'],
+                                    ('t', 'PRIMARY'): ['id']})
+        self.assertIn("TABLE_NAME IN ('t')", mock_query.call_args[0][0])
+
+    def testEnsureIndicesFails(self):
+        """
+        test that index provisioning failure is only a warning
+        """
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB._make_table_indices",
+                   side_effect=RuntimeError("denied")):
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            self.assertEqual(stats_obj.ensure_indices(), [])
+        stats_obj.logger.warning.assert_called_once()
+
+    def testVerifyQueryPlan(self):
+        """
+        test that full scans and filesorts are flagged
+        """
+        cursor = MagicMock()
+        cursor.column_names = ('table', 'type', 'key', 'Extra')
+        plans = {'good': [('applications', 'index', 'cf_diff_applications_guid',
+                           'Using index')],
+                 'scan': [('applications', 'ALL', None, None)],
+                 'sort': [('applications', 'range', 'x', 'Using filesort')]}
+
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB.query", return_value=cursor) as mock_query:
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            results = {}
+            for name, plan in plans.items():
+                cursor.__iter__.return_value = iter(plan)
+                results[name] = stats_obj.verify_query_plan("SELECT " + name)
+
+        self.assertEqual(results, {'good': True, 'scan': False, 'sort': False})
+        mock_query.assert_any_call("EXPLAIN SELECT good")
+        self.assertEqual(stats_obj.logger.warning.call_count, 2)
 
     def testConnect(self):
         """
@@ -81,6 +159,44 @@ class TestStatsDB(unittest.TestCase):
                                              database=stats_obj._database)
         stats_obj._conn.cursor.assert_called_once_with(buffered=stats_obj._buffered)
 
+    def testConnectDeadline(self):
+        """
+        test that connections are bounded by the run deadline
+        """
+        run = deadline.Deadline(10)
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("mysql.connector.connect") as mock_connect:
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            stats_obj._user = stats_obj._password = "x"
+            stats_obj._host = stats_obj._database = "x"
+            stats_obj._deadline = run
+            stats_obj._new_connection()
+            stats_obj._new_connection(timeout=30)
+        first, second = mock_connect.call_args_list
+        self.assertEqual(first[1]['connection_timeout'], 10)
+        self.assertEqual(second[1]['connection_timeout'], 30)
+        conn = mock_connect.return_value
+        conn.cursor.return_value.execute.assert_called_once_with(
+            "SET SESSION max_execution_time = 10000")
+
+    def testQueryDeadline(self):
+        """
+        test that a query failing once the deadline passed says so
+        """
+        with patch("statsdb.StatsDB.__init__", return_value=None):
+            stats_obj = statsdb.StatsDB()
+        stats_obj.logger = MagicMock()
+        stats_obj._connect = MagicMock()
+        stats_obj._cursor = MagicMock()
+        stats_obj._cursor.execute.side_effect = OSError("timed out")
+        with pytest.raises(OSError):
+            stats_obj.query("SELECT 1")
+        stats_obj._deadline = deadline.Deadline(1, clock=MagicMock(
+            side_effect=[0, 5, 5]))
+        with pytest.raises(deadline.DeadlineExceeded):
+            stats_obj.query("SELECT 1")
+
     def testConnectClose(self):
         """
         test the _connect function
@@ -120,15 +236,67 @@ class TestStatsDB(unittest.TestCase):
              patch("mysql.connector.connect") as mock_connect:
             stats_obj = statsdb.StatsDB()
             stats_obj.logger = MagicMock()
-            stats_obj._conn = MagicMock()
-            stats_obj._connect = MagicMock()
-            mock_cursor = MagicMock()
-            stats_obj._cursor = mock_cursor
+            stats_obj._conn = None
+            stats_obj._autocommit = False
+            mock_conn = MagicMock()
+            stats_obj._new_connection = MagicMock(return_value=mock_conn)
+            mock_cursor = mock_conn.cursor.return_value
 
             stats_obj.query(test_sql)
 
         mock_cursor.execute.assert_called_once_with(test_sql)
-        stats_obj._conn.close.assert_called_once
+        mock_conn.close.assert_called_once_with()
+        self.assertIsNone(stats_obj._conn)
+
+    def testQueryPooled(self):
+        """
+        test that queries return their connection to a context's pool
+        rather than closing it
+        """
+        pool = context.ConnectionPool(size=2)
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("mysql.connector.connect") as mock_connect:
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            stats_obj._user = stats_obj._password = "x"
+            stats_obj._host = stats_obj._database = "x"
+            stats_obj._autocommit = False
+            stats_obj._conn = None
+            stats_obj._pool = pool
+            mock_conn = mock_connect.return_value
+
+            for _ in range(2):
+                stats_obj.query("SELECT 1")
+            mock_connect.assert_called_once()
+            mock_conn.close.assert_not_called()
+            self.assertIsNone(stats_obj._conn)
+            self.assertIs(pool.get(), mock_conn)
+
+    def testQueryCached(self):
+        """
+        test that with the query cache enabled a repeated query is answered
+        from it, after probing the table's update time
+        """
+        with patch("statsdb.StatsDB.__init__", return_value=None):
+            stats_obj = statsdb.StatsDB()
+        stats_obj.logger = MagicMock()
+        stats_obj._conn = None
+        stats_obj._autocommit = False
+        mock_conn = MagicMock()
+        stats_obj._new_connection = MagicMock(return_value=mock_conn)
+        stats_obj._cursor = mock_conn.cursor.return_value
+        stats_obj._cursor.fetchall.side_effect = [[('applications', 'v1')],
+                                                  [(42,)]]
+        self.assertIsNone(stats_obj.query_cache_stats)
+        stats_obj._query_cache = query_cache.QueryCache(4, 60)
+        for _ in range(2):
+            rows = stats_obj.query(cf_diff.COUNT_SQL).fetchall()
+            self.assertEqual(rows, [(42,)])
+        probe, count = stats_obj._cursor.execute.call_args_list
+        self.assertIn("information_schema.TABLES", probe[0][0])
+        self.assertEqual(probe[0][1], ('applications',))
+        self.assertEqual(count, call(cf_diff.COUNT_SQL))
+        self.assertEqual(stats_obj.query_cache_stats['hits'], 1)
 
     def testConnectQueryDict(self):
         """
@@ -196,6 +364,279 @@ class TestStatsDB(unittest.TestCase):
         self.assertEqual(rtn, qrtn)
 
 
+    def testTransaction(self):
+        """
+        test the transaction context manager commit and rollback paths
+        """
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("mysql.connector.connect") as mock_connect:
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            stats_obj._user = stats_obj._password = "x"
+            stats_obj._host = stats_obj._database = "x"
+            mock_conn = mock_connect.return_value
+
+            with stats_obj.transaction() as cursor:
+                cursor.execute("INSERT 1")
+            mock_conn.commit.assert_called_once()
+            mock_conn.rollback.assert_not_called()
+
+            with pytest.raises(ValueError), stats_obj.transaction() as cursor:
+                raise ValueError
+            mock_conn.rollback.assert_called_once()
+            self.assertEqual(mock_conn.close.call_count, 2)
+
+    def testTransactionPooled(self):
+        """
+        test that a context's pool reuses committed connections only, and
+        only for work of the same timeout class
+        """
+        pool = context.ConnectionPool(size=2)
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("mysql.connector.connect") as mock_connect:
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            stats_obj._user = stats_obj._password = "x"
+            stats_obj._host = stats_obj._database = "x"
+            stats_obj._pool = pool
+            mock_conn = mock_connect.return_value
+
+            for _ in range(2):
+                with stats_obj.transaction() as cursor:
+                    cursor.execute("INSERT 1")
+            mock_connect.assert_called_once()
+            mock_conn.close.assert_not_called()
+
+            # bookkeeping on its own fixed timeout gets its own connection
+            grace = MagicMock()
+            mock_connect.return_value = grace
+            for _ in range(2):
+                with stats_obj.transaction(timeout=30) as cursor:
+                    cursor.execute("INSERT 1")
+            self.assertEqual(mock_connect.call_count, 2)
+            self.assertEqual(mock_connect.call_args[1]['connection_timeout'],
+                             30)
+            self.assertIs(pool.get(30), grace)
+
+            with pytest.raises(ValueError), stats_obj.transaction():
+                raise ValueError
+            mock_conn.close.assert_called_once()
+            self.assertIsNone(pool.get())
+
+    def testGuids(self):
+        """
+        test the guids generator: one connection, read in batches
+        """
+        mock_conn = MagicMock()
+        cursor = mock_conn.cursor.return_value
+        cursor.fetchmany.side_effect = [[('a',), ('b',)], [('c',)], []]
+        with patch("statsdb.StatsDB.__init__", return_value=None):
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            stats_obj._scan_connections = 1
+            stats_obj._new_connection = MagicMock(return_value=mock_conn)
+            guids = stats_obj.guids('applications')
+            self.assertEqual(next(guids), 'a')
+            # rows are fetched a batch at a time, as they are consumed
+            self.assertEqual(cursor.fetchmany.call_count, 1)
+            self.assertEqual(list(guids), ['b', 'c'])
+        mock_conn.cursor.assert_called_once_with()
+        cursor.execute.assert_called_once_with(
+            "SELECT DISTINCT guid FROM applications ORDER BY guid", ())
+        mock_conn.close.assert_called_once()
+
+    def testGuidOrder(self):
+        """
+        test the GUID sort key follows the column's collation
+        """
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB.query") as mock_query:
+            stats_obj = statsdb.StatsDB()
+            orders = []
+            for rows in ([('utf8_general_ci',)], [('utf8mb4_0900_as_cs',)],
+                         [('utf8_bin',)], [(None,)], []):
+                mock_query.return_value.fetchall.return_value = rows
+                orders.append(stats_obj.guid_order('applications'))
+        self.assertEqual(orders, [str.lower, str.lower, None, None, None])
+        self.assertEqual(mock_query.call_args[0][1], ('applications', 'guid'))
+
+    def testParallelGuids(self):
+        """
+        test the range-partitioned scan: one connection per range, merged
+        in ascending order
+        """
+        guids = sorted('{:02x}-guid'.format(i) for i in range(256))
+        connections = []
+
+        def new_connection():
+            conn = MagicMock()
+            cursor = conn.cursor.return_value
+
+            def execute(sql, args):
+                bounds = list(args)
+                lower = bounds.pop(0) if '>=' in sql else None
+                upper = bounds.pop(0) if ' < ' in sql else None
+                rows = [(g,) for g in guids
+                        if (lower is None or g >= lower) and
+                        (upper is None or g < upper)]
+                cursor.fetchmany.side_effect = [rows[:10], rows[10:], []]
+            cursor.execute.side_effect = execute
+            connections.append(conn)
+            return conn
+
+        with patch("statsdb.StatsDB.__init__", return_value=None):
+            stats_obj = statsdb.StatsDB()
+            stats_obj.logger = MagicMock()
+            stats_obj._new_connection = new_connection
+            result = list(stats_obj.guids('applications', connections=4,
+                                          partitions=8))
+
+        self.assertEqual(result, guids)
+        self.assertEqual(len(connections), 8)
+        for conn in connections:
+            conn.close.assert_called_once()
+
+
+    def testParallelGuidsReadAhead(self):
+        """
+        test the ranges of a parallel scan read ahead of the caller within
+        the read-ahead budget, and stop when the caller does
+        """
+        def scan(batches, read_ahead):
+            connections = []
+
+            def new_connection():
+                conn = MagicMock()
+                cursor = conn.cursor.return_value
+                cursor.fetchmany.side_effect = (
+                    [[('{:04d}'.format(i),)] for i in range(batches)] + [[]])
+                connections.append(conn)
+                return conn
+
+            with patch("statsdb.StatsDB.__init__", return_value=None), \
+                 patch.object(constants, 'DB_SCAN_READ_AHEAD',
+                              read_ahead * constants.DB_FETCH_BATCH):
+                stats_obj = statsdb.StatsDB()
+                stats_obj.logger = MagicMock()
+                stats_obj._new_connection = new_connection
+                guids = stats_obj.guids('applications', connections=4,
+                                        partitions=4)
+                self.assertEqual(next(guids), '0000')
+                time.sleep(0.2)
+                fetches = [conn.cursor.return_value.fetchmany.call_count
+                           for conn in connections]
+                guids.close()
+            for conn in connections:
+                conn.close.assert_called_once()
+            return fetches
+
+        # within budget, every range is read while the caller is busy
+        self.assertEqual(scan(5, 40), [6, 6, 6, 6])
+        # over it, the ranges after the head hold the budget (one batch;
+        # the others do not even connect) and the head the couple of
+        # batches it may always hold
+        fetches = scan(100, 1)
+        self.assertLessEqual(fetches[0], 3)
+        self.assertLessEqual(sum(fetches[1:]), 1)
+
+    def testParallelGuidsMixedCase(self):
+        """
+        test the range-partitioned scan of mixed case GUIDs: the ranges
+        concatenate into guid_order's order, whether the collation is
+        case insensitive or binary
+        """
+        guids = ['{:02x}-guid'.format(i) for i in range(0, 256, 7)]
+        guids += [guid.upper() for guid in guids[::3]]
+        for key in (str.lower, None):
+            ordered = sorted(guids, key=key)
+
+            def new_connection():
+                conn = MagicMock()
+                cursor = conn.cursor.return_value
+
+                def execute(sql, args):
+                    # pylint: disable=cell-var-from-loop
+                    bounds = list(args)
+                    lower = bounds.pop(0) if '>=' in sql else None
+                    upper = bounds.pop(0) if ' < ' in sql else None
+                    collate = key or (lambda value: value)
+                    rows = [(g,) for g in ordered
+                            if (lower is None or collate(g) >= lower) and
+                            (upper is None or collate(g) < upper)]
+                    cursor.fetchmany.side_effect = [rows, []]
+                cursor.execute.side_effect = execute
+                return conn
+
+            with patch("statsdb.StatsDB.__init__", return_value=None):
+                stats_obj = statsdb.StatsDB()
+                stats_obj.logger = MagicMock()
+                stats_obj._new_connection = new_connection
+                result = list(stats_obj.guids('applications', connections=3,
+                                              partitions=5))
+            self.assertEqual(result, ordered)
+
+    def testGuidsWithPrefixes(self):
+        """
+        test the prefix sample query
+        """
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB.query",
+                   return_value=[('ab1',), ('3f2',)]) as mock_query:
+            stats_obj = statsdb.StatsDB()
+            guids = stats_obj.guids_with_prefixes('applications', ['ab', '3f'])
+            self.assertEqual(stats_obj.guids_with_prefixes('applications', []),
+                             [])
+        self.assertEqual(guids, ['ab1', '3f2'])
+        mock_query.assert_called_once_with(
+            "SELECT DISTINCT guid FROM applications "
+            "WHERE guid LIKE %s OR guid LIKE %s", ('ab%', '3f%'))
+
+    def testLookup(self):
+        """
+        test the batch lookup of rows by GUID
+        """
+        cursor = MagicMock()
+        cursor.column_names = ('guid', 'name')
+        cursor.__iter__.return_value = iter([('g1', 'one')])
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB.query", return_value=cursor) as mock_query:
+            stats_obj = statsdb.StatsDB()
+            found = stats_obj.lookup('applications', ['g1', 'g2'])
+            self.assertEqual(stats_obj.lookup('applications', []), {})
+        self.assertEqual(found, {'g1': {'guid': 'g1', 'name': 'one'}})
+        mock_query.assert_called_once_with(
+            "SELECT * FROM applications WHERE guid IN (%s, %s)", ('g1', 'g2'))
+
+    def testLookupColumns(self):
+        """
+        test a batch lookup of some columns always includes the GUID
+        """
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB.query",
+                   return_value=[('g1', 'one')]) as mock_query:
+            stats_obj = statsdb.StatsDB()
+            found = stats_obj.lookup('applications', ['g1'], columns=['name'])
+        self.assertEqual(found, {'g1': {'guid': 'g1', 'name': 'one'}})
+        self.assertEqual(mock_query.call_args[0][0],
+                         "SELECT guid, name FROM applications WHERE guid IN (%s)")
+
+    def testExistingGuids(self):
+        """
+        test the chunked IN (...) membership query
+        """
+        guids = ['g{}'.format(i) for i in range(2500)]
+        with patch("statsdb.StatsDB.__init__", return_value=None), \
+             patch("statsdb.StatsDB.query",
+                   side_effect=[[('g1',)], [], [('g2001',)]]) as mock_query:
+            stats_obj = statsdb.StatsDB()
+            found = stats_obj.existing_guids('applications', guids)
+        self.assertEqual(found, {'g1', 'g2001'})
+        self.assertEqual(mock_query.call_count, 3)
+        sql, args = mock_query.call_args_list[2][0]
+        self.assertEqual(args, tuple(guids[2000:]))
+        self.assertEqual(sql.count('%s'), 500)
+
+
 class TestStatsStatic(unittest.TestCase):
     """
     Test StatsDB static function(s)
@@ -221,3 +662,45 @@ class TestStatsStatic(unittest.TestCase):
         row = ["val1", "val2", "val3"]
         rtn = statsdb.StatsDB.row_to_dict(row, col)
         self.assertEqual(rtn, {})
+
+    def testInsertMany(self):
+        """
+        Test batched multi-row inserts
+        """
+        cursor = MagicMock()
+        rows = [(i, 'g{}'.format(i)) for i in range(5)]
+        count = statsdb.StatsDB.insert_many(cursor, 'tbl', ['a', 'b'],
+                                            iter(rows), batch_size=2)
+        self.assertEqual(count, 5)
+        sql = "INSERT INTO tbl (a, b) VALUES (%s, %s)"
+        cursor.executemany.assert_has_calls([call(sql, rows[0:2]),
+                                             call(sql, rows[2:4]),
+                                             call(sql, rows[4:])])
+
+    def testHexRanges(self):
+        """
+        Test keyspace partitioning
+        """
+        self.assertEqual(statsdb.hex_ranges(1), [(None, None)])
+        self.assertEqual(statsdb.hex_ranges(4), [(None, '4'), ('4', '8'),
+                                                 ('8', 'c'), ('c', None)])
+        ranges = statsdb.hex_ranges(64)
+        self.assertEqual(len(ranges), 64)
+        self.assertEqual(ranges[1], ('04', '08'))
+        self.assertEqual(len(statsdb.hex_ranges(1000)), 256)
+        self.assertEqual([upper for _, upper in statsdb.hex_ranges(5)],
+                         ['3', '6', '9', 'c', None])
+        self.assertEqual(len(statsdb.hex_ranges(20)), 20)
+
+    def testRangeSql(self):
+        """
+        Test the per-range query
+        """
+        sql, args = statsdb.StatsDB.range_sql('apps', 'guid', '4', '8')
+        self.assertEqual(sql, "SELECT DISTINCT guid FROM apps "
+                              "WHERE guid >= %s AND guid < %s ORDER BY guid")
+        self.assertEqual(args, ('4', '8'))
+        sql, args = statsdb.StatsDB.range_sql('apps', 'guid', None, '4')
+        self.assertEqual(sql, "SELECT DISTINCT guid FROM apps "
+                              "WHERE guid < %s ORDER BY guid")
+        self.assertEqual(args, ('4',))